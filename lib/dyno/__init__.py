@@ -1,4 +1,9 @@
 from .backtest import Backtest, Ensemble
 from .strategy import Strategy
+from . import events
 from . import exchange
 from . import helpers
+from . import instrumentation
+from . import spark
+from . import ticks
+from . import venues
@@ -1,13 +1,230 @@
+import array
+import copy
 import functools
-from statistics import mean, stdev
+import itertools
+import multiprocessing
+import os
+
+import numpy as np
+
+from .instrumentation import Instrumentation, InstrumentedStage
+
+
+class ResultsColumns:
+    """ Collects the pipeline outputs needed by Results into typed columns in a
+    single pass. Timestamps are stored as int64 and prices, amounts and fees as
+    float64. Events that are not needed are only used for the first/last event
+    timestamps.
+
+    - positions: long_executed / short_executed events
+    - fills: bid_fill / ask_fill events (a bid fill sells, an ask fill buys)
+    - mid market prices: mid_market_price events, unless mid_prices is False
+
+    Columns collected from different parts of the outputs (e.g. spark partitions)
+    can be merged, in any order, into the columns of all of the outputs.
+    """
+    LONG = 1
+    SHORT = -1
+
+    # the names of the array.array columns
+    COLUMNS = ("position_ts", "position_side",
+               "fill_ts", "fill_position_ts", "fill_market_id", "fill_side",
+               "fill_price", "fill_amount", "fill_fee",
+               "mid_ts", "mid_price")
+
+    def __init__(self, mid_prices=True):
+        self.mid_prices = mid_prices
+
+        # positions
+        self.position_ts = array.array("q")
+        self.position_side = array.array("b")
+
+        # fills
+        self.fill_ts = array.array("q")
+        self.fill_position_ts = array.array("q")
+        self.fill_market_id = array.array("q")
+        self.fill_side = array.array("b")
+        self.fill_price = array.array("d")
+        self.fill_amount = array.array("d")
+        self.fill_fee = array.array("d")
+
+        # mid market prices
+        self.mid_ts = array.array("q")
+        self.mid_price = array.array("d")
+
+        # first and last event timestamps
+        self.first_ts = None
+        self.last_ts = None
+
+    def collect(self, events):
+        """ Add an iterable of (event_name, unix_ts_ns, values) events to the
+        columns. Returns self.
+        """
+        # bind the appends once rather than looking them up for every event
+        position_ts = self.position_ts.append
+        position_side = self.position_side.append
+        fill_ts = self.fill_ts.append
+        fill_position_ts = self.fill_position_ts.append
+        fill_market_id = self.fill_market_id.append
+        fill_side = self.fill_side.append
+        fill_price = self.fill_price.append
+        fill_amount = self.fill_amount.append
+        fill_fee = self.fill_fee.append
+        mid_ts = self.mid_ts.append
+        mid_price = self.mid_price.append
+
+        first_ts, last_ts = self.first_ts, self.last_ts
+        collect_mid_prices = self.mid_prices
+
+        for event_name, unix_ts_ns, values in events:
+            if first_ts is None or unix_ts_ns < first_ts:
+                first_ts = unix_ts_ns
+            if last_ts is None or unix_ts_ns > last_ts:
+                last_ts = unix_ts_ns
+
+            if event_name == "mid_market_price":
+                if collect_mid_prices:
+                    mid_ts(unix_ts_ns)
+                    mid_price(values["mid_market_price"])
+
+            elif event_name == "bid_fill" or event_name == "ask_fill":
+                fill_ts(unix_ts_ns)
+                fill_position_ts(values["position_ts"])
+                fill_market_id(values["market_id"])
+                fill_side(ResultsColumns.SHORT if event_name == "bid_fill"
+                          else ResultsColumns.LONG)
+                fill_price(values.get("fill_price", values["price"]))
+                fill_amount(values["amount"])
+                fill_fee(values["fee"])
+
+            elif event_name == "long_executed":
+                position_ts(values["position_ts"])
+                position_side(ResultsColumns.LONG)
+
+            elif event_name == "short_executed":
+                position_ts(values["position_ts"])
+                position_side(ResultsColumns.SHORT)
+
+        self.first_ts, self.last_ts = first_ts, last_ts
+        return self
+
+    def merge(self, other):
+        """ Add the columns of another ResultsColumns to these columns. Returns self.
+        """
+        for name in ResultsColumns.COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+        if other.first_ts is not None:
+            if self.first_ts is None or other.first_ts < self.first_ts:
+                self.first_ts = other.first_ts
+            if self.last_ts is None or other.last_ts > self.last_ts:
+                self.last_ts = other.last_ts
+
+        return self
+
+    @staticmethod
+    def collect_rdd(rdd, mid_prices=False, persist=False):
+        """ Collect the columns of an RDD of per event lists of outputs in one
+        distributed pass: every partition collects its own columns and the columns
+        are merged in a tree, so no outputs are cached and only the columns reach the
+        driver. Returns the merged columns, or (merged columns, per partition columns
+        RDD) if persist is True, in which case only the per partition trade and fill
+        columns are kept (persisted) for later use.
+
+        The merged columns are held by the driver. Fills and positions grow with the
+        number of trades but mid market prices grow with the number of ticks, so they
+        are left out unless mid_prices is True, and cannot be persisted.
+        """
+        columns = rdd.mapPartitions(lambda partition: [
+            ResultsColumns(mid_prices).collect(
+                event for events in partition for event in events)
+        ])
+
+        return ResultsColumns.aggregate(columns, mid_prices, persist)
+
+    @staticmethod
+    def aggregate(columns, mid_prices=False, persist=False):
+        """ Merge an RDD of ResultsColumns (e.g. one per partition) in a tree. See
+        collect_rdd.
+        """
+        if persist and mid_prices:
+            raise Exception("only trade and fill columns are persisted: "
+                            "mid_prices must be False")
+
+        if persist:
+            columns = columns.persist()
+
+        merged = columns.treeAggregate(ResultsColumns(mid_prices),
+                                       ResultsColumns.merge,
+                                       ResultsColumns.merge)
+
+        return (merged, columns) if persist else merged
+
+    @staticmethod
+    def as_array(column, dtype):
+        """ View an array.array column as a numpy array without copying.
+        """
+        return np.frombuffer(column, dtype=dtype) if len(column) > 0 \
+            else np.empty(0, dtype=dtype)
+
+
+# one row per position, in chronological order
+TRADES_DTYPE = np.dtype([
+    ("position_ts", np.int64),
+    ("side", np.int8),
+    ("entry_price", np.float64),
+    ("exit_price", np.float64),
+    ("entry_amount", np.float64),
+    ("exit_amount", np.float64),
+    ("fees", np.float64),
+    ("closed", np.bool_),
+    ("returns", np.float64),
+    ("pnl", np.float64)
+])
+
+
+def _moments(xs):
+    """ Return the mean, sample standard deviation, skew and excess kurtosis of a
+    numpy array. Undefined moments are nan.
+    """
+    if len(xs) == 0:
+        return np.nan, np.nan, np.nan, np.nan
+
+    avg = xs.mean()
+    deviations = xs - avg
+
+    # population central moments for skew and kurtosis
+    m2 = np.mean(deviations ** 2)
+    m3 = np.mean(deviations ** 3)
+    m4 = np.mean(deviations ** 4)
+
+    std = xs.std(ddof=1) if len(xs) > 1 else np.nan
+    skew = m3 / m2 ** 1.5 if m2 > 0 else np.nan
+    kurt = m4 / m2 ** 2 - 3 if m2 > 0 else np.nan
+
+    return avg, std, skew, kurt
+
+
+def _describe(xs):
+    """ Return the average, minimum and maximum of a numpy array, nan if empty.
+    """
+    if len(xs) == 0:
+        return np.nan, np.nan, np.nan
+    else:
+        return xs.mean(), xs.min(), xs.max()
 
 
 class Results:
     """ Captures the start and end timestamps of the backtest as well as all
-    of the outputs from the pipeline. Implements a __str__ method so the backtest
+    of the outputs from the pipeline (an iterable of events, an RDD when executed
+    on spark, or already collected ResultsColumns). Implements a __str__ method so the backtest
     report can be printed. Also provides plot methods for visualising key results
     using the chosen charting backend.
 
+    The outputs are read once and the fills, positions, mid market prices and fees
+    are kept as numpy columns (see ResultsColumns). All statistics are vectorized
+    reductions over these columns.
+
     ### EXAMPLE REPORT ###
     * positions
     - total: x
@@ -50,8 +267,125 @@ class Results:
     - max: x
     ### EXAMPLE REPORT ###
     """
-    def __init__(self, rdd):
-        self._rdd = rdd
+    def __init__(self, outputs, mid_prices=None):
+        if isinstance(outputs, ResultsColumns):
+            # already collected e.g. merged from many partitions
+            columns = outputs
+
+        elif hasattr(outputs, "toLocalIterator"):
+            # an RDD of per-event lists of outputs: no mid prices by default
+            columns = ResultsColumns.collect_rdd(outputs, bool(mid_prices))
+
+        else:
+            columns = ResultsColumns(mid_prices is not False).collect(outputs)
+
+        # event timings
+        self._first_ts = columns.first_ts
+        self._last_ts = columns.last_ts
+
+        # merged columns are not in time order: sort each group of columns by its
+        # timestamps (stable, so events with equal timestamps keep their order)
+        as_array = ResultsColumns.as_array
+
+        # fills
+        self._fill_ts, self._fill_position_ts, self._fill_market_id, \
+            self._fill_side, self._fill_price, self._fill_amount, \
+            self._fill_fee = Results.sort_by_ts(
+                as_array(columns.fill_ts, np.int64),
+                as_array(columns.fill_position_ts, np.int64),
+                as_array(columns.fill_market_id, np.int64),
+                as_array(columns.fill_side, np.int8),
+                as_array(columns.fill_price, np.float64),
+                as_array(columns.fill_amount, np.float64),
+                as_array(columns.fill_fee, np.float64))
+
+        # mid market prices
+        self._mid_ts, self._mid_price = Results.sort_by_ts(
+            as_array(columns.mid_ts, np.int64),
+            as_array(columns.mid_price, np.float64))
+
+        # positions
+        self._position_ts, self._position_side = Results.sort_by_ts(
+            as_array(columns.position_ts, np.int64),
+            as_array(columns.position_side, np.int8))
+
+        # one row per position
+        self._trades = Results.build_trades(
+            self._position_ts,
+            self._position_side,
+            self._fill_position_ts,
+            self._fill_side,
+            self._fill_price,
+            self._fill_amount,
+            self._fill_fee)
+
+    @staticmethod
+    def sort_by_ts(ts, *columns):
+        """ Stable sort a timestamp column and the columns that go with it. Returns
+        the sorted columns, timestamps first. Columns already in time order are
+        returned as they are.
+        """
+        if len(ts) < 2 or np.all(ts[1:] >= ts[:-1]):
+            return (ts, *columns)
+
+        order = np.argsort(ts, kind="stable")
+        return (ts[order], *[column[order] for column in columns])
+
+    @staticmethod
+    def build_trades(position_ts, position_side, fill_position_ts, fill_side,
+                     fill_price, fill_amount, fill_fee):
+        """ Join fills onto the positions they belong to and return a TRADES_DTYPE
+        array. A fill in the same direction as its position is an entry fill, any
+        other fill is an exit fill. Entry/exit prices are the amount weighted
+        average fill prices. A position is closed once it has exit fills, and its
+        return is measured from the entry price to the exit price.
+        """
+        # sort positions by the timestamp that identifies them
+        order = np.argsort(position_ts, kind="stable")
+        position_ts = position_ts[order]
+        position_side = position_side[order]
+        n = len(position_ts)
+
+        # find each fill's position, dropping fills with unknown positions
+        index = np.searchsorted(position_ts, fill_position_ts)
+        known = index < n
+        known[known] = position_ts[index[known]] == fill_position_ts[known]
+        index = index[known]
+
+        is_entry = fill_side[known] == position_side[index]
+        is_exit = ~is_entry
+        price = fill_price[known]
+        amount = fill_amount[known]
+
+        # per position sums of fill amounts, values and fees
+        sums = lambda weights, mask: \
+            np.bincount(index[mask], weights[mask], minlength=n)
+
+        entry_amount = sums(amount, is_entry)
+        exit_amount = sums(amount, is_exit)
+        entry_value = sums(price * amount, is_entry)
+        exit_value = sums(price * amount, is_exit)
+        fees = np.bincount(index, fill_fee[known], minlength=n)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entry_price = entry_value / entry_amount
+            exit_price = exit_value / exit_amount
+            returns = position_side * (exit_price - entry_price) / entry_price
+
+        closed = exit_amount > 0
+
+        trades = np.empty(n, dtype=TRADES_DTYPE)
+        trades["position_ts"] = position_ts
+        trades["side"] = position_side
+        trades["entry_price"] = entry_price
+        trades["exit_price"] = exit_price
+        trades["entry_amount"] = entry_amount
+        trades["exit_amount"] = exit_amount
+        trades["fees"] = fees
+        trades["closed"] = closed
+        trades["returns"] = np.where(closed, returns, np.nan)
+        trades["pnl"] = np.where(closed, returns * exit_amount - fees, np.nan)
+        return trades
 
     def __str__(self):
         return f"""
@@ -79,19 +413,24 @@ class Results:
 
     def trades(self):
         """ A list of all trades/positions made (longs + shorts) in
-        chronological order.
+        chronological order. Returned as a numpy array of TRADES_DTYPE records.
         """
-        return []
+        return self._trades
 
     def longs(self):
         """ A list of all long positions in chronological order.
         """
-        return []
+        return self._trades[self._trades["side"] == ResultsColumns.LONG]
 
     def shorts(self):
         """ A list of all short positions in chronological order.
         """
-        return []
+        return self._trades[self._trades["side"] == ResultsColumns.SHORT]
+
+    def closed_trades(self):
+        """ A list of all closed trades in chronological order.
+        """
+        return self._trades[self._trades["closed"]]
 
     def trades_summary(self):
         return f"""
@@ -103,37 +442,47 @@ class Results:
     def net_gain(self):
         """ Calculates the total positive/negative gain.
         """
-        return 0
+        return self.closed_trades()["pnl"].sum()
 
     def net_gain_pct(self):
         """ Calculates the net gain as a percentage.
         """
-        return 0
+        invested = self.closed_trades()["exit_amount"].sum()
+        return self.net_gain() / invested if invested > 0 else 0
 
     def win_rate(self):
         """ Calculate win rate as ratio.
         """
-        return 0
+        pnl = self.closed_trades()["pnl"]
+        losses = np.count_nonzero(pnl < 0)
+        return np.count_nonzero(pnl > 0) / losses if losses > 0 else np.nan
 
     def win_rate_pct(self):
         """ Calculate win rate as percentage.
         """
-        return 0
+        pnl = self.closed_trades()["pnl"]
+        return np.count_nonzero(pnl > 0) / len(pnl) if len(pnl) > 0 else 0
 
     def sharpe_value(self):
         """ Calculate sharpe value.
         """
-        return 0
+        avg, std, _, _ = _moments(self.returns())
+        return avg / std if std > 0 else np.nan
 
     def max_drawdown(self):
         """ Calculate max drawdown.
         """
-        return 0
+        # cumulative profit and loss, starting from zero
+        equity = np.concatenate(([0.0], np.cumsum(self.closed_trades()["pnl"])))
+        return np.max(np.maximum.accumulate(equity) - equity)
 
     def max_drawdown_pct(self):
         """ Calculate max drawdown as percentage.
         """
-        return 0
+        # compounded returns, starting from one
+        equity = np.concatenate(([1.0], np.cumprod(1 + self.returns())))
+        peak = np.maximum.accumulate(equity)
+        return np.max((peak - equity) / peak)
 
     def performance_summary(self):
         return f"""
@@ -147,10 +496,17 @@ class Results:
         """ Return timestamps of the first and last events. Also calculate difference
         between them i.e. the timeframe of the data used.
         """
+        if self._first_ts is None:
+            return {
+                "first": 0,
+                "last": 0,
+                "timeframe": 0
+            }
+
         return {
-            "first": 0,
-            "last": 0,
-            "timeframe": 0
+            "first": self._first_ts,
+            "last": self._last_ts,
+            "timeframe": self._last_ts - self._first_ts
         }
 
     def timings_summary(self):
@@ -164,60 +520,118 @@ class Results:
     def returns(self):
         """ Return list of all standard/linear returns.
         """
-        return []
+        return self.closed_trades()["returns"]
 
     def log_returns(self):
         """ Return list of all log returns.
         """
-        return []
+        return np.log1p(self.returns())
 
     def returns_summary(self):
+        avg, std, skew, kurt = _moments(self.returns())
         return f"""
-        - avg: ?
-        - std: ?
-        - skew: ?
-        - kurt: ?
+        - avg: {avg}
+        - std: {std}
+        - skew: {skew}
+        - kurt: {kurt}
         """
 
+    def mid_market_prices(self):
+        """ Return the timestamps and mid market prices of all mid_market_price
+        events as two numpy arrays.
+        """
+        return self._mid_ts, self._mid_price
+
     def winning_trades(self):
         """ Returns list of all winning trades in chronological order.
         """
-        return []
+        trades = self.closed_trades()
+        return trades[trades["pnl"] > 0]
 
     def wins_summary(self):
+        pnl = self.winning_trades()["pnl"]
+        avg, low, high = _describe(pnl)
         return f"""
-        - total: ?
-        - avg: ?
-        - min: ?
-        - max: ?
+        - total: {len(pnl)}
+        - avg: {avg}
+        - min: {low}
+        - max: {high}
         """
 
     def losing_trades(self):
         """ Returns list of all losing trades in chronological order.
         """
-        return []
+        trades = self.closed_trades()
+        return trades[trades["pnl"] < 0]
 
     def losses_summary(self):
+        pnl = self.losing_trades()["pnl"]
+        avg, low, high = _describe(pnl)
         return f"""
-        - total: ?
-        - avg: ?
-        - min: ?
-        - max: ?
+        - total: {len(pnl)}
+        - avg: {avg}
+        - min: {low}
+        - max: {high}
         """
 
     def all_fees_incurred(self):
         """ Return list of all fees paid in chronological order.
         """
-        return []
+        return self._fill_fee
+
+    def fees_under(self, fee_schedule, maker=False):
+        """ Return the fees every fill would have incurred under another fee schedule
+        (see exchange.py), computed in bulk. Fills are charged taker fees unless
+        maker is True. Per-market fees of the schedule apply to each fill's market.
+        """
+        # the fills are in time order, as fee schedules expect
+        return fee_schedule.fees(
+            self._fill_ts,
+            self._fill_amount,
+            maker=maker,
+            market_ids=self._fill_market_id)
+
+    def trades_under(self, fee_schedule, maker=False):
+        """ Return the trades recalculated with the fees of another fee schedule
+        e.g. to check how sensitive the results are to trading costs.
+        """
+        return Results.build_trades(
+            self._position_ts,
+            self._position_side,
+            self._fill_position_ts,
+            self._fill_side,
+            self._fill_price,
+            self._fill_amount,
+            self.fees_under(fee_schedule, maker))
 
     def fees_summary(self):
         fees = self.all_fees_incurred()
+        avg, low, high = _describe(fees)
         return f"""
-        - total: {sum(fees)}
-        - avg: {mean(fees)}
-        - min: {min(fees)}
-        - max: {max(fees)}
+        - total: {fees.sum()}
+        - avg: {avg}
+        - min: {low}
+        - max: {high}
+        """
+
+    def summary(self):
+        """ Return the headline statistics as a dictionary of plain numbers e.g. to
+        compare many backtests (see Ensemble).
         """
+        return {
+            "trades": len(self.trades()),
+            "longs": len(self.longs()),
+            "shorts": len(self.shorts()),
+            "closed_trades": len(self.closed_trades()),
+            "net_gain": float(self.net_gain()),
+            "net_gain_pct": float(self.net_gain_pct()),
+            "win_rate": float(self.win_rate()),
+            "win_rate_pct": float(self.win_rate_pct()),
+            "sharpe_value": float(self.sharpe_value()),
+            "max_drawdown": float(self.max_drawdown()),
+            "max_drawdown_pct": float(self.max_drawdown_pct()),
+            "fees": float(self.all_fees_incurred().sum())
+        }
 
     def plot(self):
         """ ...
@@ -262,6 +676,7 @@ class Pipeline:
     """
     def __init__(self, *stages):
         self._stages = stages
+        self._instrumentation = None
 
     def __call__(self, events):
         """ Send events down the pipeline.
@@ -273,39 +688,277 @@ class Pipeline:
         do_stage = lambda acc, stage: stage(acc)
         return foldl(do_stage, events, self._stages)
 
+    def stream(self, events):
+        """ Send events down the pipeline lazily, one input event at a time. Returns
+        a generator of output events.
+
+        1) read the next input event from the (possibly lazy) events iterable
+        2) fold over the stages with a batch holding just that event
+        3) yield that event's outputs before reading the next input event
+
+        Each input event is fully processed by every stage before the next one is
+        read, so stages that read shared state (e.g. the exchanges' order books)
+        see exactly what they would if the pipeline were called once per event,
+        and only one event's intermediate outputs are held in memory at a time.
+        Note: chaining the stages as generators instead would interleave the
+        stages within a single event and change the results.
+        """
+        stages = self._stages
+
+        for event in events:
+            outputs = [event]
+
+            for stage in stages:
+                outputs = stage(outputs)
+
+            yield from outputs
+
+    def enable_instrumentation(self, instrumentation=None):
+        """ Start counting and timing the events of every stage into one
+        Instrumentation object (a new one by default), which is returned. Stages are
+        named by their position and class e.g. "0 DataStrategy". Strategies count
+        each event name separately, other callables count whole batches under the
+        event name "*" (see instrumentation.py).
+
+        When instrumentation is off (the default) the pipeline runs as it does
+        without it.
+        """
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+
+        stages = []
+
+        for index, stage in enumerate(self.get_stages()):
+            stage_name = f"{index} {type(stage).__name__}"
+
+            if hasattr(stage, "enable_instrumentation"):
+                stage.enable_instrumentation(instrumentation, stage_name)
+            else:
+                stage = InstrumentedStage(stage, instrumentation, stage_name)
+
+            stages.append(stage)
+
+        self._stages = tuple(stages)
+        self._instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        stages = self.get_stages()
+
+        for stage in stages:
+            if hasattr(stage, "disable_instrumentation"):
+                stage.disable_instrumentation()
+
+        self._stages = stages
+        self._instrumentation = None
+
+    def get_instrumentation(self):
+        """ Return the Instrumentation object, or None when instrumentation is off.
+        """
+        return self._instrumentation
+
+    def get_stages(self):
+        """ Return the stages, without the wrappers added by enable_instrumentation.
+        """
+        return tuple(stage.unwrap() if isinstance(stage, InstrumentedStage) else stage
+                     for stage in self._stages)
+
+    def get_exchanges(self):
+        """ Return the exchange objects used by the stages, without duplicates, in the
+        order they are first found.
+        """
+        exchanges = {}
+
+        for stage in self._stages:
+            for exchange in getattr(stage, "_exchanges", {}).values():
+                exchanges.setdefault(id(exchange), exchange)
+
+        return list(exchanges.values())
+
+    def snapshot(self):
+        """ Return a copy of the state of every stage and exchange e.g. to checkpoint
+        the pipeline after a warm-up period. Everything is copied in one go so that
+        objects shared between stages or exchanges are still shared when restored.
+        """
+        return copy.deepcopy((
+            [exchange.get_state() for exchange in self.get_exchanges()],
+            [stage.get_state() for stage in self.get_stages()]))
+
+    def restore(self, snapshot):
+        """ Go back to the state of a snapshot, e.g. to run many variations from the
+        same checkpoint. The snapshot itself is not changed so it can be restored any
+        number of times. The stage and exchange objects are updated in place.
+        """
+        exchange_states, stage_states = copy.deepcopy(snapshot)
+
+        for exchange, state in zip(self.get_exchanges(), exchange_states):
+            exchange.set_state(state)
+
+        for stage, state in zip(self.get_stages(), stage_states):
+            stage.set_state(state)
+
 
 class Backtest:
     """ A backtest has an events source and a pipeline object. Executing the pipeline
     will consume events from the events source, feeding each event into the pipeline.
     For each event, the output of the pipeline (which is a sequence of stages) is
     stored in one long "outputs" list.
+
+    The events source is either:
+    - a distributed source implementing pipe(pipeline), e.g. wrapping a spark data
+      frame, that returns an RDD of pipeline outputs (needs the optional pyspark
+      dependency: pip install dyno[spark]). A source that also implements
+      pipe_columns(pipeline, mid_prices) returns an RDD of ResultsColumns instead,
+      collected where the outputs are produced (see ArrowSparkEvents)
+    - any other python iterable of (event_name, unix_ts_ns, values) tuples, which
+      is replayed in-process without spark
+
+    The outputs are not kept: they are collected into ResultsColumns as they are
+    produced (on spark, per partition, then merged). mid_prices sets whether the mid
+    market price columns, which are only needed for plotting, are kept. By default
+    they are kept by local backtests but not by distributed ones, where they would
+    bring one price per tick back to the driver. persist=True keeps (persists) the
+    per partition trade and fill columns of a distributed backtest, see
+    get_persisted().
     """
-    def __init__(self, events, pipeline):
+    def __init__(self, events, pipeline, mid_prices=None, persist=False):
         self._events = events
         self._pipeline = pipeline
+        self._mid_prices = mid_prices
+        self._persist = persist
+        self._persisted = None
 
     def execute(self):
-        rdd = self._events.pipe(self._pipeline).cache()
-        return Results(rdd)
-        
+        if hasattr(self._events, "pipe"):
+            return self.execute_distributed()
+        else:
+            return self.execute_locally()
+
+    def execute_distributed(self):
+        """ Let the events source pipe its events through the pipeline e.g. on a
+        spark cluster.
+        """
+        mid_prices = bool(self._mid_prices)
+
+        if hasattr(self._events, "pipe_columns"):
+            # the source collects each partition's columns itself
+            rdd = self._events.pipe_columns(self._pipeline, mid_prices)
+            collect = ResultsColumns.aggregate
+        else:
+            rdd = self._events.pipe(self._pipeline)
+            collect = ResultsColumns.collect_rdd
+
+        if self._persist:
+            columns, self._persisted = collect(rdd, mid_prices, persist=True)
+        else:
+            columns = collect(rdd, mid_prices)
+
+        return Results(columns)
+
+    def execute_locally(self):
+        """ Stream the events through the pipeline in this process, one event at a
+        time in the order they are produced by the events iterable.
+        """
+        outputs = self._pipeline.stream(self._events)
+        return Results(outputs, self._mid_prices)
+
+    def get_persisted(self):
+        """ Return the persisted RDD of per partition ResultsColumns (trades and fills
+        only) of the last distributed execution, or None. Call unpersist() on it when
+        done.
+        """
+        return self._persisted
+
+
+# the events and pipeline builder of an Ensemble's worker process,
+# set once per worker by the pool's initializer
+_worker_events = None
+_worker_build_pipeline = None
+
+
+def _init_worker(events, build_pipeline):
+    global _worker_events, _worker_build_pipeline
+    _worker_events = events
+    _worker_build_pipeline = build_pipeline
+
+
+def _run_worker(params):
+    return Ensemble.run(_worker_events, _worker_build_pipeline, params)
+
 
 class Ensemble:
-    """ ...
+    """ An ensemble runs the same backtest for every point of a parameter grid, on a
+    pool of worker processes, and returns a compact summary of each backtest's
+    results (see Results.summary).
+
+    - events: a re-iterable events source e.g. a list of events, a TickFile or a
+      MergedEvents. It is sent to each worker once, when the worker starts, and
+      reused by every backtest that worker runs.
+    - build_pipeline: called with a point's parameters as keyword arguments, returns
+      a new Pipeline with fresh exchanges e.g. functools.partial of
+      helpers.build_basic_signal_pipeline. It must be picklable, so it has to be
+      defined at the top level of a module.
+    - grid: a dictionary mapping parameter names to lists of values (every
+      combination is run) or a list of parameter dictionaries.
+    - processes: the number of worker processes, default one per cpu. With one
+      process the backtests run in this process, without a pool.
+
+    Results are returned in the grid's order whatever order the workers finish in.
+    If build_pipeline enables the pipeline's instrumentation, each summary also has
+    an "instrumentation" dictionary.
     """
-    def __init__(self):
-        pass
-
-    def execute(self):
-        """ ...
+    def __init__(self, events, build_pipeline, grid, processes=None):
+        self._events = events
+        self._build_pipeline = build_pipeline
+        self._grid = Ensemble.parameter_grid(grid)
+        self._processes = os.cpu_count() if processes is None else processes
+
+    @staticmethod
+    def parameter_grid(grid):
+        """ Return the list of parameter dictionaries for a grid. A dictionary of
+        lists is expanded into every combination, in order (the last parameter
+        changes fastest).
+        """
+        if isinstance(grid, dict):
+            names = list(grid)
+            return [dict(zip(names, values))
+                    for values in itertools.product(*grid.values())]
+        else:
+            return [dict(params) for params in grid]
+
+    @staticmethod
+    def run(events, build_pipeline, params):
+        """ Run one backtest and return its results summary.
         """
+        pipeline = build_pipeline(**params)
+        summary = Backtest(events, pipeline).execute().summary()
 
-        # multiple backtests at the same time
-        # ...
+        # the counters of an instrumented pipeline are sent back with the summary
+        # (see Instrumentation.merge_all)
+        instrumentation = pipeline.get_instrumentation()
 
-        # how to merge the results together?
-        # ...
+        if instrumentation is not None:
+            summary["instrumentation"] = instrumentation.to_dict()
 
-        # how to extract summary statistics from all results?
-        # ...
+        return summary
 
-        pass
+    def execute(self):
+        """ Run every backtest. Returns a list of (parameters, summary) pairs in the
+        grid's order.
+        """
+        if self._processes == 1 or len(self._grid) <= 1:
+            summaries = [Ensemble.run(self._events, self._build_pipeline, params)
+                         for params in self._grid]
+
+        else:
+            processes = min(self._processes, len(self._grid))
+
+            with multiprocessing.Pool(processes,
+                                      initializer=_init_worker,
+                                      initargs=(self._events,
+                                                self._build_pipeline)) as pool:
+                # one backtest per task so that slow backtests do not hold up
+                # the others, imap returns them in order
+                summaries = list(pool.imap(_run_worker, self._grid, chunksize=1))
+
+        return list(zip(self._grid, summaries))
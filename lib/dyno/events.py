@@ -0,0 +1,137 @@
+import sys
+from collections.abc import Mapping
+from typing import NamedTuple
+
+
+# interned names of the built-in events
+BEST_BID = sys.intern("best_bid")
+BEST_ASK = sys.intern("best_ask")
+MID_MARKET_PRICE = sys.intern("mid_market_price")
+MID_MARKET_PRICE_RETURNS = sys.intern("mid_market_price_returns")
+BID_FILL = sys.intern("bid_fill")
+ASK_FILL = sys.intern("ask_fill")
+
+
+class Event(NamedTuple):
+    """ An event is a three-tuple: (event_name, unix_ts_ns, values). Event is a plain
+    tuple so it can be used anywhere a tuple event is expected.
+    """
+    event_name: str
+    unix_ts_ns: int
+    values: object
+
+
+class Values(Mapping):
+    """ Base class for compact event values. Subclasses list their fields in
+    __slots__ so instances have no per-instance dictionary.
+
+    Compatibility: values can be read like a dictionary (values["price"],
+    values.get("price"), {**values}, "price" in values, ...) so strategies written
+    for dictionary values keep working. Values compare equal to a dictionary with
+    the same keys and values.
+    """
+    __slots__ = ()
+
+    # the field names, set for each subclass
+    _fields = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)})"
+
+
+class Quote(Values):
+    """ Values of best_bid and best_ask events.
+    """
+    __slots__ = ("exchange_name", "market_id", "price", "liquidity")
+
+    def __init__(self, exchange_name, market_id, price, liquidity):
+        self.exchange_name = exchange_name
+        self.market_id = market_id
+        self.price = price
+        self.liquidity = liquidity
+
+
+class MidMarketPrice(Values):
+    """ Values of mid_market_price events.
+    """
+    __slots__ = ("market_id", "exchange_name", "mid_market_price")
+
+    def __init__(self, market_id, exchange_name, mid_market_price):
+        self.market_id = market_id
+        self.exchange_name = exchange_name
+        self.mid_market_price = mid_market_price
+
+
+class MidMarketPriceReturns(Values):
+    """ Values of mid_market_price_returns events: linear and log returns.
+    """
+    __slots__ = ("market_id", "exchange_name", "lin", "log")
+
+    def __init__(self, market_id, exchange_name, lin, log):
+        self.market_id = market_id
+        self.exchange_name = exchange_name
+        self.lin = lin
+        self.log = log
+
+
+class Fill(Values):
+    """ Values of bid_fill and ask_fill events. A fill refers to the order it filled
+    instead of copying it: keys that are not fields of the fill itself are looked up
+    in the order. The order's remaining amount is copied because the order changes
+    as it is filled.
+    """
+    __slots__ = ("order", "amount", "fee", "fill_price", "remaining")
+
+    # the order is not exposed as a key
+    _own_keys = ("amount", "fee", "fill_price", "remaining")
+
+    def __init__(self, order, amount, fee, fill_price, remaining):
+        self.order = order
+        self.amount = amount
+        self.fee = fee
+        self.fill_price = fill_price
+        self.remaining = remaining
+
+    def __getitem__(self, key):
+        if key in self._own_keys:
+            return getattr(self, key)
+        else:
+            return self.order[key]
+
+    def __iter__(self):
+        own_keys = self._own_keys
+        yield from own_keys
+        yield from (key for key in self.order if key not in own_keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def best_bid(unix_ts_ns, exchange_name, market_id, price, liquidity):
+    """ Make a best_bid event with compact values.
+    """
+    return Event(BEST_BID, unix_ts_ns,
+                 Quote(exchange_name, market_id, price, liquidity))
+
+
+def best_ask(unix_ts_ns, exchange_name, market_id, price, liquidity):
+    """ Make a best_ask event with compact values.
+    """
+    return Event(BEST_ASK, unix_ts_ns,
+                 Quote(exchange_name, market_id, price, liquidity))
@@ -1,18 +1,192 @@
+import bisect
+import collections
+import copy
+import functools
+import weakref
+
+import numpy as np
+
+from . import venues
+
+
 class MakerTakerFeeSchedule:
     """ Fee schedule: calculates the maker / taker fees when executing a
     position on an exchange. Maker fees are charged for market makers i.e. when
     using limit orders. Taker fees are charged for market takers i.e. when using
     market orders.
+
+    Fees are a fraction of the trade size e.g. 0.001 is a 0.1% fee. A negative
+    maker fee is a rebate. Trade sizes can be numbers or numpy arrays.
     """
     def __init__(self, maker_pct, taker_pct):
         self._maker_pct = maker_pct
         self._taker_pct = taker_pct
 
-    def maker_fee(self, trade_size):
-        return 0
+    def __deepcopy__(self, memo):
+        # flat fees have no state so copies can share the schedule
+        return self
+
+    def maker_fee(self, trade_size, market_id=None, unix_ts_ns=None):
+        return trade_size * self._maker_pct
+
+    def taker_fee(self, trade_size, market_id=None, unix_ts_ns=None):
+        return trade_size * self._taker_pct
+
+    def record_volume(self, unix_ts_ns, trade_size):
+        """ Record a trade's size. Flat fees do not depend on volume.
+        """
+        pass
+
+    def fees(self, unix_ts_ns, trade_sizes, maker=False, market_ids=None):
+        """ Return the fees for numpy arrays of trade timestamps and sizes.
+        """
+        pct = self._maker_pct if maker else self._taker_pct
+        return np.asarray(trade_sizes, dtype=np.float64) * pct
+
+
+class TieredFeeSchedule:
+    """ Fee schedule with volume tiers: the maker / taker fees depend on the
+    account's trading volume over a rolling window (30 days by default). Tiers are
+    a list of (minimum volume, maker pct, taker pct) in ascending order of volume,
+    starting at zero. Negative maker fees are rebates.
+
+    Per-market overrides map a market id to a (maker pct, taker pct) pair that
+    replaces the tier's fees for that market. Trades on every market count towards
+    the volume.
+
+    The rolling volume is kept incrementally: record_volume appends the trade to a
+    queue and evicts the trades that fell out of the window, keeping a running
+    total. maker_fee / taker_fee also evict the trades that fell out of the window
+    by the trade's timestamp, so a quiet period drops the account's tier. The fees
+    method evaluates whole arrays of trades in one go using
+    cumulative sums instead.
+    """
+    WINDOW_NS = 30 * 24 * 60 * 60 * 1_000_000_000
+
+    def __init__(self, tiers, window_ns=WINDOW_NS, market_overrides=None):
+        tiers = sorted(tiers)
+
+        if len(tiers) == 0 or tiers[0][0] != 0:
+            raise Exception("the first fee tier must start at zero volume")
+
+        self._thresholds = [volume for volume, _, _ in tiers]
+        self._maker_pcts = np.array([maker for _, maker, _ in tiers])
+        self._taker_pcts = np.array([taker for _, _, taker in tiers])
+        self._window_ns = window_ns
+        self._market_overrides = dict(market_overrides or {})
+
+        # (unix_ts_ns, trade size) in the window and their total
+        self._trades = collections.deque()
+        self._volume = 0.0
+
+    def get_volume(self):
+        """ The volume traded in the current window.
+        """
+        return self._volume
+
+    def get_tier(self, volume=None):
+        """ Return the index of the tier for a volume (default: current volume).
+        """
+        volume = self._volume if volume is None else volume
+        return bisect.bisect_right(self._thresholds, volume) - 1
+
+    def record_volume(self, unix_ts_ns, trade_size):
+        """ Add a trade to the rolling volume. Trades must be recorded in time
+        order.
+        """
+        self.evict(unix_ts_ns)
+        self._trades.append((unix_ts_ns, trade_size))
+        self._volume += trade_size
+
+    def evict(self, unix_ts_ns):
+        """ Remove the trades that are out of the window at time unix_ts_ns.
+        """
+        trades = self._trades
+        cutoff = unix_ts_ns - self._window_ns
+
+        while trades and trades[0][0] <= cutoff:
+            _, size = trades.popleft()
+            self._volume -= size
+
+        # avoid rounding errors building up once the window is empty
+        if not trades:
+            self._volume = 0.0
+
+    def maker_fee(self, trade_size, market_id=None, unix_ts_ns=None):
+        """ The maker fee of a trade. Without the trade's timestamp the tier of the
+        last recorded trade's window is used.
+        """
+        override = self._market_overrides.get(market_id)
+
+        if override is not None:
+            return trade_size * override[0]
+
+        if unix_ts_ns is not None:
+            self.evict(unix_ts_ns)
+
+        return trade_size * self._maker_pcts[self.get_tier()]
+
+    def taker_fee(self, trade_size, market_id=None, unix_ts_ns=None):
+        """ The taker fee of a trade, see maker_fee.
+        """
+        override = self._market_overrides.get(market_id)
+
+        if override is not None:
+            return trade_size * override[1]
+
+        if unix_ts_ns is not None:
+            self.evict(unix_ts_ns)
+
+        return trade_size * self._taker_pcts[self.get_tier()]
+
+    def fees(self, unix_ts_ns, trade_sizes, maker=False, market_ids=None):
+        """ Return the fees for numpy arrays of trade timestamps and sizes (in time
+        order). The volume starts at zero i.e. the recorded volume is not used. Each
+        trade's tier is set by the volume of the trades before it in the window.
+        """
+        unix_ts_ns = np.asarray(unix_ts_ns, dtype=np.int64)
+        trade_sizes = np.asarray(trade_sizes, dtype=np.float64)
+
+        # rolling volume before each trade:
+        # the sum of trade sizes from the first trade in the window
+        totals = np.concatenate(([0.0], np.cumsum(trade_sizes)))
+        first = np.searchsorted(unix_ts_ns, unix_ts_ns - self._window_ns,
+                                side="right")
+        volume = totals[:-1] - totals[first]
+
+        # look up each trade's tier
+        tier = np.searchsorted(self._thresholds, volume, side="right") - 1
+        pct = (self._maker_pcts if maker else self._taker_pcts)[tier]
 
-    def taker_fee(self, trade_size):
-        return 0
+        # apply per-market overrides
+        if market_ids is not None and self._market_overrides:
+            market_ids = np.asarray(market_ids)
+
+            for market_id, (maker_pct, taker_pct) in \
+                    self._market_overrides.items():
+                pct = np.where(market_ids == market_id,
+                               maker_pct if maker else taker_pct,
+                               pct)
+
+        return trade_sizes * pct
+
+
+@functools.lru_cache(maxsize=None)
+def flat_fee_schedule(maker_pct, taker_pct):
+    """ Return a shared MakerTakerFeeSchedule. Flat fee schedules have no state so
+    one object per pair of fees is enough.
+    """
+    return MakerTakerFeeSchedule(maker_pct, taker_pct)
+
+
+def venue_fee_schedule(config):
+    """ Return the fee schedule for a VenueConfig. Tiered fee schedules track the
+    account's volume so every exchange object gets its own.
+    """
+    if config.fee_tiers:
+        return TieredFeeSchedule(config.fee_tiers)
+    else:
+        return flat_fee_schedule(config.maker_pct, config.taker_pct)
 
 
 class OrderBook:
@@ -98,13 +272,559 @@ class OrderBook:
             self.set_best_ask(price, liquidity)
 
 
+class DepthOrderBook:
+    """ Mimics a full depth (L2) order book. Each side is a set of price levels with
+    the liquidity available at that price. Supports the same methods as OrderBook
+    (where "best" means the top level) plus L2 snapshots, deltas and walking the
+    book to fill an amount across several levels.
+
+    Each side is stored as a dictionary mapping price -> liquidity plus a sorted list
+    of the prices' sort keys, ordered so that the best price is at the end of the
+    list. Looking up a level is O(log n) (bisect), reading or removing the best level
+    is O(1). Inserting or deleting other levels shifts the list with a memmove.
+
+    - bids: sort key is +price, best (highest) price last
+    - asks: sort key is -price, best (lowest) price last
+    - a side is "bids" or "asks"
+    """
+    SIDES = ("bids", "asks")
+
+    def __init__(self, bids=(), asks=()):
+        self._levels = {"bids": {}, "asks": {}}
+        self._keys = {"bids": [], "asks": []}
+        self.apply_snapshot(bids, asks)
+
+    @staticmethod
+    def sort_key(side, price):
+        if side == "bids":
+            return +price
+        elif side == "asks":
+            return -price
+        else:
+            raise Exception(f"unknown order book side: {side}")
+
+    def is_empty(self):
+        """ A book is empty if either of its sides has no levels.
+        """
+        return not self._keys["bids"] or not self._keys["asks"]
+
+    def set_level(self, side, price, liquidity):
+        """ Set the liquidity available at a price level. Zero liquidity deletes the
+        level. Raise exception if liquidity is negative.
+        """
+        if liquidity < 0:
+            raise Exception(f"{side} liquidity cannot be negative")
+
+        price, liquidity = float(price), float(liquidity)
+        levels, keys = self._levels[side], self._keys[side]
+        key = DepthOrderBook.sort_key(side, price)
+
+        if liquidity == 0:
+            # delete the level if it exists
+            if price in levels:
+                del levels[price]
+                del keys[bisect.bisect_left(keys, key)]
+
+        else:
+            # add the level if it does not exist
+            if price not in levels:
+                bisect.insort(keys, key)
+
+            levels[price] = liquidity
+
+    def apply_snapshot(self, bids, asks):
+        """ Replace both sides of the book with lists of (price, liquidity) levels.
+        """
+        self._levels = {"bids": {}, "asks": {}}
+        self._keys = {"bids": [], "asks": []}
+
+        for price, liquidity in bids:
+            self.set_level("bids", price, liquidity)
+
+        for price, liquidity in asks:
+            self.set_level("asks", price, liquidity)
+
+    def apply_delta(self, side, price, liquidity):
+        """ Update a single price level. Zero liquidity deletes the level.
+        """
+        self.set_level(side, price, liquidity)
+
+    def get_best(self, side):
+        """ Return the best price and its liquidity on a side, or (None, None) if
+        the side has no levels.
+        """
+        keys = self._keys[side]
+
+        if not keys:
+            return (None, None)
+
+        price = abs(keys[-1])
+        return (price, self._levels[side][price])
+
+    def get_levels(self, side, n=None):
+        """ Return up to n (default all) (price, liquidity) levels from a side,
+        best first.
+        """
+        keys, levels = self._keys[side], self._levels[side]
+        best_first = reversed(keys) if n is None else reversed(keys[-n:])
+        return [(abs(key), levels[abs(key)]) for key in best_first]
+
+    def walk(self, side, amount):
+        """ Walk a side of the book from the best level to fill "amount" (quoted in
+        the market's quote currency) without changing the book. Returns the volume
+        weighted average price and the levels consumed as (price, liquidity taken)
+        pairs. If the side cannot fill the whole amount then every level is
+        consumed. The vwap is None if nothing can be filled.
+        """
+        keys, levels = self._keys[side], self._levels[side]
+        consumed = []
+        remaining = amount
+        total_value, total_liquidity = 0, 0
+
+        for key in reversed(keys):
+            if remaining <= 0:
+                break
+
+            price = abs(key)
+            liquidity = levels[price]
+
+            # take the whole level or just what is needed
+            taken = min(liquidity, remaining / price)
+            consumed.append((price, taken))
+            remaining -= taken * price
+
+            total_value += taken * price
+            total_liquidity += taken
+
+        vwap = total_value / total_liquidity if total_liquidity > 0 else None
+        return vwap, consumed
+
+    def take(self, side, amount):
+        """ Walk a side of the book (see walk) and remove the consumed liquidity.
+        """
+        vwap, consumed = self.walk(side, amount)
+
+        for price, taken in consumed:
+            self.remove_liquidity(side, price, taken)
+
+        return vwap, consumed
+
+    def remove_liquidity(self, side, price, amount):
+        """ Subtract liquidity from a price level, deleting it once empty. Raise
+        exception if liquidity would be negative.
+        """
+        liquidity = self._levels[side].get(float(price), 0) - amount
+
+        if liquidity < 0:
+            raise Exception(f"{side} liquidity cannot be negative")
+        else:
+            self.set_level(side, price, liquidity)
+
+    def get_best_bid(self):
+        """ Return best bid price and available liquidity.
+        """
+        return self.get_best("bids")
+
+    def get_best_ask(self):
+        """ Return best ask price and available liquidity.
+        """
+        return self.get_best("asks")
+
+    def get_best_bid_price(self):
+        """ Return just the best bid price.
+        """
+        return self.get_best("bids")[0]
+
+    def get_best_ask_price(self):
+        """ Return just the best ask price.
+        """
+        return self.get_best("asks")[0]
+
+    def set_best_bid(self, price, liquidity):
+        """ Set the best bid level. Bid levels above the new best price are stale so
+        they are removed.
+        """
+        keys = self._keys["bids"]
+
+        while keys and keys[-1] > price:
+            del self._levels["bids"][keys.pop()]
+
+        self.set_level("bids", price, liquidity)
+
+    def set_best_ask(self, price, liquidity):
+        """ Set the best ask level. Ask levels below the new best price are stale so
+        they are removed.
+        """
+        keys = self._keys["asks"]
+
+        while keys and -keys[-1] < price:
+            del self._levels["asks"][-keys.pop()]
+
+        self.set_level("asks", price, liquidity)
+
+    def remove_bid_liquidity(self, amount):
+        """ Subtract liquidity from the best bid level, deleting it once empty.
+        """
+        self.remove_liquidity("bids", self.get_best_bid_price(), amount)
+
+    def remove_ask_liquidity(self, amount):
+        """ Subtract liquidity from the best ask level, deleting it once empty.
+        """
+        self.remove_liquidity("asks", self.get_best_ask_price(), amount)
+
+
+class BookStore:
+    """ Stores the best bid/ask levels of many order books (across markets and
+    exchanges) as a struct of arrays. Each (exchange_name, market_id) pair is given a
+    dense integer slot, and the bid/ask prices and liquidity of every slot are kept
+    in contiguous float64 arrays. Unset levels are nan.
+
+    This allows bulk updates from numpy arrays and vectorized queries across every
+    market at once e.g. "all spreads right now". Exchanges can keep their books in a
+    store, see Exchange.attach_book_store.
+    """
+    def __init__(self, capacity=64):
+        self._slots = {}
+        self._keys = []
+        self._bid_price = np.full(capacity, np.nan)
+        self._bid_liquidity = np.full(capacity, np.nan)
+        self._ask_price = np.full(capacity, np.nan)
+        self._ask_liquidity = np.full(capacity, np.nan)
+
+        # exchange name -> the StoreOrderBooks of that name, which get a view of
+        # every new slot (not part of the store's state)
+        self._attached = {}
+
+    def __getstate__(self):
+        state = dict(vars(self))
+        del state["_attached"]
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._attached = {}
+
+    def __deepcopy__(self, memo):
+        # the store belongs to whoever attached it, so copies of the exchanges (e.g.
+        # snapshots) share it: its levels are saved and restored with get_state /
+        # set_state instead (see Exchange.get_state)
+        return self
+
+    def get_state(self):
+        """ Return the store's slots and levels. The state is not copied.
+        """
+        return self.__getstate__()
+
+    def set_state(self, state):
+        """ Replace the store's slots and levels, in place, with ones returned by
+        get_state. Views of the store (and exchanges using it) see the new levels,
+        and the attached StoreOrderBooks are rebuilt from the restored slots.
+        """
+        vars(self).update(state)
+
+        for attached in self._attached.values():
+            for ref in attached:
+                books = ref()
+                if books is not None:
+                    books.rebuild_views()
+
+    def attach(self, books, exchange_name):
+        """ Keep a StoreOrderBooks up to date with the slots of an exchange name: it
+        gets a view of every slot, including slots added later e.g. by
+        update_block.
+        """
+        # weak references: forget books that are no longer used
+        attached = [ref for ref in self._attached.get(exchange_name, [])
+                    if ref() is not None]
+        attached.append(weakref.ref(books))
+        self._attached[exchange_name] = attached
+
+        for (name, market_id), slot in self._slots.items():
+            if name == exchange_name:
+                books.add_view(market_id, slot)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def keys(self):
+        """ Return the (exchange_name, market_id) pair of every slot, in slot order.
+        """
+        return list(self._keys)
+
+    def grow(self):
+        """ Double the length of the arrays.
+        """
+        pad = lambda array: np.concatenate((array, np.full(len(array), np.nan)))
+        self._bid_price = pad(self._bid_price)
+        self._bid_liquidity = pad(self._bid_liquidity)
+        self._ask_price = pad(self._ask_price)
+        self._ask_liquidity = pad(self._ask_liquidity)
+
+    def slot(self, exchange_name, market_id):
+        """ Return the slot for an (exchange_name, market_id) pair, giving it the
+        next free slot if it does not have one yet.
+        """
+        key = (exchange_name, market_id)
+        slot = self._slots.get(key)
+
+        if slot is None:
+            if len(self._keys) == len(self._bid_price):
+                self.grow()
+
+            slot = len(self._keys)
+            self._slots[key] = slot
+            self._keys.append(key)
+
+            for ref in self._attached.get(exchange_name, ()):
+                books = ref()
+                if books is not None:
+                    books.add_view(market_id, slot)
+
+        return slot
+
+    def slots(self, exchange_name, market_ids):
+        """ Return an array with the slot of every market id in an array of market
+        ids for one exchange.
+        """
+        market_ids, inverse = np.unique(market_ids, return_inverse=True)
+        slots = [self.slot(exchange_name, market_id)
+                 for market_id in market_ids.tolist()]
+
+        return np.array(slots, dtype=np.int64)[inverse]
+
+    def set_best_bid(self, slot, price, liquidity):
+        if liquidity < 0:
+            raise Exception("best bid liquidity cannot be negative")
+
+        self._bid_price[slot] = price
+        self._bid_liquidity[slot] = liquidity
+
+    def set_best_ask(self, slot, price, liquidity):
+        if liquidity < 0:
+            raise Exception("best ask liquidity cannot be negative")
+
+        self._ask_price[slot] = price
+        self._ask_liquidity[slot] = liquidity
+
+    def update_block(self, exchange_name, market_ids, is_bid, prices, liquidity):
+        """ Apply a block of best bid/ask updates for one exchange given as arrays:
+        market_ids, is_bid (True for a bid update, False for an ask update), prices
+        and liquidity. When a book has several updates on a side the last one wins.
+        """
+        is_bid = np.asarray(is_bid, dtype=bool)
+        prices = np.asarray(prices, dtype=np.float64)
+        liquidity = np.asarray(liquidity, dtype=np.float64)
+
+        if np.any(liquidity < 0):
+            raise Exception("best bid/ask liquidity cannot be negative")
+
+        slots = self.slots(exchange_name, market_ids)
+
+        for side_mask, price_array, liquidity_array in [
+                (is_bid, self._bid_price, self._bid_liquidity),
+                (~is_bid, self._ask_price, self._ask_liquidity)]:
+
+            rows = np.flatnonzero(side_mask)
+
+            # the last update for each slot: first occurrence in reverse
+            _, last = np.unique(slots[rows][::-1], return_index=True)
+            rows = rows[len(rows) - 1 - last]
+
+            price_array[slots[rows]] = prices[rows]
+            liquidity_array[slots[rows]] = liquidity[rows]
+
+    def get_best_bid(self, slot):
+        """ Return best bid price and available liquidity, None if unset.
+        """
+        # item returns a python float; nan is the only value not equal to itself
+        price = self._bid_price.item(slot)
+        if price != price:
+            return (None, None)
+        return (price, self._bid_liquidity.item(slot))
+
+    def get_best_ask(self, slot):
+        """ Return best ask price and available liquidity, None if unset.
+        """
+        price = self._ask_price.item(slot)
+        if price != price:
+            return (None, None)
+        return (price, self._ask_liquidity.item(slot))
+
+    def best_bids(self):
+        """ Return the best bid prices and liquidity of every slot as two arrays.
+        """
+        n = len(self._keys)
+        return self._bid_price[:n], self._bid_liquidity[:n]
+
+    def best_asks(self):
+        """ Return the best ask prices and liquidity of every slot as two arrays.
+        """
+        n = len(self._keys)
+        return self._ask_price[:n], self._ask_liquidity[:n]
+
+    def spreads(self):
+        """ Return the spread (best ask - best bid) of every slot.
+        """
+        n = len(self._keys)
+        return self._ask_price[:n] - self._bid_price[:n]
+
+    def mid_prices(self):
+        """ Return the mid market price of every slot.
+        """
+        n = len(self._keys)
+        return (self._ask_price[:n] + self._bid_price[:n]) / 2
+
+    def book(self, exchange_name, market_id):
+        """ Return an OrderBook-like view of one slot.
+        """
+        return StoreOrderBook(self, self.slot(exchange_name, market_id))
+
+
+class StoreOrderBook:
+    """ Implements the OrderBook methods on top of a slot in a BookStore. The store's
+    arrays are read and written directly: this is the per tick path.
+    """
+    __slots__ = ("_store", "_slot")
+
+    def __init__(self, store, slot):
+        self._store = store
+        self._slot = slot
+
+    def is_empty(self):
+        store, slot = self._store, self._slot
+        bid_price = store._bid_price.item(slot)
+        ask_price = store._ask_price.item(slot)
+        return bid_price != bid_price or ask_price != ask_price
+
+    def get_best_bid(self):
+        price = self._store._bid_price.item(self._slot)
+        if price != price:
+            return (None, None)
+        return (price, self._store._bid_liquidity.item(self._slot))
+
+    def get_best_ask(self):
+        price = self._store._ask_price.item(self._slot)
+        if price != price:
+            return (None, None)
+        return (price, self._store._ask_liquidity.item(self._slot))
+
+    def get_best_bid_price(self):
+        price = self._store._bid_price.item(self._slot)
+        return None if price != price else price
+
+    def get_best_ask_price(self):
+        price = self._store._ask_price.item(self._slot)
+        return None if price != price else price
+
+    def set_best_bid(self, price, liquidity):
+        if liquidity < 0:
+            raise Exception("best bid liquidity cannot be negative")
+
+        store, slot = self._store, self._slot
+        store._bid_price[slot] = price
+        store._bid_liquidity[slot] = liquidity
+
+    def set_best_ask(self, price, liquidity):
+        if liquidity < 0:
+            raise Exception("best ask liquidity cannot be negative")
+
+        store, slot = self._store, self._slot
+        store._ask_price[slot] = price
+        store._ask_liquidity[slot] = liquidity
+
+    def remove_bid_liquidity(self, amount):
+        price, liquidity = self.get_best_bid()
+
+        # do the deduction
+        liquidity -= amount
+
+        if liquidity < 0:
+            raise Exception("best bid liquidity cannot be negative")
+        else:
+            self.set_best_bid(price, liquidity)
+
+    def remove_ask_liquidity(self, amount):
+        price, liquidity = self.get_best_ask()
+
+        # do the deduction
+        liquidity -= amount
+
+        if liquidity < 0:
+            raise Exception("best ask liquidity cannot be negative")
+        else:
+            self.set_best_ask(price, liquidity)
+
+
+class StoreOrderBooks(dict):
+    """ Replaces an exchange's market id -> order book dictionary when the exchange
+    keeps its books in a BookStore. Every market of the exchange in the store maps
+    to a StoreOrderBook view of its slot. The store adds the views of new slots (see
+    BookStore.attach) so looking up a market is a plain dictionary lookup.
+
+    A store only holds the best bid/ask levels: depth books (DepthOrderBook, see
+    Exchange.apply_l2_snapshot) are kept in the dictionary as they are, and the
+    store's levels for their markets are not updated.
+    """
+    def __init__(self, store, exchange_name, books=()):
+        super().__init__(books)
+        self._store = store
+        self._exchange_name = exchange_name
+        store.attach(self, exchange_name)
+
+    def __reduce__(self):
+        # the books are added without copying their levels into the store again
+        return (StoreOrderBooks, (self._store, self._exchange_name, dict(self)))
+
+    def get_store(self):
+        return self._store
+
+    def add_view(self, market_id, slot):
+        if not dict.__contains__(self, market_id):
+            dict.__setitem__(self, market_id, StoreOrderBook(self._store, slot))
+
+    def rebuild_views(self):
+        """ Replace the views with views of the store's current slots, e.g. after the
+        store's state was restored: markets that are no longer in the store are
+        dropped. Depth books are kept.
+        """
+        for market_id, book in list(dict.items(self)):
+            if isinstance(book, StoreOrderBook):
+                dict.__delitem__(self, market_id)
+
+        for (name, market_id), slot in self._store._slots.items():
+            if name == self._exchange_name:
+                self.add_view(market_id, slot)
+
+    def __setitem__(self, market_id, book):
+        if isinstance(book, DepthOrderBook):
+            dict.__setitem__(self, market_id, book)
+            return
+
+        # copy the book's levels into the market's slot
+        slot = self._store.slot(self._exchange_name, market_id)
+        bid_price, bid_liquidity = book.get_best_bid()
+        ask_price, ask_liquidity = book.get_best_ask()
+
+        if bid_price is not None:
+            self._store.set_best_bid(slot, bid_price, bid_liquidity)
+        if ask_price is not None:
+            self._store.set_best_ask(slot, ask_price, ask_liquidity)
+
+        dict.__setitem__(self, market_id, StoreOrderBook(self._store, slot))
+
+
 class BankRoll:
     """ BankRoll stores the account's balances i.e. the amount of each currency
     available. This must be initialised with a dictionary mapping currency symbol to
-    initial balance. It is not possible to add new currencies later.
+    initial balance (which is copied). It is not possible to add new currencies
+    later.
     """
     def __init__(self, initial):
-        self._balances = initial
+        # copy so that bank rolls never share balances
+        self._balances = dict(initial)
 
     def get_balance(self, currency):
         return self._balances[currency]
@@ -152,6 +872,43 @@ class Exchange:
     def __str__(self):
         return self._name
 
+    def get_state(self):
+        """ Return the exchange's state: the order books, bank roll and fee schedule
+        (the name and size limits are immutable config). The state is not copied.
+
+        A BookStore attached to the exchange is not copied with the order books:
+        its levels are part of the state instead and are restored into the same
+        store object, which stays attached.
+        """
+        state = {name: value for name, value in vars(self).items()
+                 if name not in ("_name", "_size_limits")}
+
+        if isinstance(self._order_books, StoreOrderBooks):
+            state["_book_store"] = self._order_books.get_store().get_state()
+
+        return state
+
+    def set_state(self, state):
+        """ Replace the exchange's state with one returned by get_state.
+        """
+        state = dict(state)
+        store_state = state.pop("_book_store", None)
+        vars(self).update(state)
+
+        if store_state is not None:
+            self._order_books.get_store().set_state(store_state)
+
+    def snapshot(self):
+        """ Return a copy of the exchange's state. A snapshot can be restored any
+        number of times.
+        """
+        return copy.deepcopy(self.get_state())
+
+    def restore(self, snapshot):
+        """ Go back to the state of a snapshot. The snapshot itself is not changed.
+        """
+        self.set_state(copy.deepcopy(snapshot))
+
     def make_sure_book_exists(func):
         def check_order_book(self, market_id, price, liquidity):
             # create the order book object for the given market id
@@ -180,6 +937,57 @@ class Exchange:
         book = self._order_books[market_id]
         book.set_best_ask(price, liquidity)
 
+    def attach_book_store(self, store, name=None):
+        """ Keep this exchange's top of book order books in a BookStore, under the
+        given name (default: the exchange's name). Existing books are copied into
+        the store. Depth books (l2 snapshots / deltas) are kept beside the store, see
+        StoreOrderBooks.
+        """
+        books = StoreOrderBooks(store, self._name if name is None else name)
+
+        for market_id, book in self._order_books.items():
+            books[market_id] = book
+
+        self._order_books = books
+
+    def has_order_book(self, market_id):
+        """ Return True if an order book exists for the given market id.
+        """
+        return market_id in self._order_books
+
+    def make_sure_depth_book_exists(self, market_id):
+        """ Return the DepthOrderBook for a market id, creating it if it does not
+        exist or replacing a top of book OrderBook.
+        """
+        book = self._order_books.get(market_id)
+
+        if not isinstance(book, DepthOrderBook):
+            book = DepthOrderBook()
+            self._order_books[market_id] = book
+
+        return book
+
+    def apply_l2_snapshot(self, market_id, bids, asks):
+        """ Replace the order book for a market id with lists of (price, liquidity)
+        bid and ask levels.
+        """
+        book = self.make_sure_depth_book_exists(market_id)
+        book.apply_snapshot(bids, asks)
+
+    def apply_l2_delta(self, market_id, side, price, liquidity):
+        """ Update a single price level of the order book for a market id. Zero
+        liquidity deletes the level.
+        """
+        book = self.make_sure_depth_book_exists(market_id)
+        book.apply_delta(side, price, liquidity)
+
+    def walk(self, market_id, side, amount):
+        """ Walk the order book for a market id to fill "amount" across price levels.
+        Returns the vwap and levels consumed. Assumes a DepthOrderBook exists.
+        """
+        book = self._order_books[market_id]
+        return book.walk(side, amount)
+
     def add_to_balance(self, currency, amount):
         """ Add an amount to the bank roll for some currency symbol.
         """
@@ -237,15 +1045,20 @@ class Exchange:
         """
         return self._bank_roll.get_balance(currency)
 
-    def get_maker_quoted_fee(self, amount_quote):
-        """ Get the maker fee for a position.
+    def get_maker_quoted_fee(self, amount_quote, market_id=None, unix_ts_ns=None):
+        """ Get the maker fee for a position, traded at unix_ts_ns.
         """
-        return self._fee_schedule.maker_fee(amount_quote)
+        return self._fee_schedule.maker_fee(amount_quote, market_id, unix_ts_ns)
 
-    def get_taker_quoted_fee(self, amount_quote):
-        """ Get the taker fee for a position.
+    def get_taker_quoted_fee(self, amount_quote, market_id=None, unix_ts_ns=None):
+        """ Get the taker fee for a position, traded at unix_ts_ns.
         """
-        return self._fee_schedule.taker_fee(amount_quote)
+        return self._fee_schedule.taker_fee(amount_quote, market_id, unix_ts_ns)
+
+    def record_volume(self, unix_ts_ns, amount_quote):
+        """ Record a fill's size with the fee schedule (for volume based fees).
+        """
+        self._fee_schedule.record_volume(unix_ts_ns, amount_quote)
 
     def get_min_trade_size(self, base_currency, quote_currency):
         """ Get the minimum position size.
@@ -257,189 +1070,95 @@ class Exchange:
         """
         return self._size_limits[base_currency][quote_currency]["maximum"]
 
+    def get_tick_size(self, base_currency, quote_currency):
+        """ Get the price increment, or None if not known.
+        """
+        return self._size_limits[base_currency][quote_currency].get("tick_size")
 
-class Binance(Exchange):
-    """ Mimics the Binance exchange's parameters.
+    def get_lot_size(self, base_currency, quote_currency):
+        """ Get the position size increment (in the base currency), or None if not
+        known.
+        """
+        return self._size_limits[base_currency][quote_currency].get("lot_size")
+
+
+class VenueExchange(Exchange):
+    """ Base class for exchanges configured from the venue registry (see venues.py).
+    Subclasses set VENUE to the name of their venue. The venue's config and flat fee
+    schedule are shared by every instance, only the bank roll is per instance.
     """
+    VENUE = None
+
     def __init__(self, initial_balances):
-        super().__init__(name="Binance",
+        config = venues.get_venue(self.VENUE)
+
+        super().__init__(name=config.name,
                          initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Bitfinex(Exchange):
+                         fee_schedule=venue_fee_schedule(config),
+                         size_limits=config.size_limits)
+
+
+class Binance(VenueExchange):
+    """ Mimics the Binance exchange's parameters.
+    """
+    VENUE = "Binance"
+
+
+class Bitfinex(VenueExchange):
     """ Mimics the Bitfinex exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Bitfinex",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Bitflyer(Exchange):
+    VENUE = "Bitfinex"
+
+
+class Bitflyer(VenueExchange):
     """ Mimics the Bitflyer exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Bitflyer",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class BitMEX(Exchange):
+    VENUE = "Bitflyer"
+
+
+class BitMEX(VenueExchange):
     """ Mimics the BitMEX exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="BitMEX",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Bitstamp(Exchange):
+    VENUE = "BitMEX"
+
+
+class Bitstamp(VenueExchange):
     """ Mimics the Bitstamp exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Bitstamp",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Bybit(Exchange):
+    VENUE = "Bitstamp"
+
+
+class Bybit(VenueExchange):
     """ Mimics the Bybit exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Bybit",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Coinbase(Exchange):
+    VENUE = "Bybit"
+
+
+class Coinbase(VenueExchange):
     """ Mimics the Coinbase exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Coinbase",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Gemini(Exchange):
+    VENUE = "Coinbase"
+
+
+class Gemini(VenueExchange):
     """ Mimics the Gemini exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Gemini",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class HitBTC(Exchange):
+    VENUE = "Gemini"
+
+
+class HitBTC(VenueExchange):
     """ Mimics the HitBTC exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="HitBTC",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Kraken(Exchange):
+    VENUE = "HitBTC"
+
+
+class Kraken(VenueExchange):
     """ Mimics the Kraken exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Kraken",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
-
-
-class Poloniex(Exchange):
+    VENUE = "Kraken"
+
+
+class Poloniex(VenueExchange):
     """ Mimics the Poloniex exchange's parameters.
     """
-    def __init__(self, initial_balances):
-        super().__init__(name="Poloniex",
-                         initial_balances=initial_balances,
-                         fee_schedule=MakerTakerFeeSchedule(0.01, 0.01),
-                         size_limits={
-                             "BTC": {
-                                 "GBP": {"minimum": 25, "maximum": 100000},
-                                 "EUR": {"minimum": 25, "maximum": 100000},
-                                 "USD": {"minimum": 25, "maximum": 100000},
-                                 "USDT": {"minimum": 25, "maximum": 100000}
-                             }
-                         })
+    VENUE = "Poloniex"
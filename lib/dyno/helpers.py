@@ -1,3 +1,5 @@
+import collections
+
 from . import exchange
 from . import strategy
 from .backtest import Pipeline
@@ -37,6 +39,18 @@ def all_cryptocurrency_exchanges(initial_balances):
     }
 
 
+def attach_book_store(exchanges, store=None):
+    """ Keep the order books of every exchange in a dictionary of exchanges in one
+    BookStore, using the dictionary's keys as exchange names. Returns the store.
+    """
+    store = exchange.BookStore() if store is None else store
+
+    for exchange_name, exchange_object in exchanges.items():
+        exchange_object.attach_book_store(store, exchange_name)
+
+    return store
+
+
 def build_basic_signal_strategy(users_signal_strategy, exchanges):
     """ Helper function. Build and return a Pipeline object using dyno's pre-defined
     strategy classes. Each strategy object has access to the shared state "exchanges"
@@ -59,169 +73,410 @@ def build_basic_signal_strategy(users_signal_strategy, exchanges):
                     strategy.ExitStrategy(exchanges))
 
 
-class QueueNode:
-    """ A node in a circular queue. Has a "thing" value and points to previous and
-    next nodes in the queue.
+def build_basic_signal_pipeline(signal_strategy_class, initial_balances, **params):
+    """ Helper function. Build and return a basic signal strategy Pipeline (see
+    build_basic_signal_strategy) with fresh exchange objects for every exchange.
+    The user's signal strategy is created with signal_strategy_class(exchanges,
+    **params). Use functools.partial to bind the class and balances e.g. to build
+    the pipelines of an Ensemble.
     """
-    def __init__(self, prev_node, next_node, thing):
-        self.prev_node = prev_node
-        self.next_node = next_node
-        self.thing = thing
+    exchanges = all_cryptocurrency_exchanges(initial_balances)
+    return build_basic_signal_strategy(
+        signal_strategy_class(exchanges, **params),
+        exchanges)
 
 
 class CircularQueue:
-    """ Implements a circular queue by maintaining pointers to head and tail QueueNode
-    objects. Also keeps a count of the number of nodes in the queue.
+    """ Implements a circular queue using a ring buffer: a preallocated list of slots
+    plus the index of the head slot and a count of the number of "things" in the
+    queue. The list doubles in size when it is full, so appending and trimming are
+    amortized O(1) and do not allocate per "thing".
+
+    Note: the list's length is always a power of two so indexes can wrap around
+    with a bit mask instead of a modulo.
+
+    Note: view() returns a QueueView of the things in the queue without copying
+    them. Every mutation increments a version number so that stale views can be
+    detected. Copy-on-write views mark the list as shared instead, and the next
+    trim copies the list before writing to it.
+
+    Note: copies of the queue (copy.copy / copy.deepcopy, e.g. when a strategy is
+    snapshotted) share the list until either queue writes to it. The things
+    themselves are not copied, they are assumed to be immutable e.g. events.
     """
-    def __init__(self):
-        self._head = None
-        self._tail = None
+    __slots__ = ("_items", "_head", "_counter", "_version", "_shared")
+
+    # the list is shared with copy-on-write views, which only read the slots in
+    # use, or with copies of the queue, which also write to the free slots
+    NOT_SHARED = 0
+    SHARED_WITH_VIEWS = 1
+    SHARED_WITH_COPIES = 2
+
+    def __init__(self, capacity=16):
+        # round the initial capacity up to a power of two
+        size = 1
+        while size < capacity:
+            size *= 2
+
+        self._items = [None] * size
+        self._head = 0
         self._counter = 0
+        self._version = 0
+        self._shared = CircularQueue.NOT_SHARED
 
     def __len__(self):
         return self._counter
 
+    def __copy__(self):
+        queue = CircularQueue.__new__(CircularQueue)
+        queue._items = self._items
+        queue._head = self._head
+        queue._counter = self._counter
+        queue._version = 0
+
+        # whichever queue writes first copies the list
+        self._shared = queue._shared = CircularQueue.SHARED_WITH_COPIES
+        return queue
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
     def __iter__(self):
-        count = len(self)
-        things = self.get_head(count)
-        return iter(things)
+        items, head, mask = self._items, self._head, len(self._items) - 1
+        return (items[(head + i) & mask] for i in range(self._counter))
 
     def is_empty(self):
         return self._counter == 0
 
-    def append(self, thing):
-        """ Append a new "thing" to the queue. Note: the user does not need to create
-        the QueueNode object as this is done internally.
+    def grow(self):
+        """ Double the size of the underlying list, moving the things so that the
+        head is at index 0.
         """
-        # create the new queue node
-        prev_node = self._tail
-        next_node = self._head
-        node = QueueNode(prev_node, next_node, thing)
+        self._items = list(self) + [None] * len(self._items)
+        self._head = 0
+        self._shared = CircularQueue.NOT_SHARED
 
-        if self.is_empty():
-            # set next and previous nodes to the node itself
-            node.next_node = node
-            node.prev_node = node
+    def unshare(self):
+        """ Copy the underlying list so that copy-on-write views of the old list are
+        not affected by later writes.
+        """
+        self._items = list(self._items)
+        self._shared = CircularQueue.NOT_SHARED
 
-            # node becomes head and tail of the queue
-            self._head = node
-            self._tail = node
+    def view(self, copy_on_write=False):
+        """ Return a read-only QueueView of the things currently in the queue. A view
+        is invalidated by the next mutation of the queue, unless copy_on_write is
+        True in which case the view stays valid forever.
+        """
+        if copy_on_write:
+            self._shared = max(self._shared, CircularQueue.SHARED_WITH_VIEWS)
 
-        else:
-            # replace the queue's tail node
-            self._tail.next_node = node
-            self._tail = node
+        return QueueView(self, copy_on_write)
 
-        # increment node counter
+    def append(self, thing):
+        """ Append a new "thing" to the tail of the queue.
+        """
+        if self._counter == len(self._items):
+            # the ring buffer is full
+            self.grow()
+        elif self._shared == CircularQueue.SHARED_WITH_COPIES:
+            self.unshare()
+
+        items = self._items
+        items[(self._head + self._counter) & (len(items) - 1)] = thing
+
+        # increment counter
         self._counter += 1
+        self._version += 1
 
     def trim_head(self, n=1):
-        """ Removes the queue's head node and replaces it with the next head
-        if there is one. Does this n (default 1) times using recursion.
+        """ Removes n (default 1) things from the queue's head and returns them as a
+        list, oldest first. Raise exception if the queue has fewer than n things.
         """
-        if self.is_empty():
-            # cannot trim an empty queue
+        if self._counter < n or self._counter == 0:
+            # cannot trim more things than there are
             raise Exception("queue is empty")
 
-        else:
-            # queue is not empty
-            # get the head node
-            trimmed = self._head
-
-            if self._counter == 1:
-                # set head and tail to none
-                # reset node counter
-                self._head, self._tail = None, None
-                self._counter = 0
-            else:
-                # set head to trimmed next node
-                # decrement node counter
-                self._head = trimmed.next_node
-                self._counter -= 1
-
-            if n > 1:
-                # recurse
-                return [trimmed.thing] + self.trim_head(n - 1)
-            else:
-                # base case
-                return [trimmed.thing]
+        if self._shared:
+            self.unshare()
+
+        items, head, mask = self._items, self._head, len(self._items) - 1
+        trimmed = []
+
+        for _ in range(n):
+            # take the thing and clear its slot
+            trimmed.append(items[head])
+            items[head] = None
+            head = (head + 1) & mask
+
+        self._head = head
+        self._counter -= n
+        self._version += 1
+        return trimmed
 
     def trim_tail(self, n=1):
-        """ Removes the queue's tail node and replaces it with the previous tail
-        if there is one. Does this n (default 1) times using recursion.
+        """ Removes n (default 1) things from the queue's tail and returns them as a
+        list, newest first. Raise exception if the queue has fewer than n things.
         """
-        if self.is_empty():
-            # cannot trim an empty queue
+        if self._counter < n or self._counter == 0:
+            # cannot trim more things than there are
             raise Exception("queue is empty")
 
-        else:
-            # queue is not empty
-            # get the tail node
-            trimmed = self._tail
-
-            if self._counter == 1:
-                # set head and tail to none
-                # reset node counter
-                self._head, self._tail = None, None
-                self._counter = 0
-            else:
-                # set tail to trimmed previous node
-                # decrement node counter
-                self._tail = trimmed.prev_node
-                self._counter -= 1
-
-            if n > 1:
-                # recurse
-                return [trimmed.thing] + self.trim_tail(n - 1)
-            else:
-                # base case
-                return [trimmed.thing]
+        if self._shared:
+            self.unshare()
+
+        items, mask = self._items, len(self._items) - 1
+        tail = (self._head + self._counter - 1) & mask
+        trimmed = []
+
+        for _ in range(n):
+            # take the thing and clear its slot
+            trimmed.append(items[tail])
+            items[tail] = None
+            tail = (tail - 1) & mask
+
+        self._counter -= n
+        self._version += 1
+        return trimmed
 
     def get_head(self, n=1):
         """ Get up to n (default 1) "things" starting from the queue's head and
         going forward. If queue's length is < n then raise exception.
         """
-        # get the head
-        head = self._head
+        if self._counter < n or self._counter == 0:
+            raise Exception("queue is empty")
 
-        # the list of things to return
-        things = []
+        items, head, mask = self._items, self._head, len(self._items) - 1
+        return [items[(head + i) & mask] for i in range(n)]
 
-        while n > 0:
-            if head != None:
-                # append to list and update current head
-                things.append(head.thing)
-                head = head.next_node
-            else:
-                # the queue is empty
-                raise Exception("queue is empty")
+    def peek_head(self):
+        """ Return the thing at the queue's head without building a list. Raise
+        exception if the queue is empty.
+        """
+        if self._counter == 0:
+            raise Exception("queue is empty")
 
-            n -= 1
+        return self._items[self._head]
 
-        return things
+    def pop_head(self):
+        """ Remove and return the thing at the queue's head without building a list.
+        Raise exception if the queue is empty.
+        """
+        if self._counter == 0:
+            raise Exception("queue is empty")
+
+        if self._shared:
+            self.unshare()
+
+        items, head = self._items, self._head
+        thing = items[head]
+
+        # clear the slot and move the head forward
+        items[head] = None
+        self._head = (head + 1) & (len(items) - 1)
+        self._counter -= 1
+        self._version += 1
+        return thing
+
+    def peek_tail(self):
+        """ Return the thing at the queue's tail without building a list. Raise
+        exception if the queue is empty.
+        """
+        if self._counter == 0:
+            raise Exception("queue is empty")
+
+        items = self._items
+        return items[(self._head + self._counter - 1) & (len(items) - 1)]
 
     def get_tail(self, n=1):
         """ Get up to n (default 1) "things" starting from the queue's tail and
         going backwards. If queue's length is < n then raise exception.
         """
-        # get the tail
-        tail = self._tail
+        if self._counter < n or self._counter == 0:
+            raise Exception("queue is empty")
+
+        items, mask = self._items, len(self._items) - 1
+        tail = self._head + self._counter - 1
+        return [items[(tail - i) & mask] for i in range(n)]
+
+
+class QueueView:
+    """ A read-only, zero-copy view of the things in a CircularQueue. The view
+    refers to the queue's underlying list plus the start index and number of things
+    when the view was made. Indexing, slicing and iterating read straight from the
+    list.
+
+    A view raises an exception once the queue has been mutated, unless it is a
+    copy-on-write view: then the queue copies its list before overwriting anything
+    the view can see, so the view stays valid.
+    """
+    __slots__ = ("_queue", "_version", "_items", "_start", "_counter")
+
+    def __init__(self, queue, copy_on_write=False):
+        # copy-on-write views never go stale so do not keep the queue
+        self._queue = None if copy_on_write else queue
+        self._version = queue._version
+        self._items = queue._items
+        self._start = queue._head
+        self._counter = len(queue)
+
+    def is_valid(self):
+        """ A view is valid if it is copy-on-write or the queue has not been
+        mutated since the view was made.
+        """
+        return self._queue is None or self._queue._version == self._version
+
+    def check_valid(self):
+        if not self.is_valid():
+            raise Exception("view is stale: the queue has been mutated")
+
+    def __len__(self):
+        return self._counter
+
+    def __getitem__(self, i):
+        self.check_valid()
 
-        # the list of things to return
-        things = []
+        if isinstance(i, slice):
+            # slicing returns a list of the selected things
+            items, start, mask = self._items, self._start, len(self._items) - 1
+            return [items[(start + j) & mask]
+                    for j in range(*i.indices(self._counter))]
 
-        while n > 0:
-            if tail != None:
-                # append to list and update current tail
-                things.append(tail.thing)
-                tail = tail.prev_node
-            else:
-                # the queue is empty
-                raise Exception("queue is empty")
+        if i < 0:
+            i += self._counter
 
-            n -= 1
+        if not 0 <= i < self._counter:
+            raise IndexError("view index out of range")
+
+        return self._items[(self._start + i) & (len(self._items) - 1)]
+
+    def __iter__(self):
+        self.check_valid()
+
+        items, start, mask = self._items, self._start, len(self._items) - 1
+        return (items[(start + i) & mask] for i in range(self._counter))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def to_list(self):
+        """ Copy the things in the view into a new list.
+        """
+        return list(self)
 
-        return things
+
+class RollingAggregates:
+    """ Maintains the sum, mean, variance, min and max of a first-in-first-out
+    sequence of numbers. Numbers are pushed onto the end of the sequence and popped
+    from the front, and every aggregate is updated in amortized O(1) time.
+
+    - mean and variance use Welford's algorithm, extended to remove values
+    - min and max use monotonic deques of (sequence number, value) pairs
+    """
+    __slots__ = ("_count", "_sum", "_mean", "_m2",
+                 "_mins", "_maxs", "_pushed", "_popped")
+
+    def __init__(self):
+        self._count = 0
+        self._sum = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._mins = collections.deque()
+        self._maxs = collections.deque()
+        self._pushed = 0
+        self._popped = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, x):
+        """ Add a number to the end of the sequence.
+        """
+        self._count += 1
+        self._sum += x
+
+        # welford update
+        delta = x - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (x - self._mean)
+
+        # drop values that can never be the min/max again
+        seq = self._pushed
+        mins, maxs = self._mins, self._maxs
+
+        while mins and mins[-1][1] >= x:
+            mins.pop()
+        mins.append((seq, x))
+
+        while maxs and maxs[-1][1] <= x:
+            maxs.pop()
+        maxs.append((seq, x))
+
+        self._pushed += 1
+
+    def pop(self, x):
+        """ Remove the number at the front of the sequence. The caller passes the
+        number being removed because the sequence itself is not stored here.
+        """
+        if self._count == 0:
+            raise Exception("sequence is empty")
+
+        self._count -= 1
+
+        if self._count == 0:
+            # reset rather than accumulate rounding errors
+            self._sum = 0.0
+            self._mean = 0.0
+            self._m2 = 0.0
+
+        else:
+            self._sum -= x
+
+            # reverse welford update
+            delta = x - self._mean
+            self._mean -= delta / self._count
+            self._m2 = max(self._m2 - delta * (x - self._mean), 0.0)
+
+        # expire the min/max if it was the popped number
+        seq = self._popped
+
+        if self._mins[0][0] == seq:
+            self._mins.popleft()
+
+        if self._maxs[0][0] == seq:
+            self._maxs.popleft()
+
+        self._popped += 1
+
+    def sum(self):
+        return self._sum
+
+    def mean(self):
+        """ Return the mean, or None if the sequence is empty.
+        """
+        return self._mean if self._count > 0 else None
+
+    def variance(self):
+        """ Return the sample variance, or None if there are fewer than two numbers.
+        """
+        return self._m2 / (self._count - 1) if self._count > 1 else None
+
+    def std(self):
+        """ Return the sample standard deviation, or None if there are fewer than
+        two numbers.
+        """
+        variance = self.variance()
+        return variance ** 0.5 if variance is not None else None
+
+    def min(self):
+        """ Return the minimum, or None if the sequence is empty.
+        """
+        return self._mins[0][1] if self._mins else None
+
+    def max(self):
+        """ Return the maximum, or None if the sequence is empty.
+        """
+        return self._maxs[0][1] if self._maxs else None
 
 
 class EventTimeWindow:
@@ -230,65 +485,92 @@ class EventTimeWindow:
     the first and last event timestamps will always be at most window_duration_seconds.
 
     - An event is a three-tuple: (event_name, unix_ts_ns, values)
-    - The window's size is given in seconds: window_duration_seconds
+    - The window's size is given in seconds: window_duration_seconds. Fractions of
+      a second are allowed e.g. 0.25 for a 250ms window
+    - If aggregate_value is given then rolling aggregates of values[aggregate_value]
+      are updated as events enter and expire from the window: see get_aggregates
     """
-    def __init__(self, window_duration_seconds):
-        self._window_duration_secs = window_duration_seconds
+    def __init__(self, window_duration_seconds, aggregate_value=None):
+        self._window_duration_ns = round(window_duration_seconds * 1_000_000_000)
         self._circular_queue = CircularQueue()
+        self._aggregate_value = aggregate_value
+        self._aggregates = RollingAggregates() \
+            if aggregate_value is not None else None
 
     def add_event(self, event_name, unix_ts_ns, values):
         """ Append a new event to the window, and remove zero or more events if they
         have expired (trim the underlying circular queue).
         """
+        queue = self._circular_queue
+        aggregates = self._aggregates
+
         # append to queue
-        self._circular_queue.append((event_name, unix_ts_ns, values))
-
-        # remove from tail of queue until difference
-        # between head and tail is < self._window_duration_secs
-        finished_trimming = False
-
-        while not finished_trimming:
-            if self._circular_queue.is_empty():
-                # the queue is empty so finish trimming
-                finished_trimming = True
-
-            else:
-                # get head and tail of the queue
-                # use [0] because get_head/tail always returns a list
-                newest = self._circular_queue.get_tail()[0]
-                oldest = self._circular_queue.get_head()[0]
-
-                # extract event timestamps from
-                # (event_name, unix_ts_ns, values)
-                newest_ts_ns = newest[1]
-                oldest_ts_ns = oldest[1]
-
-                # calculate difference in seconds
-                duration_ns = (newest_ts_ns - oldest_ts_ns)
-                duration_secs = duration_ns // 1_000_000_000
-
-                if duration_secs < self._window_duration_secs:
-                    # the differnece between head and tail's
-                    # timestamps is < self._window_duration_secs
-                    finished_trimming = True
-                else:
-                    # trim from beginning of the queue
-                    self._circular_queue.trim_head()
+        queue.append((event_name, unix_ts_ns, values))
+
+        if aggregates is not None:
+            # the new event enters the rolling aggregates
+            aggregates.push(values[self._aggregate_value])
+
+        # the new event is the newest in the window: an event has expired if
+        # the difference between its timestamp and unix_ts_ns is at least the
+        # window duration i.e. its timestamp is <= horizon_ns
+        horizon_ns = unix_ts_ns - self._window_duration_ns
+
+        # remove from head of queue until the oldest event is inside the window
+        while not queue.is_empty() and queue.peek_head()[1] <= horizon_ns:
+            _, _, expired_values = queue.pop_head()
+
+            if aggregates is not None:
+                # the expired event leaves the rolling aggregates
+                aggregates.pop(expired_values[self._aggregate_value])
 
     def get_window(self):
         """ Return a list of all events in the window.
         """
         return list(self._circular_queue)
 
+    def get_window_view(self, copy_on_write=False):
+        """ Return a read-only QueueView of the events in the window without copying
+        them. The view is invalidated by the next add_event unless copy_on_write is
+        True.
+        """
+        return self._circular_queue.view(copy_on_write)
+
+    def get_aggregates(self):
+        """ Return the RollingAggregates of the events currently in the window, or
+        None if the window was not created with an aggregate_value.
+        """
+        return self._aggregates
+
 
 class EventTimeSlidingWindow(EventTimeWindow):
-    """ ...
+    """ An event time window that returns a snapshot of the window every
+    window_step_seconds. How snapshots are returned depends on snapshot_mode:
+
+    - "list": a new list of the events (default)
+    - "view": a zero-copy QueueView that is valid until the next add_event
+    - "copy_on_write": a zero-copy QueueView that stays valid; the window copies
+      its buffer only if it is trimmed while a snapshot may still be in use
     """
-    def __init__(self, window_duration_seconds, window_step_seconds):
-        super().__init__(window_duration_seconds)
-        self._window_step_secs = window_step_seconds
+    def __init__(self, window_duration_seconds, window_step_seconds,
+                 aggregate_value=None, snapshot_mode="list"):
+        super().__init__(window_duration_seconds, aggregate_value)
+        self._window_step_ns = round(window_step_seconds * 1_000_000_000)
         self._window_start_ts_ns = None
 
+        if snapshot_mode not in ("list", "view", "copy_on_write"):
+            raise Exception(f"unknown snapshot mode: {snapshot_mode}")
+
+        self._snapshot_mode = snapshot_mode
+
+    def get_snapshot(self):
+        """ Return the events in the window according to the snapshot mode.
+        """
+        if self._snapshot_mode == "list":
+            return self.get_window()
+        else:
+            return self.get_window_view(self._snapshot_mode == "copy_on_write")
+
     def add_event(self, event_name, unix_ts_ns, values):
         """ ...
         """
@@ -299,25 +581,21 @@ class EventTimeSlidingWindow(EventTimeWindow):
             self._window_start_ts_ns = unix_ts_ns
             return None
 
+        elif unix_ts_ns - self._window_start_ts_ns < self._window_step_ns:
+            # duration since last window is <
+            # self._window_step_ns -> don't return a new
+            # window snapshot
+            return None
+
         else:
-            # calculate difference in seconds
-            duration_ns = (unix_ts_ns - self._window_start_ts_ns)
-            duration_secs = duration_ns // 1_000_000_000
-
-            if duration_secs < self._window_step_secs:
-                # duration since last window is <
-                # self._window_step_secs -> don't return a new
-                # window snapshot
-                return None
-            else:
-                # duration since last window is >=
-                # self._window_step_secs -> return a new window
-                # snapshot and reset window_start_ts_ns
-                start, end = self._window_start_ts_ns, unix_ts_ns
-
-                # the start of the next window will be set to
-                # the current event's timestamp
-                self._window_start_ts_ns = unix_ts_ns
-
-                # ((start ts, end ts), iterator)
-                return ((start, end), self.get_window())
+            # duration since last window is >=
+            # self._window_step_ns -> return a new window
+            # snapshot and reset window_start_ts_ns
+            start, end = self._window_start_ts_ns, unix_ts_ns
+
+            # the start of the next window will be set to
+            # the current event's timestamp
+            self._window_start_ts_ns = unix_ts_ns
+
+            # ((start ts, end ts), snapshot)
+            return ((start, end), self.get_snapshot())
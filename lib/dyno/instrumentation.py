@@ -0,0 +1,177 @@
+import time
+
+
+# the counters kept for every (stage, event name)
+COUNTERS = ("events_in", "events_out", "handler_calls", "wall_ns", "cpu_ns")
+
+
+class Instrumentation:
+    """ Counters for the stages of a pipeline, per stage and per input event name:
+
+    - events_in: number of input events
+    - events_out: number of output events they produced
+    - handler_calls: number of input events sent to an on_event_name handler (the
+      rest are forwarded)
+    - wall_ns / cpu_ns: cumulative wall clock and cpu time, in nanoseconds
+
+    Instrumentation is opt-in (see Pipeline.enable_instrumentation and
+    Strategy.enable_instrumentation). An Instrumentation object can be pickled and
+    merged with others, e.g. the counters of spark tasks or worker processes.
+    """
+    def __init__(self):
+        # stage name -> event name -> list of COUNTERS
+        self._stages = {}
+
+    def record(self, stage_name, event_name, events_in, events_out, handler_calls,
+               wall_ns, cpu_ns):
+        """ Add to the counters of a stage's input events of one name.
+        """
+        events = self._stages.get(stage_name)
+
+        if events is None:
+            events = self._stages[stage_name] = {}
+
+        counters = events.get(event_name)
+
+        if counters is None:
+            counters = events[event_name] = [0, 0, 0, 0, 0]
+
+        counters[0] += events_in
+        counters[1] += events_out
+        counters[2] += handler_calls
+        counters[3] += wall_ns
+        counters[4] += cpu_ns
+
+    def is_empty(self):
+        return len(self._stages) == 0
+
+    def reset(self):
+        self._stages = {}
+
+    def merge(self, other):
+        """ Add the counters of another Instrumentation, or of a dictionary returned
+        by to_dict, to these counters. Returns self.
+        """
+        stages = other.to_dict() if isinstance(other, Instrumentation) else other
+
+        for stage_name, events in stages.items():
+            for event_name, other_counters in events.items():
+                merged = self._stages.setdefault(stage_name, {}) \
+                    .setdefault(event_name, [0, 0, 0, 0, 0])
+
+                for i, name in enumerate(COUNTERS):
+                    merged[i] += other_counters[name]
+
+        return self
+
+    @staticmethod
+    def merge_all(instrumentations):
+        """ Merge many Instrumentation objects or dictionaries into a new one.
+        """
+        merged = Instrumentation()
+
+        for instrumentation in instrumentations:
+            merged.merge(instrumentation)
+
+        return merged
+
+    def to_dict(self):
+        """ Return the counters as plain dictionaries:
+        {stage name: {event name: {counter name: value}}}
+        """
+        return {
+            stage_name: {
+                event_name: dict(zip(COUNTERS, counters))
+                for event_name, counters in events.items()
+            }
+            for stage_name, events in self._stages.items()
+        }
+
+    def totals(self):
+        """ Return the counters summed over the event names of each stage:
+        {stage name: {counter name: value}}
+        """
+        totals = {}
+
+        for stage_name, events in self._stages.items():
+            summed = [sum(column) for column in zip(*events.values())]
+            totals[stage_name] = dict(zip(COUNTERS, summed))
+
+        return totals
+
+    def table(self):
+        """ Return the counters as a printable table, one row per stage and event
+        name followed by the stage's total. Times are in milliseconds.
+        """
+        header = ("stage", "event", "in", "out", "calls", "wall ms", "cpu ms",
+                  "wall %")
+        rows = []
+
+        totals = self.totals()
+        total_wall_ns = sum(total["wall_ns"] for total in totals.values()) or 1
+
+        def row(stage_name, event_name, counters):
+            return (stage_name, event_name,
+                    str(counters["events_in"]),
+                    str(counters["events_out"]),
+                    str(counters["handler_calls"]),
+                    f"{counters['wall_ns'] / 1e6:.3f}",
+                    f"{counters['cpu_ns'] / 1e6:.3f}",
+                    f"{100 * counters['wall_ns'] / total_wall_ns:.1f}")
+
+        for stage_name, events in self.to_dict().items():
+            for event_name, counters in events.items():
+                rows.append(row(stage_name, event_name, counters))
+
+            rows.append(row(stage_name, "(total)", totals[stage_name]))
+
+        widths = [max(len(line[i]) for line in [header] + rows)
+                  for i in range(len(header))]
+
+        # names left aligned, numbers right aligned
+        format_line = lambda line: "  ".join(
+            value.ljust(width) if i < 2 else value.rjust(width)
+            for i, (value, width) in enumerate(zip(line, widths)))
+
+        lines = [format_line(header), "  ".join("-" * width for width in widths)]
+        lines.extend(format_line(line) for line in rows)
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.table()
+
+
+class InstrumentedStage:
+    """ Wraps a pipeline stage that is not a strategy (any callable taking and
+    returning a list of events) to count its batches of events under the event name
+    "*". Other attributes are looked up on the wrapped stage.
+    """
+    def __init__(self, stage, instrumentation, stage_name):
+        self._stage = stage
+        self._instrumentation = instrumentation
+        self._stage_name = stage_name
+
+    def __call__(self, events_in):
+        wall_ns, cpu_ns = time.perf_counter_ns(), time.process_time_ns()
+        events_out = self._stage(events_in)
+
+        self._instrumentation.record(
+            self._stage_name,
+            "*",
+            len(events_in),
+            len(events_out),
+            0,
+            time.perf_counter_ns() - wall_ns,
+            time.process_time_ns() - cpu_ns)
+
+        return events_out
+
+    def __getattr__(self, name):
+        # only called for missing attributes; _stage is missing while unpickling
+        if "_stage" not in vars(self):
+            raise AttributeError(name)
+
+        return getattr(self._stage, name)
+
+    def unwrap(self):
+        return self._stage
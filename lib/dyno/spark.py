@@ -0,0 +1,420 @@
+import array
+
+from . import events
+from .backtest import ResultsColumns
+from .instrumentation import Instrumentation
+
+
+def import_spark_functions():
+    """ Import pyspark's sql functions. pyspark is an optional dependency so it is
+    only imported when a spark events source is used.
+    """
+    try:
+        from pyspark.sql import functions
+    except ImportError:
+        raise Exception("running backtests on spark needs pyspark: "
+                        "pip install dyno[spark]")
+
+    return functions
+
+
+def row_to_event(row, exchange_name=None):
+    """ Convert a best bid/ask row (unix_ts_ns, market_id, side, price, liquidity
+    and optionally exchange_name columns) into a best_bid / best_ask event. side is
+    "bids" or "asks".
+    """
+    if exchange_name is None:
+        exchange_name = row.exchange_name
+
+    make_event = events.best_bid if row.side == "bids" else events.best_ask
+    return make_event(int(row.unix_ts_ns),
+                      exchange_name,
+                      int(row.market_id),
+                      float(row.price),
+                      float(row.liquidity))
+
+
+class InstrumentationParam:
+    """ A spark AccumulatorParam (zero and addInPlace) that merges Instrumentation
+    counters.
+    """
+    def zero(self, value):
+        return Instrumentation()
+
+    def addInPlace(self, value1, value2):
+        return value1.merge(value2)
+
+
+def instrumentation_accumulator(spark_context):
+    """ Return a spark accumulator of Instrumentation counters, for the
+    instrumentation argument of SparkEvents. Read its value on the driver once the
+    backtest has run e.g. print(accumulator.value).
+    """
+    return spark_context.accumulator(Instrumentation(), InstrumentationParam())
+
+
+def run_partition(pipeline, rows, exchange_name=None, instrumentation=None):
+    """ Send a partition's rows through one pipeline instance, in order, yielding the
+    list of outputs for each row. The pipeline's state (order books, mid market
+    prices, open positions, ...) carries over from row to row.
+
+    If instrumentation (an accumulator, see instrumentation_accumulator) is given
+    the partition's pipeline is instrumented and its counters are added to the
+    accumulator when the partition is done.
+    """
+    if instrumentation is not None:
+        counters = pipeline.enable_instrumentation()
+
+    for row in rows:
+        yield pipeline([row_to_event(row, exchange_name)])
+
+    if instrumentation is not None:
+        instrumentation.add(counters)
+
+
+class SparkEvents:
+    """ An events source for running a Backtest on spark. Wraps a spark data frame
+    of best bid/ask rows, with the columns of the example price change CSV files
+    (unix_ts_ns, market_id, price, liquidity) plus a side column ("bids" or
+    "asks") and an exchange_name column, unless exchange_name is given.
+
+    The pipeline is stateful, so calling it once per row in independent tasks would
+    lose or split its state. Instead the rows are range partitioned by
+    (exchange_name, market_id), so every update of an order book is in the same
+    partition, sorted by time within each partition, and each partition is sent
+    through its own copy of the pipeline with mapPartitions. Different markets are
+    backtested in parallel.
+
+    Note: a partition can hold more than one market but a market is never split,
+    so strategies that trade one market at a time give the same results as a local
+    backtest. Strategies that need to see several markets at once (e.g. arbitrage)
+    must be run locally, or with num_partitions=1.
+
+    instrumentation is an optional accumulator (see instrumentation_accumulator)
+    that collects the per stage counters of every partition's pipeline.
+    """
+    def __init__(self, df, exchange_name=None, num_partitions=None,
+                 instrumentation=None):
+        self._df = df
+        self._exchange_name = exchange_name
+        self._num_partitions = num_partitions
+        self._instrumentation = instrumentation
+
+    def partitioned(self):
+        """ Return the data frame range partitioned by (exchange_name, market_id) and
+        sorted by time within each partition.
+        """
+        functions = import_spark_functions()
+        df = self._df
+
+        if self._exchange_name is not None:
+            df = df.withColumn("exchange_name", functions.lit(self._exchange_name))
+
+        keys = [functions.col("exchange_name"), functions.col("market_id")]
+
+        if self._num_partitions is None:
+            df = df.repartitionByRange(*keys)
+        else:
+            df = df.repartitionByRange(self._num_partitions, *keys)
+
+        # ties are broken by book so that the order is deterministic
+        return df.sortWithinPartitions("unix_ts_ns", "exchange_name", "market_id")
+
+    def pipe(self, pipeline):
+        """ Run the pipeline over every partition. Returns an RDD of per event lists
+        of outputs (see Results).
+        """
+        instrumentation = self._instrumentation
+
+        return self.partitioned().rdd.mapPartitions(
+            lambda rows: run_partition(pipeline, rows,
+                                       instrumentation=instrumentation))
+
+
+# the pipeline outputs sent back from arrow partitions: the events Results needs,
+# one column per field (see ResultsColumns)
+RESULT_EVENTS = frozenset([
+    "mid_market_price",
+    "bid_fill",
+    "ask_fill",
+    "long_executed",
+    "short_executed"
+])
+
+RESULT_SCHEMA = ("event_name string, unix_ts_ns long, exchange_name string, "
+                 "market_id long, position_ts long, price double, amount double, "
+                 "fee double")
+
+RESULT_COLUMNS = ["event_name", "unix_ts_ns", "exchange_name", "market_id",
+                  "position_ts", "price", "amount", "fee"]
+
+
+def import_pyarrow():
+    """ Import pyarrow, which comes with pyspark's arrow support.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception("arrow batches need pyarrow: pip install dyno[spark]")
+
+    return pyarrow
+
+
+def result_arrow_schema(pyarrow):
+    """ The arrow schema of RESULT_SCHEMA.
+    """
+    return pyarrow.schema([
+        ("event_name", pyarrow.string()),
+        ("unix_ts_ns", pyarrow.int64()),
+        ("exchange_name", pyarrow.string()),
+        ("market_id", pyarrow.int64()),
+        ("position_ts", pyarrow.int64()),
+        ("price", pyarrow.float64()),
+        ("amount", pyarrow.float64()),
+        ("fee", pyarrow.float64())
+    ])
+
+
+def columns_to_events(columns):
+    """ Convert best bid/ask columns (a dictionary of equal length arrays or lists
+    with unix_ts_ns, market_id, side, price, liquidity and exchange_name keys) into
+    best_bid / best_ask events. Whole columns are converted to python values at
+    once instead of field by field.
+    """
+    to_list = lambda column: column.tolist() \
+        if hasattr(column, "tolist") else list(column)
+
+    rows = zip(*[to_list(columns[name]) for name in
+                 ("unix_ts_ns", "exchange_name", "market_id", "side", "price",
+                  "liquidity")])
+
+    best_bid, best_ask = events.best_bid, events.best_ask
+
+    for unix_ts_ns, exchange_name, market_id, side, price, liquidity in rows:
+        make_event = best_bid if side == "bids" else best_ask
+        yield make_event(unix_ts_ns, exchange_name, market_id, price, liquidity)
+
+
+def outputs_to_columns(outputs):
+    """ Convert pipeline outputs into a dictionary of RESULT_COLUMNS lists, keeping
+    only the RESULT_EVENTS. Fields an event does not have are None.
+    """
+    columns = {name: [] for name in RESULT_COLUMNS}
+
+    for event_name, unix_ts_ns, values in outputs:
+        if event_name not in RESULT_EVENTS:
+            continue
+
+        if event_name == "mid_market_price":
+            price, amount, fee = values["mid_market_price"], None, None
+        elif event_name == "bid_fill" or event_name == "ask_fill":
+            price = values.get("fill_price", values["price"])
+            amount, fee = values["amount"], values["fee"]
+        else:
+            price, amount, fee = None, None, None
+
+        columns["event_name"].append(event_name)
+        columns["unix_ts_ns"].append(unix_ts_ns)
+        columns["exchange_name"].append(values["exchange_name"])
+        columns["market_id"].append(values["market_id"])
+        columns["position_ts"].append(values.get("position_ts"))
+        columns["price"].append(price)
+        columns["amount"].append(amount)
+        columns["fee"].append(fee)
+
+    return columns
+
+
+def row_to_output(row):
+    """ Convert a RESULT_SCHEMA row back into an event Results can collect.
+    """
+    values = {
+        "exchange_name": row.exchange_name,
+        "market_id": row.market_id
+    }
+
+    if row.event_name == "mid_market_price":
+        values["mid_market_price"] = row.price
+    elif row.event_name == "bid_fill" or row.event_name == "ask_fill":
+        values["position_ts"] = row.position_ts
+        values["price"] = row.price
+        values["amount"] = row.amount
+        values["fee"] = row.fee
+    else:
+        values["position_ts"] = row.position_ts
+
+    return (row.event_name, row.unix_ts_ns, values)
+
+
+def batch_to_columns(batch):
+    """ Convert an arrow record batch into a dictionary of numpy columns.
+    """
+    return {name: batch.column(name).to_numpy(zero_copy_only=False)
+            for name in batch.schema.names}
+
+
+def run_arrow_partition(pipeline, batches, instrumentation=None):
+    """ Send a partition's arrow record batches through one pipeline instance,
+    yielding a RESULT_SCHEMA record batch of outputs per input batch. See
+    run_partition for instrumentation.
+    """
+    pyarrow = import_pyarrow()
+    schema = result_arrow_schema(pyarrow)
+
+    if instrumentation is not None:
+        counters = pipeline.enable_instrumentation()
+
+    for batch in batches:
+        columns = batch_to_columns(batch)
+
+        outputs = [output
+                   for event in columns_to_events(columns)
+                   for output in pipeline([event])]
+
+        yield pyarrow.RecordBatch.from_pydict(outputs_to_columns(outputs),
+                                              schema=schema)
+
+    if instrumentation is not None:
+        instrumentation.add(counters)
+
+
+# spark sql / arrow types of the ResultsColumns array typecodes
+COLUMN_TYPES = {
+    "q": ("bigint", "int64"),
+    "b": ("tinyint", "int8"),
+    "d": ("double", "float64")
+}
+
+# typecode of every ResultsColumns column
+COLUMN_TYPECODES = {name: getattr(ResultsColumns(), name).typecode
+                    for name in ResultsColumns.COLUMNS}
+
+# one row per partition: every ResultsColumns column as an array, and the first
+# and last event timestamps
+COLUMNS_SCHEMA = ", ".join(
+    [f"{name} array<{COLUMN_TYPES[COLUMN_TYPECODES[name]][0]}>"
+     for name in ResultsColumns.COLUMNS] +
+    ["first_ts bigint", "last_ts bigint"])
+
+
+def columns_arrow_schema(pyarrow):
+    """ The arrow schema of COLUMNS_SCHEMA.
+    """
+    return pyarrow.schema(
+        [(name, pyarrow.list_(getattr(pyarrow,
+                                      COLUMN_TYPES[COLUMN_TYPECODES[name]][1])()))
+         for name in ResultsColumns.COLUMNS] +
+        [("first_ts", pyarrow.int64()), ("last_ts", pyarrow.int64())])
+
+
+def columns_to_pydict(columns):
+    """ Convert ResultsColumns into a one row dictionary of COLUMNS_SCHEMA lists.
+    """
+    pydict = {name: [getattr(columns, name).tolist()]
+              for name in ResultsColumns.COLUMNS}
+    pydict["first_ts"] = [columns.first_ts]
+    pydict["last_ts"] = [columns.last_ts]
+    return pydict
+
+
+def row_to_columns(row):
+    """ Convert a COLUMNS_SCHEMA row back into ResultsColumns.
+    """
+    columns = ResultsColumns()
+
+    for name in ResultsColumns.COLUMNS:
+        setattr(columns, name,
+                array.array(COLUMN_TYPECODES[name], getattr(row, name) or []))
+
+    columns.first_ts, columns.last_ts = row.first_ts, row.last_ts
+    return columns
+
+
+def collect_partition(pipeline, column_batches, mid_prices=False):
+    """ Send a partition's best bid/ask columns (see columns_to_events), one
+    dictionary of columns per batch, through one pipeline instance and collect the
+    outputs into ResultsColumns.
+    """
+    columns = ResultsColumns(mid_prices)
+
+    for batch in column_batches:
+        columns.collect(output
+                        for event in columns_to_events(batch)
+                        for output in pipeline([event]))
+
+    return columns
+
+
+def run_columns_partition(pipeline, batches, mid_prices=False,
+                          instrumentation=None):
+    """ Send a partition's arrow record batches through one pipeline instance,
+    yielding a single COLUMNS_SCHEMA record batch with the partition's
+    ResultsColumns. See run_partition for instrumentation.
+    """
+    pyarrow = import_pyarrow()
+
+    if instrumentation is not None:
+        counters = pipeline.enable_instrumentation()
+
+    columns = collect_partition(pipeline, (batch_to_columns(batch)
+                                           for batch in batches), mid_prices)
+
+    yield pyarrow.RecordBatch.from_pydict(columns_to_pydict(columns),
+                                          schema=columns_arrow_schema(pyarrow))
+
+    if instrumentation is not None:
+        instrumentation.add(counters)
+
+
+class ArrowSparkEvents(SparkEvents):
+    """ A SparkEvents source that moves data between spark and python as arrow record
+    batches (mapInArrow) instead of one pickled row at a time. Partitions are sent
+    through the pipeline from columnar buffers. pipe_arrow returns the outputs
+    Results needs (RESULT_EVENTS) as arrow batches, and pipe_columns (used by
+    Backtest) collects them into ResultsColumns in each partition so only the
+    columns come back.
+
+    Needs pyspark >= 3.3 with pyarrow.
+    """
+    def partitioned(self):
+        functions = import_spark_functions()
+
+        # cast once in spark so python receives typed columns
+        return super().partitioned().select(
+            functions.col("unix_ts_ns").cast("long"),
+            functions.col("exchange_name").cast("string"),
+            functions.col("market_id").cast("long"),
+            functions.col("side").cast("string"),
+            functions.col("price").cast("double"),
+            functions.col("liquidity").cast("double"))
+
+    def pipe_arrow(self, pipeline):
+        """ Run the pipeline over every partition. Returns a data frame of outputs
+        with the RESULT_SCHEMA.
+        """
+        instrumentation = self._instrumentation
+
+        return self.partitioned().mapInArrow(
+            lambda batches: run_arrow_partition(pipeline, batches, instrumentation),
+            RESULT_SCHEMA)
+
+    def pipe(self, pipeline):
+        """ Run the pipeline over every partition. Returns an RDD of per event lists
+        of outputs (see Results).
+        """
+        return self.pipe_arrow(pipeline).rdd.map(
+            lambda row: [row_to_output(row)])
+
+    def pipe_columns(self, pipeline, mid_prices=False):
+        """ Run the pipeline over every partition and collect each partition's
+        outputs into ResultsColumns in the python worker. Only the columns come back
+        from each partition, as one arrow row (see COLUMNS_SCHEMA), so the outputs are
+        never turned into rows. Returns an RDD of ResultsColumns, one per partition.
+        Backtest uses this instead of pipe.
+        """
+        instrumentation = self._instrumentation
+
+        return self.partitioned().mapInArrow(
+            lambda batches: run_columns_partition(pipeline, batches, mid_prices,
+                                                  instrumentation),
+            COLUMNS_SCHEMA).rdd.map(row_to_columns)
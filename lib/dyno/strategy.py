@@ -1,5 +1,15 @@
-import math
+import bisect
+import collections
+import copy
 import heapq
+import itertools
+import math
+import time
+
+import numpy as np
+
+from .events import MidMarketPrice, MidMarketPriceReturns, Fill
+from .instrumentation import Instrumentation
 
 
 class Strategy:
@@ -13,21 +23,90 @@ class Strategy:
       receive an event's timestamp and values. It returns a list of new events.
     - If a handler is missing then the input event is simply appended to the
       list of output events i.e. "forwarded".
+    - Instrumentation (per event counts and timings, see instrumentation.py) is
+      off unless enabled with enable_instrumentation.
     """
+    # set by enable_instrumentation
+    _instrumentation = None
+
+    # event name -> handler bound to the strategy, set by bind_handlers
+    _bound_handlers = None
+
+    # attributes that are not part of the strategy's state (see get_state)
+    _not_state = frozenset(["_exchanges", "_instrumentation", "_stage_name",
+                            "_bound_handlers"])
+
     def __init__(self, exchanges):
         self._exchanges = exchanges
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # build the handler dispatch table once, when the subclass is defined
+        cls._handlers = cls.build_handler_table()
+
+    @classmethod
+    def build_handler_table(cls):
+        """ Map event names to handler functions by looking up every on_event_name
+        attribute on the class. Subclass overrides and decorated handlers are picked
+        up because the lookup follows the class's method resolution order.
+        """
+        handlers = {}
+
+        for attr_name in dir(cls):
+            if attr_name.startswith("on_"):
+                func = getattr(cls, attr_name)
+
+                if callable(func):
+                    # strip the "on_" prefix to get the event name
+                    handlers[attr_name[3:]] = func
+
+        return handlers
+
+    @classmethod
+    def handles(cls):
+        """ Return the set of event names this strategy has a handler for. Events
+        with any other name are simply forwarded.
+        """
+        return frozenset(cls._handlers)
+
+    def bind_handlers(self):
+        """ Map event names to this strategy's handlers. The handlers are looked up
+        on the strategy itself, so handlers assigned to the instance and static or
+        class method handlers are called like methods are. This is done on the
+        first call: call it again after assigning a handler to a strategy that was
+        already called.
+        """
+        names = set(self._handlers)
+        names.update(name[3:] for name in vars(self) if name.startswith("on_"))
+        handlers = {}
+
+        for event_name in names:
+            func = getattr(self, "on_" + event_name)
+
+            if callable(func):
+                handlers[event_name] = func
+
+        self._bound_handlers = handlers
+        return handlers
+
     def __call__(self, events_in):
+        if self._instrumentation is not None:
+            return self.call_instrumented(events_in)
+
         events_out = []
+        handlers = self._bound_handlers
+
+        if handlers is None:
+            handlers = self.bind_handlers()
 
         for event_name, unix_ts_ns, values in events_in:
-            # derive the handler's name
-            func_name = f"on_{event_name}"
+            # look up the handler in the strategy's dispatch table
+            func = handlers.get(event_name)
 
-            if hasattr(self, func_name):
-                # try to call the input's handler function
+            if func is not None:
+                # call the input's handler function
                 # append outputs to list of outputs
-                func = getattr(self, func_name)
                 events_out.extend(func(unix_ts_ns, values))
 
             else:
@@ -37,6 +116,81 @@ class Strategy:
 
         return events_out
 
+    def call_instrumented(self, events_in):
+        """ The same as __call__ but every input event is counted and timed.
+        """
+        events_out = []
+        handlers = self._bound_handlers
+        record = self._instrumentation.record
+        stage_name = self._stage_name
+        clock, cpu_clock = time.perf_counter_ns, time.process_time_ns
+
+        if handlers is None:
+            handlers = self.bind_handlers()
+
+        for event_name, unix_ts_ns, values in events_in:
+            func = handlers.get(event_name)
+            size = len(events_out)
+            wall_ns, cpu_ns = clock(), cpu_clock()
+
+            if func is not None:
+                events_out.extend(func(unix_ts_ns, values))
+            else:
+                events_out.append((event_name, unix_ts_ns, values))
+
+            record(stage_name, event_name, 1, len(events_out) - size,
+                   func is not None, clock() - wall_ns, cpu_clock() - cpu_ns)
+
+        return events_out
+
+    def enable_instrumentation(self, instrumentation=None, stage_name=None):
+        """ Start counting and timing this strategy's input events, per event name,
+        into an Instrumentation object (a new one by default), under stage_name
+        (the class name by default). Returns the Instrumentation object.
+        """
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+
+        self._instrumentation = instrumentation
+        self._stage_name = type(self).__name__ if stage_name is None else stage_name
+        return instrumentation
+
+    def disable_instrumentation(self):
+        self._instrumentation = None
+
+    def get_instrumentation(self):
+        """ Return the Instrumentation object, or None when instrumentation is off.
+        """
+        return self._instrumentation
+
+    def get_state(self):
+        """ Return the strategy's state: every attribute except the exchanges, which
+        are shared between strategies (see Exchange.get_state), and the
+        instrumentation. The state is not copied.
+        """
+        not_state = self._not_state
+        return {name: value for name, value in vars(self).items()
+                if name not in not_state}
+
+    def set_state(self, state):
+        """ Replace the strategy's state with one returned by get_state.
+        """
+        vars(self).update(state)
+
+        # the state may hold handlers assigned to the instance
+        self._bound_handlers = None
+
+    def snapshot(self):
+        """ Return a copy of the strategy's state. A snapshot can be restored any
+        number of times.
+        """
+        return copy.deepcopy(self.get_state())
+
+    def restore(self, snapshot):
+        """ Go back to the state of a snapshot. The snapshot itself is not changed.
+        """
+        self.set_state(copy.deepcopy(snapshot))
+
     def on_best_bid(self, unix_ts_ns, values):
         return [("best_bid", unix_ts_ns, values)]
 
@@ -44,6 +198,10 @@ class Strategy:
         return [("best_ask", unix_ts_ns, values)]
 
 
+# the base class is not a subclass of itself so build its table here
+Strategy._handlers = Strategy.build_handler_table()
+
+
 class DataStrategy(Strategy):
     """ The data strategy receives best_bid and best_ask events and returns
     mid_market_price and mid_market_price_returns events. It also updates the best
@@ -58,6 +216,14 @@ class DataStrategy(Strategy):
     3)
     The current and previous mid market prices are stored to that the mid market
     returns can be calculated: (curr - prev) / prev
+    4)
+    on_l2_snapshot / on_l2_delta -> update full depth book on exchange ->
+    calculate mid market price -> calculate mid market price returns
+    5)
+    on_best_bid_ask_block -> compute_block -> mid_market_price_block
+    A block is many best bid/ask updates for one exchange given as numpy arrays.
+    The mid market prices and returns for the whole block are computed with numpy,
+    continuing from (and updating) the same per market state as the per event path.
     """
     def __init__(self, exchanges):
         super().__init__(exchanges)
@@ -89,12 +255,11 @@ class DataStrategy(Strategy):
                 # return output of decorated function + mid market
                 # returns (linear and log) event
                 return events + [
-                    ("mid_market_price_returns", unix_ts_ns, {
-                        "market_id": market_id,
-                        "exchange_name": exchange_name,
-                        "lin": (curr - prev) / prev,
-                        "log": math.log(curr / prev)
-                    })
+                    ("mid_market_price_returns", unix_ts_ns, MidMarketPriceReturns(
+                        market_id,
+                        exchange_name,
+                        (curr - prev) / prev,
+                        math.log(curr / prev)))
                 ]
 
             else:
@@ -137,11 +302,10 @@ class DataStrategy(Strategy):
                 # return output of decorated function + mid market
                 # price change event
                 return events + [
-                    ("mid_market_price", unix_ts_ns, {
-                        "market_id": market_id,
-                        "exchange_name": exchange_name,
-                        "mid_market_price": midm
-                    })
+                    ("mid_market_price", unix_ts_ns, MidMarketPrice(
+                        market_id,
+                        exchange_name,
+                        midm))
                 ]
 
             else:
@@ -151,6 +315,167 @@ class DataStrategy(Strategy):
             
         return compute
 
+    @staticmethod
+    def forward_fill(initial, values, is_set):
+        """ Return values where every unset entry is replaced by the most recent set
+        entry before it, or by initial if there is none. Unset means nan.
+        """
+        values = np.concatenate(([initial], np.where(is_set, values, np.nan)))
+        is_set = np.concatenate(([True], is_set))
+
+        # index of the most recent set entry at each position
+        last_set = np.maximum.accumulate(
+            np.where(is_set, np.arange(len(values)), 0))
+
+        return values[last_set][1:]
+
+    def compute_block(self, exchange_name, unix_ts_ns, market_ids, is_bid, prices,
+                      liquidity):
+        """ Apply a block of best bid/ask updates for one exchange and compute the mid
+        market prices and returns for every update. Gives the same results as
+        calling on_best_bid/on_best_ask once per update (log returns may differ in
+        the last bit), and leaves the exchange's books and this strategy's mid
+        market prices in the same state.
+
+        - unix_ts_ns, market_ids, prices, liquidity: arrays with one entry per update
+        - is_bid: boolean array, True for a best bid update and False for a best ask
+
+        Returns a dictionary of arrays with one entry per update: the input
+        unix_ts_ns and market_id, plus mid_market_price, lin and log which are nan
+        where the per event path would not have produced the corresponding event.
+        """
+        exchange = self._exchanges[exchange_name]
+
+        unix_ts_ns = np.asarray(unix_ts_ns, dtype=np.int64)
+        market_ids = np.asarray(market_ids)
+        is_bid = np.asarray(is_bid, dtype=bool)
+        prices = np.asarray(prices, dtype=np.float64)
+        liquidity = np.asarray(liquidity, dtype=np.float64)
+
+        if np.any(liquidity < 0):
+            raise Exception("best bid/ask liquidity cannot be negative")
+
+        n = len(unix_ts_ns)
+        mids = np.full(n, np.nan)
+        lin = np.full(n, np.nan)
+        log = np.full(n, np.nan)
+
+        # group the updates by market, keeping each market's updates in order
+        order = np.argsort(market_ids, kind="stable")
+        markets, starts = np.unique(market_ids[order], return_index=True)
+
+        for market_id, rows in zip(markets.tolist(), np.split(order, starts[1:])):
+            # best bid/ask prices before this block
+            if exchange.has_order_book(market_id):
+                bid_price = exchange.get_best_bid_price(market_id)
+                ask_price = exchange.get_best_ask_price(market_id)
+            else:
+                bid_price, ask_price = None, None
+
+            # best bid/ask price after each update
+            bids = DataStrategy.forward_fill(
+                np.nan if bid_price is None else bid_price,
+                prices[rows],
+                is_bid[rows])
+            asks = DataStrategy.forward_fill(
+                np.nan if ask_price is None else ask_price,
+                prices[rows],
+                ~is_bid[rows])
+
+            # a mid market price exists once both sides are set
+            market_mids = (bids + asks) / 2
+            has_mid = ~np.isnan(market_mids)
+            mid_rows = rows[has_mid]
+            mids[mid_rows] = market_mids[has_mid]
+
+            # each mid market price's previous mid market price
+            curr = self._curr_mid_market_prices.get(market_id)
+            prev_mids = np.concatenate((
+                [np.nan if curr is None else curr],
+                market_mids[has_mid][:-1]))
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lin[mid_rows] = (mids[mid_rows] - prev_mids) / prev_mids
+                log[mid_rows] = np.log(mids[mid_rows] / prev_mids)
+
+            # carry the mid market prices over to the next block
+            if len(mid_rows) > 0:
+                prev = prev_mids[-1]
+                self._prev_mid_market_prices[market_id] = \
+                    None if np.isnan(prev) else float(prev)
+                self._curr_mid_market_prices[market_id] = float(mids[mid_rows[-1]])
+
+            # leave the exchange's book at the last bid and ask
+            bid_rows = rows[is_bid[rows]]
+            ask_rows = rows[~is_bid[rows]]
+
+            if len(bid_rows) > 0:
+                exchange.set_best_bid(market_id,
+                                      prices[bid_rows[-1]],
+                                      liquidity[bid_rows[-1]])
+
+            if len(ask_rows) > 0:
+                exchange.set_best_ask(market_id,
+                                      prices[ask_rows[-1]],
+                                      liquidity[ask_rows[-1]])
+
+        return {
+            "unix_ts_ns": unix_ts_ns,
+            "market_id": market_ids,
+            "mid_market_price": mids,
+            "lin": lin,
+            "log": log
+        }
+
+    def on_best_bid_ask_block(self, unix_ts_ns, values):
+        """ Handle a block of best bid/ask updates. The values are the arguments of
+        compute_block. Returns one mid_market_price_block event holding the arrays
+        returned by compute_block, plus the exchange name.
+
+        Note: the exchange's books are left at their state after the last update in
+        the block, so later stages see the book as of the end of the block.
+        """
+        block = self.compute_block(values["exchange_name"],
+                                   values["unix_ts_ns"],
+                                   values["market_id"],
+                                   values["is_bid"],
+                                   values["price"],
+                                   values["liquidity"])
+
+        return [
+            ("mid_market_price_block", unix_ts_ns, {
+                **block,
+                "exchange_name": values["exchange_name"]
+            })
+        ]
+
+    @mid_market_price_returns
+    @mid_market_price
+    def on_l2_snapshot(self, unix_ts_ns, values):
+        exchange = self._exchanges[values["exchange_name"]]
+
+        # replace the market's order book with the snapshot's
+        # (price, liquidity) levels
+        exchange.apply_l2_snapshot(values["market_id"],
+                                   values["bids"],
+                                   values["asks"])
+
+        return [("l2_snapshot", unix_ts_ns, values)]
+
+    @mid_market_price_returns
+    @mid_market_price
+    def on_l2_delta(self, unix_ts_ns, values):
+        exchange = self._exchanges[values["exchange_name"]]
+
+        # update one price level on one side of the market's
+        # order book, zero liquidity deletes the level
+        exchange.apply_l2_delta(values["market_id"],
+                                values["side"],
+                                values["price"],
+                                values["liquidity"])
+
+        return [("l2_delta", unix_ts_ns, values)]
+
     @mid_market_price_returns
     @mid_market_price
     def on_best_bid(self, unix_ts_ns, values):
@@ -241,7 +566,7 @@ class RiskStrategy(Strategy):
             # the fraction of available quote balance to use
             # and the fee for removing that liquidity from the order book
             amount = balance * fraction
-            fee = exchange.get_taker_quoted_fee(amount)
+            fee = exchange.get_taker_quoted_fee(amount, market_id, unix_ts_ns)
 
             # need to make sure amount is between min/max bounds
             # and account can cover trade fee (amount + fee)
@@ -288,60 +613,165 @@ class RiskStrategy(Strategy):
 class Queue:
     """ Base class for bid and ask queues. The queues are used to queue one or more
     pending orders to be executed against the order book.
+
+    Pending orders are indexed by order id. The heap holds (key, seq, order_id)
+    entries: the sequence number breaks ties between orders with the same price in
+    FIFO order, so the order values are never compared. Cancelled and amended
+    orders leave stale entries in the heap that are skipped when they reach the
+    head, so append, cancel and amend are all O(log n).
+
+    The heap is ordered by sign * price: +1 executes the lowest price first, -1 the
+    highest price first.
     """
-    def __init__(self):
+    def __init__(self, sign):
+        self._sign = sign
         self._items = []
+        self._orders = {}
+        self._seq = 0
 
     def __len__(self):
-        return len(self._items)
+        return len(self._orders)
 
     def __iter__(self):
-        return self._items
+        """ Iterate over the pending orders' values in execution order.
+        """
+        orders = self._orders
+
+        for _, seq, order_id in sorted(self._items):
+            entry = orders.get(order_id)
+
+            if entry is not None and entry[0] == seq:
+                yield entry[2]
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
 
     def is_empty(self):
         return len(self) == 0
 
+    def sort_key(self, price):
+        return self._sign * price
 
-class BidQueue(Queue):
-    """ Wraps a min heap queue. Pending orders with the lowest price will be executed
-    first, because the bids side is descending order.
-    """
-    def __init__(self):
-        super().__init__()
+    def push(self, order_id, price, values):
+        seq = self._seq
+        self._seq += 1
+        self._orders[order_id] = (seq, price, values)
+        heapq.heappush(self._items, (self.sort_key(price), seq, order_id))
+
+    def append(self, price, values, order_id=None):
+        """ Append a new order to the queue, ordered by "price" and then by time of
+        arrival. Returns the order's id: if no id is given, a new object that cannot
+        be equal to the ids of other orders.
+        """
+        if order_id is None:
+            order_id = object()
+
+        if order_id in self._orders:
+            raise Exception(f"order {order_id} is already in the queue")
+
+        self.push(order_id, price, values)
+        return order_id
+
+    def cancel(self, order_id):
+        """ Remove an order from the queue. Returns its values, or None if there
+        is no order with this id.
+        """
+        entry = self._orders.pop(order_id, None)
+
+        if entry is None:
+            return None
+
+        # rebuild the heap once it is mostly stale entries
+        if len(self._items) > 2 * len(self._orders) + 32:
+            self.compact()
+
+        return entry[2]
+
+    def amend(self, order_id, price=None, values=None):
+        """ Amend an order's price and/or values. An order keeps its place in the
+        queue unless its price changes, in which case it goes to the back of the
+        queue at its new price.
+        """
+        entry = self._orders.get(order_id)
+
+        if entry is None:
+            raise Exception(f"order {order_id} is not in the queue")
+
+        seq, old_price, old_values = entry
+        values = old_values if values is None else values
+
+        if price is None or price == old_price:
+            self._orders[order_id] = (seq, old_price, values)
+        else:
+            self.push(order_id, price, values)
+
+            # the order's previous entry is now stale
+            if len(self._items) > 2 * len(self._orders) + 32:
+                self.compact()
+
+    def compact(self):
+        """ Drop stale entries from the heap.
+        """
+        orders = self._orders
+        self._items = [(self.sort_key(price), seq, order_id)
+                       for order_id, (seq, price, _) in orders.items()]
+        heapq.heapify(self._items)
 
-    def append(self, price, values):
-        """ Append a new event to the queue, ordered by "price".
-        Note: the min heap will order events such that the lowest price comes first.
+    def discard_stale(self):
+        """ Pop stale entries from the head of the heap.
         """
-        key = +price
-        heapq.heappush(self._items, (key, values))
+        items, orders = self._items, self._orders
+
+        while items:
+            _, seq, order_id = items[0]
+            entry = orders.get(order_id)
+
+            if entry is not None and entry[0] == seq:
+                break
+
+            heapq.heappop(items)
+
+    def peek_id(self):
+        """ Return the id of the order at the head of the queue without removing it,
+        or None if the queue is empty.
+        """
+        self.discard_stale()
+        return self._items[0][2] if self._items else None
+
+    def peek(self):
+        """ Return the values of the order at the head of the queue without removing
+        it, or None if the queue is empty.
+        """
+        order_id = self.peek_id()
+        return None if order_id is None else self._orders[order_id][2]
 
     def pop(self):
         """ Pop from the queue returning only the event's values.
         """
-        _, values = heapq.heappop(self._items)
+        self.discard_stale()
+        _, _, order_id = heapq.heappop(self._items)
+        _, _, values = self._orders.pop(order_id)
         return values
 
 
+class BidQueue(Queue):
+    """ Wraps a min heap queue. Pending orders with the lowest price will be executed
+    first, because the bids side is descending order.
+    """
+    def __init__(self):
+        # Note: the min heap will order events such that the lowest price comes
+        # first.
+        super().__init__(+1)
+
+
 class AskQueue(Queue):
     """ Wraps a max heap. Pending orders with the highest price will be executed
     first, because the ask side is ascending order.
     """
     def __init__(self):
-        super().__init__()
-
-    def append(self, price, values):
-        """ Append a new event to the queue, ordered by "price".
-        Note: the max heap will order events such that the highest price comes first.
-        """
-        key = -price
-        heapq.heappush(self._items, (key, values))
-
-    def pop(self):
-        """ Pop from the queue returning only the event's values.
-        """
-        _, values = heapq.heappop(self._items)
-        return values
+        # Note: the max heap will order events such that the highest price comes
+        # first.
+        super().__init__(-1)
 
 
 class ExecutionStrategy(Strategy):
@@ -355,25 +785,56 @@ class ExecutionStrategy(Strategy):
     bids_queue, whilst a "short" takes from the bids side and is scheduled on
     the asks_queue.
 
+    Note: pending orders are partitioned by order book i.e. (exchange_name,
+    market_id), so an order book update only triggers matches for the orders on
+    that order book.
+
     1)
     on_best_bid -> trigger_bid_matches
     2)
     on_best_ask -> trigger_ask_matches
+    3)
+    on_l2_snapshot / on_l2_delta -> trigger_ask_matches -> trigger_bid_matches
     """
     def __init__(self, exchanges):
         super().__init__(exchanges)
-        self._bid_queue = BidQueue()
-        self._ask_queue = AskQueue()
+        self._bid_queues = {}
+        self._ask_queues = {}
+
+    def get_bid_queue(self, exchange_name, market_id):
+        """ Return the bid queue for an order book, creating it if needed.
+        """
+        key = (exchange_name, market_id)
+        queue = self._bid_queues.get(key)
+
+        if queue is None:
+            queue = BidQueue()
+            self._bid_queues[key] = queue
+
+        return queue
+
+    def get_ask_queue(self, exchange_name, market_id):
+        """ Return the ask queue for an order book, creating it if needed.
+        """
+        key = (exchange_name, market_id)
+        queue = self._ask_queues.get(key)
+
+        if queue is None:
+            queue = AskQueue()
+            self._ask_queues[key] = queue
+
+        return queue
 
     @staticmethod
-    def match(exchange, next_order, best_price, liquidity):
+    def match(exchange, next_order, best_price, liquidity, unix_ts_ns=None):
         # set amount to fill entirely / partial fill
         amount = next_order["remaining"] \
             if liquidity >= next_order["remaining"] / best_price \
             else liquidity * best_price
 
         # calculate fee
-        fee = exchange.get_taker_quoted_fee(amount)
+        fee = exchange.get_taker_quoted_fee(amount, next_order["market_id"],
+                                            unix_ts_ns)
 
         # subtract fee from account balance
         exchange.sub_from_balance(
@@ -395,45 +856,61 @@ class ExecutionStrategy(Strategy):
             # an order can have multiple fills
             fills = []
 
+            # only the orders on the updated order book can match
+            queue = self._bid_queues.get(
+                (values["exchange_name"], values["market_id"]))
+
+            if queue is None:
+                return events
+
+            exchange = self._exchanges[values["exchange_name"]]
+
             should_stop = False
-            while not (self._bid_queue.is_empty() or should_stop):
+            while not (queue.is_empty() or should_stop):
                 # match against bid queue
+                # (peek first: an order is only popped once it has filled)
                 # ordered by price: lowest -> highest
-                next_order = self._bid_queue.pop()
-                exchange = self._exchanges[next_order["exchange_name"]]
+                next_order = queue.peek()
 
                 # current best price and liquidity available
                 best_price, liquidity = \
                     exchange.get_best_bid(next_order["market_id"])
 
-                if best_price >= next_order["price"] and liquidity > 0:
+                if best_price is not None and \
+                   best_price >= next_order["price"] and liquidity > 0:
                     # match against the order book
                     amount, fee = ExecutionStrategy.match(
                         exchange,
                         next_order,
                         best_price,
-                        liquidity)
+                        liquidity,
+                        unix_ts_ns)
 
                     # subtract amount from remaining
                     next_order["remaining"] -= amount
 
+                    # count the fill towards volume based fees
+                    exchange.record_volume(unix_ts_ns, amount)
+
                     # subtract amount from book's available liquidity
+                    # (never more than is available: amount / best_price can
+                    # round to just above the liquidity on a full take)
                     exchange.remove_bid_liquidity(
                         next_order["market_id"],
-                        amount / best_price)
+                        min(amount / best_price, liquidity))
 
                     # log fill event
-                    fills.append(("bid_fill", unix_ts_ns, {
-                        **next_order,
-                        "amount": amount,
-                        "fee": fee
-                    }))
-
-                    # the order did not execute in full so add it back to queue
-                    if next_order["remaining"] > 0:
-                        self._bid_queue.append(
-                            next_order["price"],
-                            next_order)
+                    # (the fill refers to the order rather than copying it)
+                    fills.append(("bid_fill", unix_ts_ns, Fill(
+                        next_order,
+                        amount,
+                        fee,
+                        best_price,
+                        next_order["remaining"])))
+
+                    # the order executed in full so remove it from the queue
+                    if next_order["remaining"] <= 0:
+                        queue.pop()
 
                 else:
                     should_stop = True
@@ -450,45 +927,61 @@ class ExecutionStrategy(Strategy):
             # an order can have multiple fills
             fills = []
 
+            # only the orders on the updated order book can match
+            queue = self._ask_queues.get(
+                (values["exchange_name"], values["market_id"]))
+
+            if queue is None:
+                return events
+
+            exchange = self._exchanges[values["exchange_name"]]
+
             should_stop = False
-            while not (self._ask_queue.is_empty() or should_stop):
+            while not (queue.is_empty() or should_stop):
                 # match against ask queue
+                # (peek first: an order is only popped once it has filled)
                 # ordered by price: highest -> lowest
-                next_order = self._ask_queue.pop()
-                exchange = self._exchanges[next_order["exchange_name"]]
+                next_order = queue.peek()
 
                 # current best price and liquidity available
                 best_price, liquidity = \
                     exchange.get_best_ask(next_order["market_id"])
 
-                if best_price <= next_order["price"] and liquidity > 0:
+                if best_price is not None and \
+                   best_price <= next_order["price"] and liquidity > 0:
                     # match against the order book
                     amount, fee = ExecutionStrategy.match(
                         exchange,
                         next_order,
                         best_price,
-                        liquidity)
+                        liquidity,
+                        unix_ts_ns)
 
                     # subtract amount from remaining
                     next_order["remaining"] -= amount
 
+                    # count the fill towards volume based fees
+                    exchange.record_volume(unix_ts_ns, amount)
+
                     # subtract amount from book's available liquidity
+                    # (never more than is available: amount / best_price can
+                    # round to just above the liquidity on a full take)
                     exchange.remove_ask_liquidity(
                         next_order["market_id"],
-                        amount / best_price)
+                        min(amount / best_price, liquidity))
 
                     # log fill event
-                    fills.append(("ask_fill", unix_ts_ns, {
-                        **next_order,
-                        "amount": amount,
-                        "fee": fee
-                    }))
-
-                    # the order did not execute in full so add it back to queue
-                    if next_order["remaining"] > 0:
-                        self._ask_queue.append(
-                            next_order["price"],
-                            next_order)
+                    # (the fill refers to the order rather than copying it)
+                    fills.append(("ask_fill", unix_ts_ns, Fill(
+                        next_order,
+                        amount,
+                        fee,
+                        best_price,
+                        next_order["remaining"])))
+
+                    # the order executed in full so remove it from the queue
+                    if next_order["remaining"] <= 0:
+                        queue.pop()
 
                 else:
                     should_stop = True
@@ -505,6 +998,16 @@ class ExecutionStrategy(Strategy):
     def on_best_ask(self, unix_ts_ns, values):
         return super().on_best_ask(unix_ts_ns, values)
 
+    @trigger_bid_matches
+    @trigger_ask_matches
+    def on_l2_snapshot(self, unix_ts_ns, values):
+        return [("l2_snapshot", unix_ts_ns, values)]
+
+    @trigger_bid_matches
+    @trigger_ask_matches
+    def on_l2_delta(self, unix_ts_ns, values):
+        return [("l2_delta", unix_ts_ns, values)]
+
 
 class EntryStrategy(ExecutionStrategy):
     """ The entry strategy extends the base execution strategy. It defines handlers
@@ -521,7 +1024,9 @@ class EntryStrategy(ExecutionStrategy):
     @ExecutionStrategy.trigger_bid_matches
     def on_take_from_bids(self, unix_ts_ns, values):
         # take from bids by appending to bid queue
-        self._bid_queue.append(
+        queue = self.get_bid_queue(values["exchange_name"],
+                                   values["market_id"])
+        queue.append(
             values["price"],
             {
                 **values,
@@ -539,7 +1044,9 @@ class EntryStrategy(ExecutionStrategy):
     @ExecutionStrategy.trigger_ask_matches
     def on_take_from_asks(self, unix_ts_ns, values):
         # take from asks by appending to ask queue
-        self._ask_queue.append(
+        queue = self.get_ask_queue(values["exchange_name"],
+                                   values["market_id"])
+        queue.append(
             values["price"],
             {
                 **values,
@@ -723,13 +1230,15 @@ class PositionStrategy(Strategy):
     def on_bid_fill(self, unix_ts_ns, values):
         # get position's fills
         ts = values["position_ts"]
-        fills = self._open_shorts[ts]["fills"]
+        position = self._open_shorts.get(ts)
 
         # append to position's fills
-        fills.append({
-            "price": values["price"],
-            "amount": values["amount"]
-        })
+        # (an order can still fill after its position has been closed)
+        if position is not None:
+            position["fills"].append({
+                "price": values["price"],
+                "amount": values["amount"]
+            })
 
         return [
             ("bid_fill", unix_ts_ns, values)
@@ -738,13 +1247,15 @@ class PositionStrategy(Strategy):
     def on_ask_fill(self, unix_ts_ns, values):
         # get position's fills
         ts = values["position_ts"]
-        fills = self._open_longs[ts]["fills"]
+        position = self._open_longs.get(ts)
 
         # append to position's fills
-        fills.append({
-            "price": values["price"],
-            "amount": values["amount"]
-        })
+        # (an order can still fill after its position has been closed)
+        if position is not None:
+            position["fills"].append({
+                "price": values["price"],
+                "amount": values["amount"]
+            })
 
         return [
             ("ask_fill", unix_ts_ns, values)
@@ -772,10 +1283,15 @@ class ExitStrategy(ExecutionStrategy):
     @ExecutionStrategy.trigger_bid_matches
     def on_give_to_bids(self, unix_ts_ns, values):
         # give to bids by appending to bids queue
-        self._bid_queue.append({
-            **values,
-            "remaining": values["amount"]
-        })
+        queue = self.get_bid_queue(values["exchange_name"],
+                                   values["market_id"])
+        queue.append(
+            values["price"],
+            {
+                **values,
+                "remaining": values["amount"]
+            }
+        )
 
         return [
             ("exit_bid_queue_append", unix_ts_ns, {
@@ -787,10 +1303,15 @@ class ExitStrategy(ExecutionStrategy):
     @ExecutionStrategy.trigger_ask_matches
     def on_give_to_asks(self, unix_ts_ns, values):
         # give to asks by appending to asks queue
-        self._ask_queue.append({
-            **values,
-            "remaining": values["amount"]
-        })
+        queue = self.get_ask_queue(values["exchange_name"],
+                                   values["market_id"])
+        queue.append(
+            values["price"],
+            {
+                **values,
+                "remaining": values["amount"]
+            }
+        )
 
         return [
             ("exit_ask_queue_append", unix_ts_ns, {
@@ -798,3 +1319,387 @@ class ExitStrategy(ExecutionStrategy):
                 "initial_amount": values["amount"]
             })
         ]
+
+
+class RestingOrder:
+    """ A resting (limit) order in a PriceLevelQueue. Sizes are in base currency
+    units, the same units as order book liquidity.
+
+    - values: the order's values e.g. market_id, price, amount
+    - size: the order's size
+    - start: how much liquidity must trade at the price level before this order
+      is reached, or None if not known yet
+    - filled: how much of the order has been filled
+    """
+    __slots__ = ("values", "size", "start", "filled")
+
+    def __init__(self, values, size, start):
+        self.values = values
+        self.size = size
+        self.start = start
+        self.filled = 0.0
+
+
+class PriceLevelQueue:
+    """ A FIFO queue of resting orders at one price level. Also counts the
+    liquidity that has traded at this price level (while it was the best level),
+    so an order's position in the queue is a point on that running total: the
+    order fills once the running total passes its start.
+
+    Orders whose start is not known yet (see RestingOrderSide.add) are always the
+    last "unplaced" orders in the queue.
+    """
+    __slots__ = ("orders", "traded", "unplaced")
+
+    def __init__(self):
+        self.orders = collections.deque()
+        self.traded = 0.0
+        self.unplaced = 0
+
+    def end(self):
+        """ Where the last order in the queue ends, or None if not known.
+        """
+        if not self.orders:
+            return None
+
+        last = self.orders[-1]
+        return None if last.start is None else last.start + last.size
+
+    def fill(self):
+        """ Fill orders from the front of the queue up to the traded liquidity.
+        Returns a list of (order, size filled) pairs.
+        """
+        fills = []
+        orders, traded = self.orders, self.traded
+
+        while orders and orders[0].start is not None:
+            order = orders[0]
+
+            # everything traded past the order's start fills the order
+            filled = min(max(traded - order.start, 0.0), order.size)
+
+            if filled > order.filled:
+                fills.append((order, filled - order.filled))
+                order.filled = filled
+
+            if order.filled >= order.size:
+                orders.popleft()
+            else:
+                break
+
+        return fills
+
+    def fill_all(self):
+        """ Fill every order in the queue in full.
+        """
+        fills = []
+
+        for order in self.orders:
+            fills.append((order, order.size - order.filled))
+            order.filled = order.size
+
+        self.orders.clear()
+        self.unplaced = 0
+        return fills
+
+    def place(self, liquidity):
+        """ Give the unplaced orders their start: behind the liquidity visible at
+        the level (or behind the previous order).
+        """
+        orders = self.orders
+        end = self.traded + liquidity
+
+        first = len(orders) - self.unplaced
+        if first > 0:
+            previous = orders[first - 1]
+            end = max(end, previous.start + previous.size)
+
+        for i in range(first, len(orders)):
+            order = orders[i]
+            order.start = end
+            end = order.start + order.size
+
+        self.unplaced = 0
+
+
+class RestingOrderSide:
+    """ The resting orders on one side ("bids" or "asks") of one order book, held in
+    one PriceLevelQueue per price level. The level prices are kept in a sorted list
+    (see DepthOrderBook) so that the levels traded through by a price move are found
+    without scanning the other levels.
+
+    Queue position is estimated from best bid/ask updates: an order joins behind the
+    liquidity visible at its price, and any decrease of the visible liquidity at the
+    best level is assumed to be liquidity traded ahead of the order.
+    """
+    def __init__(self, side):
+        self._side = side
+        self._levels = {}
+        self._keys = []
+        self._best = (None, None)
+        self._prices = {}
+
+    def __len__(self):
+        return len(self._prices)
+
+    def sort_key(self, price):
+        return +price if self._side == "bids" else -price
+
+    def add(self, order_id, price, values, size):
+        """ Add an order to the back of the queue at its price level.
+        """
+        level = self._levels.get(price)
+
+        if level is None:
+            level = PriceLevelQueue()
+            self._levels[price] = level
+            bisect.insort(self._keys, self.sort_key(price))
+
+        best_price, best_liquidity = self._best
+
+        if best_price is None or \
+           self.sort_key(price) < self.sort_key(best_price):
+            # behind the best level: the liquidity ahead is not known yet
+            start = None
+        elif price == best_price:
+            # join behind the visible liquidity
+            start = level.traded + best_liquidity
+        else:
+            # better than the best level: nothing ahead
+            start = level.traded
+
+        # join behind our own orders at this level
+        end = level.end()
+        if start is not None and end is not None:
+            start = max(start, end)
+
+        if start is None:
+            level.unplaced += 1
+
+        level.orders.append(RestingOrder(values, size, start))
+        self._prices[order_id] = price
+
+    def cancel(self, order_id):
+        """ Remove an order. Returns False if there is no order with this id.
+        """
+        price = self._prices.pop(order_id, None)
+
+        if price is None:
+            return False
+
+        level = self._levels.get(price)
+
+        if level is None:
+            # the level has already traded
+            return False
+
+        orders = level.orders
+        index = next((i for i, order in enumerate(orders)
+                      if order.values["order_id"] == order_id), None)
+
+        if index is None:
+            return False
+
+        order = orders[index]
+        del orders[index]
+
+        if order.start is None:
+            level.unplaced -= 1
+        else:
+            # orders behind the cancelled order move up the queue
+            shift = order.size - order.filled
+
+            for behind in itertools.islice(orders, index, None):
+                if behind.start is not None:
+                    behind.start -= shift
+
+        if not orders:
+            self.remove_level(price)
+
+        return True
+
+    def remove_level(self, price):
+        del self._levels[price]
+        del self._keys[bisect.bisect_left(self._keys, self.sort_key(price))]
+
+    def fill_levels_through(self, price):
+        """ Fill every order at a price level better than "price" in full.
+        """
+        fills = []
+        key = self.sort_key(price)
+
+        while self._keys and self._keys[-1] > key:
+            level_price = abs(self._keys[-1])
+            fills.extend(self._levels[level_price].fill_all())
+            self.remove_level(level_price)
+
+        return fills
+
+    def update_best(self, price, liquidity):
+        """ Update the side's best price and liquidity. Returns the resulting
+        (order, size filled) pairs.
+        """
+        # levels better than the new best price have traded
+        fills = self.fill_levels_through(price)
+
+        level = self._levels.get(price)
+
+        if level is not None:
+            prev_price, prev_liquidity = self._best
+
+            if prev_price == price and liquidity < prev_liquidity:
+                # liquidity disappeared from the best level
+                level.traded += prev_liquidity - liquidity
+
+            # orders that joined behind the best level find their place
+            if level.unplaced:
+                level.place(liquidity)
+
+            fills.extend(level.fill())
+
+            if not level.orders:
+                self.remove_level(price)
+
+        self._best = (price, liquidity)
+
+        # forget filled orders
+        for order, _ in fills:
+            if order.filled >= order.size:
+                self._prices.pop(order.values["order_id"], None)
+
+        return fills
+
+    def cross(self, opposite_price):
+        """ The opposite side's best price moved to "opposite_price": fill every
+        order it crosses in full.
+        """
+        # step just past the opposite price so orders at it are included
+        if self._side == "bids":
+            fills = self.fill_levels_through(math.nextafter(opposite_price, -math.inf))
+        else:
+            fills = self.fill_levels_through(math.nextafter(opposite_price, math.inf))
+
+        for order, _ in fills:
+            self._prices.pop(order.values["order_id"], None)
+
+        return fills
+
+
+class MakerStrategy(Strategy):
+    """ The maker strategy simulates resting limit orders. Orders join the back of
+    the queue at their price level and are filled once the liquidity ahead of them
+    has traded, or immediately if the market trades through (or crosses) their
+    price. Fills are charged maker fees.
+
+    1)
+    on_join_bids -> rest a buy order on the bids side -> resting_bid_placed
+    2)
+    on_join_asks -> rest a sell order on the asks side -> resting_ask_placed
+    3)
+    on_cancel_resting_order -> remove the order -> resting_order_cancelled
+    4)
+    on_best_bid -> update queue positions on the bids side / check asks crossed ->
+    bid_maker_fill / ask_maker_fill
+    5)
+    on_best_ask -> update queue positions on the asks side / check bids crossed ->
+    ask_maker_fill / bid_maker_fill
+
+    Note: the order's "amount" is quoted in the quote currency, like take_from_*
+    orders. Orders need an "order_id" value, otherwise one is assigned.
+    """
+    def __init__(self, exchanges):
+        super().__init__(exchanges)
+        self._resting = {}
+        self._next_order_id = 0
+
+    def get_resting_orders(self, exchange_name, market_id):
+        """ Return the (bids, asks) RestingOrderSide objects for an order book.
+        """
+        key = (exchange_name, market_id)
+        sides = self._resting.get(key)
+
+        if sides is None:
+            sides = (RestingOrderSide("bids"), RestingOrderSide("asks"))
+            self._resting[key] = sides
+
+        return sides
+
+    def settle(self, unix_ts_ns, event_name, fills):
+        """ Charge the maker fee for each (order, size filled) pair, update the
+        account balances and return the fill events.
+        """
+        events = []
+
+        for order, size in fills:
+            values = order.values
+            exchange = self._exchanges[values["exchange_name"]]
+            price = values["price"]
+            amount = size * price
+
+            # calculate fee
+            fee = exchange.get_maker_quoted_fee(amount, values["market_id"],
+                                                unix_ts_ns)
+            exchange.record_volume(unix_ts_ns, amount)
+
+            # subtract fee from account balance
+            exchange.sub_from_balance(values["quote_currency"], fee)
+
+            # add amount to account balance
+            exchange.add_to_balance(values["base_currency"], size)
+
+            remaining = (order.size - order.filled) * price
+            events.append((event_name, unix_ts_ns,
+                           Fill(values, amount, fee, price, remaining)))
+
+        return events
+
+    def join(self, side, event_name, unix_ts_ns, values):
+        if "order_id" not in values:
+            values = {**values, "order_id": self._next_order_id}
+            self._next_order_id += 1
+
+        bids, asks = self.get_resting_orders(values["exchange_name"],
+                                             values["market_id"])
+        resting = bids if side == "bids" else asks
+        resting.add(values["order_id"],
+                    float(values["price"]),
+                    values,
+                    values["amount"] / values["price"])
+
+        return [(event_name, unix_ts_ns, values)]
+
+    def on_join_bids(self, unix_ts_ns, values):
+        return self.join("bids", "resting_bid_placed", unix_ts_ns, values)
+
+    def on_join_asks(self, unix_ts_ns, values):
+        return self.join("asks", "resting_ask_placed", unix_ts_ns, values)
+
+    def on_cancel_resting_order(self, unix_ts_ns, values):
+        bids, asks = self.get_resting_orders(values["exchange_name"],
+                                             values["market_id"])
+        order_id = values["order_id"]
+
+        if bids.cancel(order_id) or asks.cancel(order_id):
+            return [("resting_order_cancelled", unix_ts_ns, values)]
+        else:
+            return []
+
+    def on_best_bid(self, unix_ts_ns, values):
+        bids, asks = self.get_resting_orders(values["exchange_name"],
+                                             values["market_id"])
+        price, liquidity = float(values["price"]), float(values["liquidity"])
+
+        return super().on_best_bid(unix_ts_ns, values) \
+            + self.settle(unix_ts_ns, "bid_maker_fill",
+                          bids.update_best(price, liquidity)) \
+            + self.settle(unix_ts_ns, "ask_maker_fill", asks.cross(price))
+
+    def on_best_ask(self, unix_ts_ns, values):
+        bids, asks = self.get_resting_orders(values["exchange_name"],
+                                             values["market_id"])
+        price, liquidity = float(values["price"]), float(values["liquidity"])
+
+        return super().on_best_ask(unix_ts_ns, values) \
+            + self.settle(unix_ts_ns, "ask_maker_fill",
+                          asks.update_best(price, liquidity)) \
+            + self.settle(unix_ts_ns, "bid_maker_fill", bids.cross(price))
@@ -0,0 +1,244 @@
+import csv
+import heapq
+import json
+import os
+
+import numpy as np
+
+from . import events
+
+
+# file layout:
+# - magic bytes and format version
+# - length of the json metadata (the exchange names) and the json itself
+# - zero padding up to a multiple of 8 bytes
+# - fixed width TICK_DTYPE records, in time order, up to the end of the file
+MAGIC = b"DYNOTICK"
+VERSION = 1
+
+# sides
+BID = 0
+ASK = 1
+
+# one best bid/ask update: 35 bytes, little endian
+TICK_DTYPE = np.dtype([
+    ("unix_ts_ns", "<i8"),
+    ("market_id", "<i8"),
+    ("exchange_id", "<u2"),
+    ("side", "<u1"),
+    ("price", "<f8"),
+    ("liquidity", "<f8")
+])
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("metadata_size", "<u4")
+])
+
+
+def write_header(f, exchange_names):
+    """ Write a tick file header to a binary file object. The exchange id of a
+    tick is the index of its exchange's name in exchange_names.
+    """
+    metadata = json.dumps({"exchange_names": list(exchange_names)}).encode()
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["metadata_size"] = len(metadata)
+
+    size = HEADER_DTYPE.itemsize + len(metadata)
+    padding = -size % 8
+
+    f.write(header.tobytes())
+    f.write(metadata)
+    f.write(b"\0" * padding)
+
+
+def read_header(f):
+    """ Read a tick file header from a binary file object. Returns the exchange
+    names and the size of the header in bytes i.e. the offset of the first tick.
+    """
+    header = np.frombuffer(f.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)
+
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise Exception("not a tick file")
+
+    if header["version"][0] != VERSION:
+        raise Exception(f"unsupported tick file version: {header['version'][0]}")
+
+    metadata_size = int(header["metadata_size"][0])
+    metadata = json.loads(f.read(metadata_size).decode())
+
+    size = HEADER_DTYPE.itemsize + metadata_size
+    return metadata["exchange_names"], size + -size % 8
+
+
+def write_ticks(path, exchange_names, ticks):
+    """ Write a tick file. ticks is a TICK_DTYPE array, or an iterable of them to
+    write a large file one chunk at a time. Ticks must be in time order.
+    """
+    if isinstance(ticks, np.ndarray):
+        ticks = [ticks]
+
+    with open(path, "wb") as f:
+        write_header(f, exchange_names)
+
+        for chunk in ticks:
+            f.write(np.ascontiguousarray(chunk, dtype=TICK_DTYPE).tobytes())
+
+
+def read_csv_ticks(path, side, exchange_id=0):
+    """ Parse a bidPriceChanges.csv / askPriceChanges.csv style file, with a header
+    and unix_ts_ns, market_id, price and liquidity columns, into a TICK_DTYPE
+    array. side is BID or ASK.
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [header.index(name) for name in
+                   ("unix_ts_ns", "market_id", "price", "liquidity")]
+
+        rows = [[row[i] for i in columns] for row in reader if row]
+
+    ticks = np.empty(len(rows), dtype=TICK_DTYPE)
+
+    if len(rows) > 0:
+        unix_ts_ns, market_id, price, liquidity = zip(*rows)
+        ticks["unix_ts_ns"] = np.array(unix_ts_ns, dtype=np.int64)
+        ticks["market_id"] = np.array(market_id, dtype=np.int64)
+        ticks["price"] = np.array(price, dtype=np.float64)
+        ticks["liquidity"] = np.array(liquidity, dtype=np.float64)
+
+    ticks["exchange_id"] = exchange_id
+    ticks["side"] = side
+    return ticks
+
+
+def convert_csv(path, bids_path, asks_path, exchange_name):
+    """ Convert a pair of bid and ask price change CSV files for one exchange into
+    a tick file. The bid and ask ticks are merged in time order, bids first when
+    the timestamps are equal. Returns the number of ticks written.
+    """
+    ticks = np.concatenate((read_csv_ticks(bids_path, BID),
+                            read_csv_ticks(asks_path, ASK)))
+
+    # stable sort keeps the csv order for equal timestamps
+    ticks = ticks[np.argsort(ticks["unix_ts_ns"], kind="stable")]
+
+    write_ticks(path, [exchange_name], ticks)
+    return len(ticks)
+
+
+class TickFile:
+    """ A memory-mapped tick file. The ticks are read straight from the mapped file
+    without parsing, so replaying a file is bounded by disk bandwidth (or the page
+    cache) rather than by parsing text.
+
+    A TickFile is an events source: iterating over it yields best_bid / best_ask
+    events with compact values (see events.py), in file order, and it can be
+    iterated more than once. blocks() yields best_bid_ask_block events holding
+    numpy arrays instead (see DataStrategy.on_best_bid_ask_block).
+    """
+    def __init__(self, path, chunk_size=65536):
+        with open(path, "rb") as f:
+            self._exchange_names, offset = read_header(f)
+
+        self._path = path
+        self._chunk_size = chunk_size
+
+        # an empty file cannot be memory-mapped
+        self._ticks = np.memmap(path, dtype=TICK_DTYPE, mode="r", offset=offset) \
+            if os.path.getsize(path) > offset \
+            else np.empty(0, dtype=TICK_DTYPE)
+
+    def __reduce__(self):
+        # pickle the path rather than the ticks e.g. when sent to another process
+        return (TickFile, (self._path, self._chunk_size))
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def get_exchange_names(self):
+        return self._exchange_names
+
+    def get_ticks(self):
+        """ Return the memory-mapped TICK_DTYPE array.
+        """
+        return self._ticks
+
+    def chunks(self):
+        """ Yield the ticks in chunks of up to chunk_size records.
+        """
+        ticks, size = self._ticks, self._chunk_size
+
+        for start in range(0, len(ticks), size):
+            yield ticks[start:start + size]
+
+    def __iter__(self):
+        names = self._exchange_names
+        best_bid, best_ask = events.best_bid, events.best_ask
+
+        for chunk in self.chunks():
+            # convert whole columns to python numbers at once
+            rows = zip(chunk["unix_ts_ns"].tolist(),
+                       chunk["market_id"].tolist(),
+                       chunk["exchange_id"].tolist(),
+                       chunk["side"].tolist(),
+                       chunk["price"].tolist(),
+                       chunk["liquidity"].tolist())
+
+            for unix_ts_ns, market_id, exchange_id, side, price, liquidity in rows:
+                make_event = best_bid if side == BID else best_ask
+                yield make_event(unix_ts_ns, names[exchange_id], market_id,
+                                 price, liquidity)
+
+    def blocks(self):
+        """ Yield best_bid_ask_block events of up to chunk_size ticks. A block only
+        holds one exchange's ticks, so chunks are split where the exchange changes.
+        The event's timestamp is the block's last timestamp.
+        """
+        names = self._exchange_names
+
+        for chunk in self.chunks():
+            exchange_ids = chunk["exchange_id"]
+
+            # split the chunk into runs of the same exchange
+            bounds = np.flatnonzero(exchange_ids[1:] != exchange_ids[:-1]) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [len(chunk)]))
+
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                block = chunk[start:end]
+                unix_ts_ns = block["unix_ts_ns"]
+
+                yield ("best_bid_ask_block", int(unix_ts_ns[-1]), {
+                    "exchange_name": names[int(exchange_ids[start])],
+                    "unix_ts_ns": unix_ts_ns,
+                    "market_id": block["market_id"],
+                    "is_bid": block["side"] == BID,
+                    "price": block["price"],
+                    "liquidity": block["liquidity"]
+                })
+
+
+class MergedEvents:
+    """ Merges many events sources, each already in time order, into one time
+    ordered events source without sorting: a heap holds the next event of each
+    source, so memory use does not grow with the number of events. Events with
+    equal timestamps come out in the order of their sources (and then in the order
+    they appear in their source), so the merge is deterministic.
+
+    A source is an iterable of events or the path of a tick file. A MergedEvents
+    can be iterated more than once if all of its sources can e.g. lists and tick
+    files, but not generators.
+    """
+    def __init__(self, *sources, chunk_size=65536):
+        self._sources = [TickFile(source, chunk_size)
+                         if isinstance(source, (str, os.PathLike)) else source
+                         for source in sources]
+
+    def __iter__(self):
+        # heapq.merge breaks ties by source order
+        return heapq.merge(*self._sources, key=lambda event: event[1])
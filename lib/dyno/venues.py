@@ -0,0 +1,127 @@
+from collections.abc import Mapping
+from typing import NamedTuple
+
+
+# declarative spec of the venues (exchanges) dyno knows about:
+# each venue's entry overrides the defaults
+VENUE_SPEC = {
+    "defaults": {
+        # maker / taker fees as a fraction of the trade size
+        "maker_pct": 0.01,
+        "taker_pct": 0.01,
+
+        # optional volume tiers: [(minimum volume, maker pct, taker pct), ...]
+        "fee_tiers": None,
+
+        # per base / quote currency pair: min/max trade size (quote currency),
+        # tick size (price increment) and lot size (base currency increment).
+        # tick and lot sizes are None (unknown) until they are taken from a venue's
+        # published specs, in which case they go in the venue's own "pairs"
+        "pairs": {
+            "BTC": {
+                quote_currency: {
+                    "minimum": 25,
+                    "maximum": 100000,
+                    "tick_size": None,
+                    "lot_size": None
+                }
+                for quote_currency in ("GBP", "EUR", "USD", "USDT")
+            }
+        }
+    },
+    "venues": {
+        "Binance": {},
+        "Bitfinex": {},
+        "Bitflyer": {},
+        "BitMEX": {},
+        "Bitstamp": {},
+        "Bybit": {},
+        "Coinbase": {},
+        "Gemini": {},
+        "HitBTC": {},
+        "Kraken": {},
+        "Poloniex": {}
+    }
+}
+
+
+class VenueConfig(NamedTuple):
+    """ Immutable configuration of a venue. One config object is shared by every
+    exchange object created for the venue, so the config must never be changed:
+    size_limits is a read-only mapping of base currency -> quote currency -> pair
+    limits (see VENUE_SPEC), and fee_tiers is a tuple or None.
+    """
+    name: str
+    maker_pct: float
+    taker_pct: float
+    fee_tiers: tuple
+    size_limits: Mapping
+
+
+class FrozenDict(Mapping):
+    """ A read-only dictionary. Unlike a mappingproxy it can be pickled, so exchange
+    objects can be sent to other processes e.g. spark executors.
+    """
+    __slots__ = ("_items",)
+
+    def __init__(self, items):
+        self._items = dict(items)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return f"FrozenDict({self._items})"
+
+    def __reduce__(self):
+        return (FrozenDict, (self._items,))
+
+
+def freeze(value):
+    """ Return a read-only copy of nested dictionaries and lists.
+    """
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    else:
+        return value
+
+
+def load_venues(spec):
+    """ Build a read-only mapping of venue name -> VenueConfig from a spec with the
+    same layout as VENUE_SPEC.
+    """
+    defaults = spec.get("defaults", {})
+    configs = {}
+
+    for name, overrides in spec["venues"].items():
+        venue = {**defaults, **overrides}
+
+        configs[name] = VenueConfig(
+            name=name,
+            maker_pct=venue["maker_pct"],
+            taker_pct=venue["taker_pct"],
+            fee_tiers=freeze(venue.get("fee_tiers")),
+            size_limits=freeze(venue["pairs"]))
+
+    return FrozenDict(configs)
+
+
+# loaded once, on import
+VENUES = load_venues(VENUE_SPEC)
+
+
+def get_venue(name):
+    """ Return the VenueConfig for a venue name.
+    """
+    if name not in VENUES:
+        raise Exception(f"unknown venue: {name}")
+
+    return VENUES[name]
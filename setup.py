@@ -16,4 +16,10 @@ setup(
 
     # dependencies
     install_requires=[
-        "pyspark >= pyspark==3.3.1"])
+        "numpy"],
+
+    # optional dependencies
+    # pyspark is only needed to run backtests on a spark cluster
+    # (pyarrow for arrow batches)
+    extras_require={
+        "spark": ["pyspark >= 3.3.1", "pyarrow >= 4.0.0"]})
@@ -1,4 +1,9 @@
 import test.backtest
+import test.events
 import test.exchange
 import test.helpers
+import test.instrumentation
+import test.spark
 import test.strategy
+import test.ticks
+import test.venues
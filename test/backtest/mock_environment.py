@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from dyno.strategy import Strategy
@@ -37,6 +38,61 @@ class TestSignalStrategy(Strategy):
             return []
 
 
+class RandomSignalStrategy(Strategy):
+    def __init__(self, exchanges, random_seed=12345):
+        super().__init__(exchanges)
+        self._rand = random.Random(random_seed)
+
+    def on_mid_market_price_returns(self, unix_ts_ns, values):
+        rand = self._rand.randint(1, 9)
+
+        # contextual info
+        market_id = values["market_id"]
+        exchange_name = values["exchange_name"]
+        exchange = self._exchanges[exchange_name]
+
+        if rand in [1, 2, 3]:
+            side, price = "long", exchange.get_best_ask_price(market_id)
+        elif rand in [4, 5, 6]:
+            side, price = "short", exchange.get_best_bid_price(market_id)
+        else:
+            return []
+
+        return [
+            (side, unix_ts_ns, {
+                "market_id": market_id,
+                "exchange_name": exchange_name,
+                "base_currency": "BTC",
+                "quote_currency": "GBP",
+                "price": price,
+                "confidence_pct": (1 + rand) / 10,
+                "stop_loss_pct": 0.03,
+                "take_profit_pct": 0.06
+            })
+        ]
+
+
+def random_ticks(n, random_seed=1, exchange_name="COINBASE.SPOT", market_id=1):
+    """ Return n best_bid/best_ask events following a random walk.
+    """
+    rand = random.Random(random_seed)
+    price = 100.0
+    events = []
+
+    for i in range(n):
+        price *= 1 + rand.gauss(0, 0.01)
+        event_name = rand.choice(["best_bid", "best_ask"])
+
+        events.append((event_name, i, {
+            "exchange_name": exchange_name,
+            "market_id": market_id,
+            "price": price - 0.05 if event_name == "best_bid" else price + 0.05,
+            "liquidity": rand.uniform(0.1, 5)
+        }))
+
+    return events
+
+
 class ClientTest(unittest.TestCase):
     def setUp(self):
         pass
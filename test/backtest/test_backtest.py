@@ -1,6 +1,15 @@
-from .mock_environment import ClientTest
+from .mock_environment import ClientTest, RandomSignalStrategy, random_ticks
 
-from dyno.backtest import Results
+import functools
+import sys
+
+import numpy as np
+
+from dyno.backtest import Results, ResultsColumns, Backtest, Ensemble
+from dyno.exchange import MakerTakerFeeSchedule, TieredFeeSchedule
+from dyno.helpers import all_cryptocurrency_exchanges, attach_book_store
+from dyno.helpers import build_basic_signal_strategy
+from dyno.helpers import build_basic_signal_pipeline
 
 
 class TestResults(ClientTest):
@@ -10,6 +19,82 @@ class TestResults(ClientTest):
         # not finished
         # ...
 
+    def test_2(self):
+        # an empty backtest still produces a report
+        r = Results([])
+
+        self.assertTrue(len(r.trades()) == 0)
+        self.assertTrue(r.net_gain() == 0)
+        self.assertTrue(r.event_timings()["timeframe"] == 0)
+        self.assertTrue(isinstance(str(r), str))
+
+    def test_3(self):
+        fill = lambda name, ts, position_ts, price, amount, fee: \
+            (name, ts, {"position_ts": position_ts, "market_id": position_ts,
+                        "price": 0, "fill_price": price, "amount": amount,
+                        "fee": fee})
+
+        r = Results([
+            # long opened at 100 and closed at 110 in two fills
+            ("long_executed", 1, {"position_ts": 1}),
+            fill("ask_fill", 1, 1, 100.0, 50.0, 1.0),
+            ("mid_market_price", 2, {"mid_market_price": 105.0}),
+            fill("bid_fill", 3, 1, 110.0, 25.0, 0.5),
+            fill("bid_fill", 3, 1, 110.0, 25.0, 0.5),
+
+            # short opened at 100 and closed at 120
+            ("short_executed", 4, {"position_ts": 4}),
+            fill("bid_fill", 4, 4, 100.0, 100.0, 1.0),
+            fill("ask_fill", 9, 4, 120.0, 100.0, 1.0),
+
+            # long that is still open
+            ("long_executed", 10, {"position_ts": 10}),
+            fill("ask_fill", 10, 10, 120.0, 10.0, 0.1)
+        ])
+
+        # positions
+        self.assertTrue(len(r.trades()) == 3)
+        self.assertTrue(len(r.longs()) == 2)
+        self.assertTrue(len(r.shorts()) == 1)
+        self.assertTrue(list(r.trades()["position_ts"]) == [1, 4, 10])
+        self.assertTrue(list(r.trades()["closed"]) == [True, True, False])
+
+        # returns: +10% on the long, -20% on the short
+        self.assertTrue(np.allclose(r.returns(), [0.1, -0.2]))
+        self.assertTrue(np.allclose(r.log_returns(), np.log([1.1, 0.8])))
+
+        # pnl net of fees: 0.1 * 50 - 2 = 3, -0.2 * 100 - 2 = -22
+        self.assertTrue(np.allclose(r.closed_trades()["pnl"], [3, -22]))
+        self.assertTrue(np.isclose(r.net_gain(), -19))
+        self.assertTrue(np.isclose(r.net_gain_pct(), -19 / 150))
+        self.assertTrue(r.win_rate() == 1)
+        self.assertTrue(r.win_rate_pct() == 0.5)
+        self.assertTrue(np.isclose(r.max_drawdown(), 22))
+        self.assertTrue(np.isclose(r.max_drawdown_pct(), 0.2))
+        self.assertTrue(np.isclose(r.sharpe_value(),
+                                   np.mean([0.1, -0.2]) / np.std([0.1, -0.2], ddof=1)))
+
+        # fees and timings
+        self.assertTrue(np.isclose(r.all_fees_incurred().sum(), 4.1))
+        self.assertTrue(r.event_timings() == {"first": 1, "last": 10, "timeframe": 9})
+
+        # mid market prices are kept as typed columns
+        ts, prices = r.mid_market_prices()
+        self.assertTrue(ts.dtype == np.int64 and prices.dtype == np.float64)
+        self.assertTrue(list(prices) == [105.0])
+
+        # the same trades under a 1% taker fee
+        fees = MakerTakerFeeSchedule(0, 0.01)
+        self.assertTrue(np.allclose(r.fees_under(fees),
+                                    [0.5, 0.25, 0.25, 1, 1, 0.1]))
+        self.assertTrue(np.allclose(r.trades_under(fees)["pnl"][:2],
+                                    [5 - 1, -20 - 2]))
+
+        # per-market fees apply to the fills of that market
+        fees = TieredFeeSchedule([(0, 0, 0.01)], market_overrides={4: (0, 0)})
+        self.assertTrue(np.allclose(r.fees_under(fees),
+                                    [0.5, 0.25, 0.25, 0, 0, 0.1]))
+
 
 class TestPipeline(ClientTest):
     def test_1(self):
@@ -19,6 +104,79 @@ class TestPipeline(ClientTest):
 
         pass
 
+    def make_pipeline(self):
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        return build_basic_signal_strategy(RandomSignalStrategy(exchanges), exchanges)
+
+    def test_2(self):
+        events = random_ticks(1000)
+
+        # list mode, one event per call
+        pipeline = self.make_pipeline()
+        expected = [output for event in events for output in pipeline([event])]
+
+        # streaming mode over a lazy iterator
+        pipeline = self.make_pipeline()
+        outputs = pipeline.stream(iter(events))
+
+        # stream is lazy and matches list mode event for event
+        self.assertFalse(isinstance(outputs, list))
+        self.assertTrue(list(outputs) == expected)
+
+        # sanity check: positions were opened and closed
+        names = {name for name, _, _ in expected}
+        self.assertTrue({"bid_fill", "ask_fill", "exit_ask_queue_append"} <= names)
+
+    def test_3(self):
+        events = random_ticks(1000)
+        pipeline = self.make_pipeline()
+
+        # warm up then checkpoint
+        list(pipeline.stream(events[:500]))
+        snapshot = pipeline.snapshot()
+
+        # running from the checkpoint twice gives the same outputs
+        expected = list(pipeline.stream(events[500:]))
+        balances = [e.get_balance("GBP") for e in pipeline.get_exchanges()]
+
+        pipeline.restore(snapshot)
+        self.assertTrue(list(pipeline.stream(events[500:])) == expected)
+        self.assertTrue([e.get_balance("GBP") for e in pipeline.get_exchanges()] ==
+                        balances)
+
+        # and the same outputs as running from the start without a checkpoint
+        pipeline = self.make_pipeline()
+        self.assertTrue(list(pipeline.stream(events))[-len(expected):] == expected)
+
+    def test_4(self):
+        events = random_ticks(1000)
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        store = attach_book_store(exchanges)
+        pipeline = build_basic_signal_strategy(RandomSignalStrategy(exchanges),
+                                               exchanges)
+
+        # checkpoint a pipeline whose exchanges keep their books in a store
+        list(pipeline.stream(events[:500]))
+        snapshot = pipeline.snapshot()
+        levels = store.best_bids()[0].copy()
+
+        expected = list(pipeline.stream(events[500:]))
+        pipeline.restore(snapshot)
+
+        # the store's levels go back to the checkpoint, in the same store object
+        self.assertTrue(np.array_equal(store.best_bids()[0], levels,
+                                       equal_nan=True))
+        self.assertTrue(list(pipeline.stream(events[500:])) == expected)
+
+        # which the exchanges still use
+        _, _, values = events[0]
+        exchange = exchanges[values["exchange_name"]]
+        self.assertTrue(exchange._order_books.get_store() is store)
+
+        store.update_block(values["exchange_name"], [values["market_id"]], [True],
+                           [200.0], [1.0])
+        self.assertTrue(exchange.get_best_bid(values["market_id"]) == (200.0, 1.0))
+
 
 class TestBacktest(ClientTest):
     def test_1(self):
@@ -28,6 +186,53 @@ class TestBacktest(ClientTest):
 
         pass
 
+    def make_pipeline(self):
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        return build_basic_signal_strategy(RandomSignalStrategy(exchanges), exchanges)
+
+    def test_2(self):
+        events = random_ticks(500)
+
+        # expected outputs from calling the pipeline once per event
+        pipeline = self.make_pipeline()
+        expected = [output for event in events for output in pipeline([event])]
+
+        # a plain generator is a valid events source
+        backtest = Backtest((event for event in events), self.make_pipeline())
+        results = backtest.execute()
+
+        # the same results object is returned, without needing spark
+        self.assertTrue(isinstance(results, Results))
+        self.assertTrue(results.event_timings()["last"] == expected[-1][1])
+        self.assertTrue(len(results.all_fees_incurred()) ==
+                        len([e for e in expected if e[0] in ("bid_fill", "ask_fill")]))
+        self.assertFalse("pyspark" in sys.modules)
+
+    def test_3(self):
+        events = random_ticks(500)
+        outputs = list(self.make_pipeline().stream(events))
+        expected = Results(outputs)
+
+        # columns collected from parts of the outputs, merged in any order
+        parts = [outputs[:400], outputs[400:1000], outputs[1000:]]
+        merged = ResultsColumns()
+        for part in reversed(parts):
+            merged.merge(ResultsColumns().collect(part))
+
+        results = Results(merged)
+        self.assertTrue(results.summary() == expected.summary())
+        self.assertTrue(results.event_timings() == expected.event_timings())
+        self.assertTrue(np.array_equal(results.mid_market_prices()[0],
+                                       expected.mid_market_prices()[0]))
+        self.assertTrue(np.array_equal(results.all_fees_incurred(),
+                                       expected.all_fees_incurred()))
+
+        # mid market prices can be left out
+        results = Backtest(events, self.make_pipeline(), mid_prices=False).execute()
+        self.assertTrue(len(results.mid_market_prices()[0]) == 0)
+        self.assertTrue(results.summary() == expected.summary())
+        self.assertTrue(results.event_timings() == expected.event_timings())
+
 
 class TestEnsemble(ClientTest):
     def test_1(self):
@@ -36,3 +241,32 @@ class TestEnsemble(ClientTest):
         # ...
 
         pass
+
+    def test_2(self):
+        grid = Ensemble.parameter_grid({"a": [1, 2], "b": ["x", "y"]})
+
+        # every combination, the last parameter changes fastest
+        self.assertTrue(grid == [{"a": 1, "b": "x"}, {"a": 1, "b": "y"},
+                                 {"a": 2, "b": "x"}, {"a": 2, "b": "y"}])
+        self.assertTrue(Ensemble.parameter_grid([{"a": 1}]) == [{"a": 1}])
+
+    def test_3(self):
+        events = random_ticks(500)
+        build_pipeline = functools.partial(build_basic_signal_pipeline,
+                                           RandomSignalStrategy,
+                                           {"GBP": 1000, "BTC": 1})
+        grid = {"random_seed": [1, 2, 3, 4]}
+
+        # in-process and on a pool of workers
+        local = Ensemble(events, build_pipeline, grid, processes=1).execute()
+        pooled = Ensemble(events, build_pipeline, grid, processes=2).execute()
+
+        # the same summaries, in the grid's order
+        self.assertTrue(local == pooled)
+        self.assertTrue([params for params, _ in local] ==
+                        [{"random_seed": seed} for seed in [1, 2, 3, 4]])
+
+        # matches running one backtest
+        results = Backtest(events, build_pipeline(random_seed=3)).execute()
+        self.assertTrue(local[2][1]["trades"] == len(results.trades()))
+        self.assertTrue(local[2][1]["fees"] == results.all_fees_incurred().sum())
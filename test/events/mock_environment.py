@@ -0,0 +1,9 @@
+import unittest
+
+
+class EventsTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
@@ -0,0 +1,69 @@
+import pickle
+
+from .mock_environment import EventsTest
+
+from dyno.events import Event, Quote, MidMarketPrice, Fill
+from dyno.events import best_bid, BEST_BID
+
+
+class TestEvent(EventsTest):
+    def test_1(self):
+        event = best_bid(1, "EXCHANGE 1", 2, 100.5, 3)
+
+        # events are plain tuples
+        event_name, unix_ts_ns, values = event
+        self.assertTrue(isinstance(event, tuple))
+        self.assertTrue(event_name is BEST_BID)
+        self.assertTrue(event == ("best_bid", 1, values))
+        self.assertTrue(event.unix_ts_ns == 1)
+
+
+class TestValues(EventsTest):
+    def test_1(self):
+        values = Quote("EXCHANGE 1", 2, 100.5, 3)
+
+        # dictionary style access
+        self.assertTrue(values["price"] == 100.5)
+        self.assertTrue(values.get("missing") is None)
+        self.assertTrue("liquidity" in values)
+        self.assertRaises(KeyError, lambda: values["keys"])
+        self.assertTrue({**values, "price": 1}["price"] == 1)
+        self.assertTrue(values == {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 2,
+            "price": 100.5,
+            "liquidity": 3
+        })
+
+        # no per-instance dictionary
+        self.assertFalse(hasattr(values, "__dict__"))
+
+    def test_2(self):
+        values = MidMarketPrice(1, "EXCHANGE 1", 99.5)
+        self.assertTrue(pickle.loads(pickle.dumps(values)) == values)
+
+
+class TestFill(EventsTest):
+    def test_1(self):
+        order = {"market_id": 1, "price": 100, "position_ts": 7, "remaining": 10}
+        fill = Fill(order, 5, 0.1, 99.5, 5)
+
+        # the order's keys are read through the fill
+        self.assertTrue(fill["position_ts"] == 7)
+        self.assertTrue(fill["price"] == 100)
+        self.assertTrue(fill["fill_price"] == 99.5)
+
+        # the remaining amount is a snapshot
+        order["remaining"] = 0
+        self.assertTrue(fill["remaining"] == 5)
+
+        self.assertTrue(dict(fill) == {
+            "market_id": 1,
+            "price": 100,
+            "position_ts": 7,
+            "remaining": 5,
+            "amount": 5,
+            "fee": 0.1,
+            "fill_price": 99.5
+        })
+        self.assertTrue(len(fill) == 7)
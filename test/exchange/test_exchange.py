@@ -1,9 +1,86 @@
 from .mock_environment import ClientTest
 
+import pickle
+
+import numpy as np
+
+from dyno.exchange import DepthOrderBook, BookStore, OrderBook
+from dyno.exchange import MakerTakerFeeSchedule, TieredFeeSchedule
+from dyno.exchange import Binance
+
 
 class TestMakerTakerFeeSchedule(ClientTest):
     def test_1(self):
-        pass
+        fees = MakerTakerFeeSchedule(-0.0001, 0.002)
+
+        # fees are a fraction of the trade size, negative maker fees are rebates
+        self.assertTrue(np.isclose(fees.taker_fee(1000), 2))
+        self.assertTrue(np.isclose(fees.maker_fee(1000), -0.1))
+        self.assertTrue(np.allclose(fees.fees([1, 2], np.array([1000, 500])),
+                                    [2, 1]))
+
+
+class TestTieredFeeSchedule(ClientTest):
+    def test_1(self):
+        day = 24 * 60 * 60 * 1_000_000_000
+        fees = TieredFeeSchedule([(0, 0.001, 0.002), (1000, 0.0005, 0.001)],
+                                 market_overrides={7: (0, 0)})
+
+        # first tier until 1000 is traded in the window
+        self.assertTrue(np.isclose(fees.taker_fee(100), 0.2))
+        fees.record_volume(0, 600)
+        fees.record_volume(day, 600)
+        self.assertTrue(fees.get_tier() == 1)
+        self.assertTrue(np.isclose(fees.taker_fee(100), 0.1))
+        self.assertTrue(np.isclose(fees.maker_fee(100), 0.05))
+
+        # the first trade falls out of the 30 day window
+        fees.record_volume(30 * day, 100)
+        self.assertTrue(np.isclose(fees.get_volume(), 700))
+        self.assertTrue(fees.get_tier() == 0)
+
+        # overrides replace the tier's fees
+        self.assertTrue(fees.taker_fee(100, 7) == 0)
+
+        # the first tier must start at zero
+        self.assertRaises(Exception, TieredFeeSchedule, [(10, 0, 0)])
+
+    def test_2(self):
+        # bulk fees match recording trades one by one
+        rng = np.random.default_rng(1)
+        ts = np.cumsum(rng.integers(0, 10 ** 14, 1000))
+        sizes = rng.uniform(0, 500, 1000)
+        market_ids = rng.integers(0, 3, 1000)
+        tiers = [(0, 0.001, 0.002),
+                 (5000, 0.0005, 0.001),
+                 (20000, -0.0001, 0.0005)]
+
+        bulk = TieredFeeSchedule(tiers, market_overrides={2: (0, 0.003)})
+        incremental = TieredFeeSchedule(tiers, market_overrides={2: (0, 0.003)})
+
+        expected = []
+        for unix_ts_ns, size, market_id in zip(ts, sizes, market_ids):
+            expected.append(incremental.taker_fee(size, market_id, unix_ts_ns))
+            incremental.record_volume(unix_ts_ns, size)
+
+        self.assertTrue(np.allclose(bulk.fees(ts, sizes, market_ids=market_ids),
+                                    expected))
+
+    def test_3(self):
+        day = 24 * 60 * 60 * 1_000_000_000
+        tiers = [(0, 0.001, 0.002), (1000, 0.0005, 0.001)]
+        fees = TieredFeeSchedule(tiers)
+
+        # a high volume day, then a quiet period longer than the window
+        fees.record_volume(0, 2000)
+        self.assertTrue(np.isclose(fees.taker_fee(100, None, day), 0.1))
+        self.assertTrue(np.isclose(fees.taker_fee(100, None, 60 * day), 0.2))
+        self.assertTrue(fees.get_tier() == 0 and fees.get_volume() == 0)
+
+        # the incremental and bulk fees agree across the gap
+        ts, sizes = [0, day, 60 * day], [2000, 100, 100]
+        self.assertTrue(np.allclose(TieredFeeSchedule(tiers).fees(ts, sizes),
+                                    [4, 0.1, 0.2]))
 
 
 class TestOrderBook(ClientTest):
@@ -11,6 +88,162 @@ class TestOrderBook(ClientTest):
         pass
 
 
+class TestDepthOrderBook(ClientTest):
+    def test_1(self):
+        book = DepthOrderBook(
+            bids=[(99, 1), (98, 2), (97, 3)],
+            asks=[(102, 1), (101, 2), (103, 3)])
+
+        self.assertFalse(book.is_empty())
+        self.assertTrue(book.get_best_bid() == (99, 1))
+        self.assertTrue(book.get_best_ask() == (101, 2))
+        self.assertTrue(book.get_levels("asks") == [(101, 2), (102, 1), (103, 3)])
+        self.assertTrue(book.get_levels("bids", 2) == [(99, 1), (98, 2)])
+
+        # deltas update, insert and delete levels
+        book.apply_delta("bids", 98, 5)
+        book.apply_delta("bids", 100, 1)
+        book.apply_delta("asks", 101, 0)
+
+        self.assertTrue(book.get_levels("bids") == [(100, 1), (99, 1), (98, 5), (97, 3)])
+        self.assertTrue(book.get_best_ask() == (102, 1))
+
+        # a new best bid removes stale levels above it
+        book.set_best_bid(98.5, 4)
+        self.assertTrue(book.get_levels("bids") == [(98.5, 4), (98, 5), (97, 3)])
+
+    def test_2(self):
+        book = DepthOrderBook(asks=[(100, 1), (101, 2), (102, 3)])
+
+        # 100 * 1 + 101 * 0.5 = 150.5
+        vwap, levels = book.walk("asks", 150.5)
+
+        self.assertTrue(levels == [(100, 1), (101, 0.5)])
+        self.assertAlmostEqual(vwap, 150.5 / 1.5)
+
+        # walking does not change the book
+        self.assertTrue(book.get_best_ask() == (100, 1))
+
+        # taking removes the consumed liquidity
+        book.take("asks", 150.5)
+        self.assertTrue(book.get_levels("asks") == [(101, 1.5), (102, 3)])
+
+        # more than the book holds consumes every level
+        vwap, levels = book.walk("asks", 10 ** 6)
+        self.assertTrue(levels == [(101, 1.5), (102, 3)])
+
+        # draining the best level exposes the next one
+        book.remove_ask_liquidity(1.5)
+        self.assertTrue(book.get_best_ask() == (102, 3))
+        self.assertRaises(Exception, book.remove_ask_liquidity, 4)
+
+        # nothing to walk on an empty side
+        self.assertTrue(book.walk("bids", 100) == (None, []))
+        self.assertTrue(book.get_best_bid() == (None, None))
+
+
+class TestBookStore(ClientTest):
+    def test_1(self):
+        store = BookStore(capacity=2)
+
+        # bulk updates, the last update per market and side wins
+        store.update_block(
+            "BINANCE.SPOT",
+            market_ids=np.array([1, 2, 1, 3, 1, 2]),
+            is_bid=np.array([True, True, False, False, True, False]),
+            prices=np.array([99.0, 49.0, 101.0, 10.5, 99.5, 51.0]),
+            liquidity=np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0]))
+
+        # slots are dense and the arrays grow past the initial capacity
+        self.assertTrue(store.keys() == [("BINANCE.SPOT", 1),
+                                         ("BINANCE.SPOT", 2),
+                                         ("BINANCE.SPOT", 3)])
+        self.assertTrue(store.get_best_bid(0) == (99.5, 5.0))
+        self.assertTrue(store.get_best_ask(0) == (101.0, 3.0))
+        self.assertTrue(store.get_best_bid(2) == (None, None))
+
+        # vectorized queries across every market
+        spreads = store.spreads()
+        self.assertTrue(np.allclose(spreads[:2], [1.5, 2.0]))
+        self.assertTrue(np.isnan(spreads[2]))
+        self.assertTrue(np.allclose(store.mid_prices()[:2], [100.25, 50.0]))
+
+        self.assertRaises(Exception, store.update_block, "BINANCE.SPOT",
+                          [1], [True], [1.0], [-1.0])
+
+    def test_2(self):
+        store = BookStore()
+        exchange = Binance({"GBP": 100, "BTC": 1})
+        exchange._order_books[7] = OrderBook((10, 1), (11, 2))
+
+        # existing books are copied into the store
+        exchange.attach_book_store(store, "BINANCE.SPOT")
+        self.assertTrue(exchange.get_best_bid(7) == (10, 1))
+
+        # updates through the exchange and through the store are shared
+        exchange.set_best_bid(8, 20, 1)
+        exchange.set_best_ask(8, 21, 1)
+        exchange.remove_ask_liquidity(8, 0.5)
+        store.update_block("BINANCE.SPOT", [7], [False], [10.5], [3])
+
+        self.assertTrue(exchange.get_best_ask(8) == (21, 0.5))
+        self.assertTrue(exchange.get_best_ask(7) == (10.5, 3))
+        self.assertTrue(exchange.has_order_book(8))
+        self.assertFalse(exchange.has_order_book(9))
+        self.assertTrue(np.allclose(store.spreads(), [0.5, 1]))
+
+        # markets added to the store by a block update are found by the exchange
+        store.update_block("BINANCE.SPOT", [9], [True], [30.0], [1.0])
+        self.assertTrue(exchange.has_order_book(9))
+        self.assertTrue(exchange.get_best_bid(9) == (30.0, 1.0))
+        self.assertTrue(exchange.get_best_ask_price(9) is None)
+
+        # exchanges with a store can be pickled e.g. sent to spark executors
+        copied = pickle.loads(pickle.dumps(exchange))
+        copied.set_best_bid(9, 31, 1)
+        self.assertTrue(copied.get_best_bid(9) == (31, 1))
+        self.assertTrue(exchange.get_best_bid(9) == (30.0, 1.0))
+
+    def test_3(self):
+        store = BookStore()
+        exchange = Binance({"GBP": 100, "BTC": 1})
+        exchange.attach_book_store(store, "BINANCE.SPOT")
+        exchange.set_best_bid(1, 99, 1)
+
+        # depth books are kept beside the store
+        exchange.apply_l2_snapshot(2, bids=[(99, 1), (98, 2)], asks=[(101, 1)])
+        exchange.apply_l2_delta(2, "bids", 99.5, 3)
+        self.assertTrue(exchange.get_best_bid(2) == (99.5, 3))
+        self.assertTrue(exchange.get_best_bid(1) == (99, 1))
+
+        # a top of book market can become a depth book
+        exchange.apply_l2_snapshot(1, bids=[(97, 1)], asks=[(103, 1)])
+        self.assertTrue(exchange.get_best_bid(1) == (97, 1))
+
+    def test_4(self):
+        store = BookStore()
+        exchange = Binance({"GBP": 100, "BTC": 1})
+        exchange.attach_book_store(store, "BINANCE.SPOT")
+        exchange.set_best_bid(1, 99, 1)
+        exchange.apply_l2_snapshot(5, bids=[(49, 1)], asks=[(51, 1)])
+        snapshot = exchange.snapshot()
+
+        # a market added after the snapshot is gone once restored
+        exchange.set_best_bid(2, 20, 1)
+        exchange.restore(snapshot)
+        self.assertFalse(exchange.has_order_book(2))
+        self.assertTrue(exchange.get_best_bid(1) == (99, 1))
+        self.assertTrue(exchange.get_best_bid(5) == (49, 1))
+
+        # the next new market gets its own slot
+        exchange.set_best_bid(3, 30, 1)
+        exchange.set_best_bid(2, 21, 1)
+        self.assertTrue(exchange.get_best_bid(3) == (30, 1))
+        self.assertTrue(exchange.get_best_bid(2) == (21, 1))
+        self.assertTrue(exchange.get_best_bid(1) == (99, 1))
+        self.assertTrue(len(store) == 3)
+
+
 class TestBankRoll(ClientTest):
     def test_1(self):
         pass
@@ -1,3 +1,4 @@
+import copy
 import random
 
 from .mock_environment import HelpersTest
@@ -8,8 +9,10 @@ from dyno.helpers import spot_market_cryptocurrency_exchanges
 from dyno.helpers import futures_market_cryptocurrency_exchanges
 from dyno.helpers import all_cryptocurrency_exchanges
 from dyno.helpers import build_basic_signal_strategy
+from dyno.helpers import attach_book_store
 from dyno.helpers import CircularQueue
 from dyno.helpers import EventTimeWindow, EventTimeSlidingWindow
+from dyno.helpers import RollingAggregates
 
 
 class TestSignalStrategy(Strategy):
@@ -125,6 +128,35 @@ class TestBuildStrategies(HelpersTest):
         print(s([bid2, ask2]))
 
 
+    def test_2(self):
+        rand = random.Random(3)
+        events = []
+
+        # random quotes on two markets of two exchanges
+        for i in range(500):
+            events.append((rand.choice(["best_bid", "best_ask"]), i, {
+                "exchange_name": rand.choice(["COINBASE.SPOT", "KRAKEN.SPOT"]),
+                "market_id": rand.choice([1, 2]),
+                "price": 100 + rand.gauss(0, 1),
+                "liquidity": rand.uniform(0.1, 10)
+            }))
+
+        outputs = []
+
+        for use_store in [False, True]:
+            exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+
+            if use_store:
+                store = attach_book_store(exchanges)
+
+            s = build_basic_signal_strategy(TestSignalStrategy(exchanges), exchanges)
+            outputs.append([output for event in events for output in s([event])])
+
+        # keeping the books in a store does not change the outputs
+        self.assertTrue(outputs[0] == outputs[1])
+        self.assertTrue(len(store) == 4)
+
+
 class TestCircularQueue(HelpersTest):
     def test_1(self):
         q = CircularQueue()
@@ -241,6 +273,94 @@ class TestCircularQueue(HelpersTest):
         self.assertTrue(q.get_tail() == ["z"])
 
 
+    def test_10(self):
+        q = CircularQueue(capacity=4)
+
+        # wrap around the ring buffer then force it to grow
+        for i in range(3):
+            q.append(i)
+        q.trim_head(2)
+        for i in range(3, 10):
+            q.append(i)
+
+        self.assertTrue(list(q) == list(range(2, 10)))
+        self.assertTrue(q.get_head(2) == [2, 3])
+        self.assertTrue(q.get_tail(2) == [9, 8])
+        self.assertTrue(q.trim_tail(2) == [9, 8])
+        self.assertTrue(q.trim_head(2) == [2, 3])
+        self.assertTrue(list(q) == [4, 5, 6, 7])
+        self.assertRaises(Exception, q.trim_head, 5)
+        self.assertRaises(Exception, q.get_head, 5)
+
+    def test_11(self):
+        q = CircularQueue()
+
+        for i in range(100000):
+            q.append(i)
+
+        # bulk trims are not limited by the recursion limit
+        self.assertTrue(q.trim_head(50000) == list(range(50000)))
+        self.assertTrue(q.trim_tail(49999) == list(range(99999, 50000, -1)))
+        self.assertTrue(list(q) == [50000])
+
+
+    def test_12(self):
+        q = CircularQueue()
+
+        self.assertRaises(Exception, q.peek_head)
+        self.assertRaises(Exception, q.pop_head)
+
+        q.append("a")
+        q.append("b")
+
+        self.assertTrue(q.peek_head() == "a" and q.peek_tail() == "b")
+        self.assertTrue(q.pop_head() == "a")
+        self.assertTrue(list(q) == ["b"])
+
+    def test_13(self):
+        q = CircularQueue()
+
+        for i in range(10):
+            q.append(i)
+
+        # a copy shares the list until either queue writes to it
+        c = copy.deepcopy(q)
+        self.assertTrue(c._items is q._items)
+
+        q.append(10)
+        c.append(-1)
+        c.pop_head()
+        self.assertTrue(list(q) == list(range(11)))
+        self.assertTrue(list(c) == list(range(1, 10)) + [-1])
+
+
+class TestRollingAggregates(HelpersTest):
+    def test_1(self):
+        a = RollingAggregates()
+
+        self.assertTrue(a.mean() is None and a.min() is None)
+
+        for x in [3, 1, 4, 1, 5]:
+            a.push(x)
+
+        self.assertTrue(a.sum() == 14)
+        self.assertTrue(a.min() == 1 and a.max() == 5)
+
+        # pop 3, 1, 4 from the front
+        a.pop(3)
+        a.pop(1)
+        a.pop(4)
+
+        self.assertTrue(len(a) == 2)
+        self.assertTrue(a.mean() == 3)
+        self.assertTrue(a.variance() == 8)
+        self.assertTrue(a.min() == 1 and a.max() == 5)
+
+        a.pop(1)
+        self.assertTrue(a.min() == 5 and a.max() == 5)
+        self.assertTrue(a.variance() is None)
+
+
 class TestEventTimeWindow(HelpersTest):
     def test_1(self):
         w = EventTimeWindow(window_duration_seconds=60)
@@ -276,6 +396,50 @@ class TestEventTimeWindow(HelpersTest):
             ("test", 60000000002, {})])
 
 
+    def test_3(self):
+        w = EventTimeWindow(window_duration_seconds=5, aggregate_value="lin")
+        rand = random.Random(42)
+        ts = 0
+
+        for i in range(2000):
+            # random gaps so a varying number of events expire
+            ts += rand.randint(0, 30) * 100_000_000
+            w.add_event("returns", ts, {"lin": rand.gauss(0, 1)})
+
+            # compare rolling aggregates against a rescan of the window
+            xs = [values["lin"] for _, _, values in w.get_window()]
+            a = w.get_aggregates()
+            mean = sum(xs) / len(xs)
+
+            self.assertTrue(len(a) == len(xs))
+            self.assertAlmostEqual(a.sum(), sum(xs))
+            self.assertAlmostEqual(a.mean(), mean)
+            self.assertTrue(a.min() == min(xs) and a.max() == max(xs))
+
+            if len(xs) > 1:
+                variance = sum((x - mean) ** 2 for x in xs) / (len(xs) - 1)
+                self.assertAlmostEqual(a.variance(), variance)
+
+
+    def test_4(self):
+        # a 250ms window
+        w = EventTimeWindow(window_duration_seconds=0.25)
+
+        w.add_event("test", 0, {})
+        w.add_event("test", 100_000_000, {})
+        w.add_event("test", 249_999_999, {})
+        self.assertTrue(len(w.get_window()) == 3)
+
+        # exactly 250ms after the first event: the first event expires
+        w.add_event("test", 250_000_000, {})
+        self.assertTrue([ts for _, ts, _ in w.get_window()] ==
+                        [100_000_000, 249_999_999, 250_000_000])
+
+        # a long gap expires everything but the newest event
+        w.add_event("test", 10_000_000_000, {})
+        self.assertTrue(w.get_window() == [("test", 10_000_000_000, {})])
+
+
 class TestEventTimeSlidingWindow(HelpersTest):
     def test_1(self):
         w = EventTimeSlidingWindow(
@@ -294,3 +458,69 @@ class TestEventTimeSlidingWindow(HelpersTest):
                 windows.append(window)
 
         self.assertTrue(len(windows) == 24)
+
+    def test_2(self):
+        # 1 second windows every 100ms
+        w = EventTimeSlidingWindow(
+            window_duration_seconds=1,
+            window_step_seconds=0.1)
+
+        windows = []
+
+        for i in range(101):
+            # one event every 10ms
+            window = w.add_event("test", i * 10_000_000, {})
+
+            if window != None:
+                windows.append(window)
+
+        self.assertTrue(len(windows) == 10)
+        self.assertTrue(windows[0][0] == (0, 100_000_000))
+
+    def test_3(self):
+        w = EventTimeSlidingWindow(
+            window_duration_seconds=1,
+            window_step_seconds=0.1,
+            snapshot_mode="view")
+
+        expected = EventTimeSlidingWindow(
+            window_duration_seconds=1,
+            window_step_seconds=0.1)
+
+        for i in range(300):
+            ts = i * 10_000_000
+            window = w.add_event("test", ts, {"i": i})
+            window_list = expected.add_event("test", ts, {"i": i})
+
+            if window != None:
+                # views see the same events as list snapshots
+                self.assertTrue(window[0] == window_list[0])
+                self.assertTrue(list(window[1]) == window_list[1])
+                self.assertTrue(window[1][-1] == window_list[1][-1])
+                self.assertTrue(window[1][:2] == window_list[1][:2])
+                last = window[1]
+
+        # plain views go stale after the next mutation
+        w.add_event("test", 300 * 10_000_000, {})
+        self.assertFalse(last.is_valid())
+        self.assertRaises(Exception, list, last)
+
+    def test_4(self):
+        w = EventTimeSlidingWindow(
+            window_duration_seconds=1,
+            window_step_seconds=0.1,
+            snapshot_mode="copy_on_write")
+
+        snapshots = []
+
+        for i in range(300):
+            ts = i * 10_000_000
+            window = w.add_event("test", ts, {"i": i})
+
+            if window != None:
+                snapshots.append((window[1], window[1].to_list()))
+
+        # copy-on-write views still hold the events they were taken with
+        for view, events in snapshots:
+            self.assertTrue(view.is_valid())
+            self.assertTrue(list(view) == events)
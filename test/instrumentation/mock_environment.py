@@ -0,0 +1,15 @@
+import unittest
+
+
+def double_stage(events):
+    """ A stage that is not a strategy: outputs every input event twice.
+    """
+    return [event for event in events for _ in range(2)]
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
@@ -0,0 +1,149 @@
+from .mock_environment import InstrumentationTest, double_stage
+
+import functools
+import pickle
+
+from dyno.backtest import Backtest, Ensemble, Pipeline
+from dyno.instrumentation import Instrumentation, InstrumentedStage
+from dyno.strategy import DataStrategy
+from dyno.helpers import all_cryptocurrency_exchanges
+from dyno.helpers import build_basic_signal_strategy
+from dyno.helpers import build_basic_signal_pipeline
+
+from test.backtest.mock_environment import RandomSignalStrategy, random_ticks
+
+
+def build_instrumented_pipeline(**params):
+    pipeline = build_basic_signal_pipeline(RandomSignalStrategy,
+                                           {"GBP": 1000, "BTC": 1},
+                                           **params)
+    pipeline.enable_instrumentation()
+    return pipeline
+
+
+class TestInstrumentation(InstrumentationTest):
+    def make_pipeline(self):
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        return build_basic_signal_strategy(RandomSignalStrategy(exchanges), exchanges)
+
+    def test_1(self):
+        events = random_ticks(500)
+        expected = list(self.make_pipeline().stream(events))
+
+        # off by default
+        pipeline = self.make_pipeline()
+        self.assertTrue(pipeline.get_instrumentation() is None)
+
+        instrumentation = pipeline.enable_instrumentation()
+        outputs = list(pipeline.stream(events))
+
+        # instrumenting does not change the outputs
+        self.assertTrue(outputs == expected)
+        self.assertTrue(pipeline.get_instrumentation() is instrumentation)
+
+        counters = instrumentation.to_dict()
+        totals = instrumentation.totals()
+        self.assertTrue(list(counters)[0] == "0 DataStrategy")
+
+        # every input event reaches the first stage, each stage's outputs are the
+        # next stage's inputs, and the last stage's outputs are the pipeline's
+        names = list(totals)
+        self.assertTrue(totals[names[0]]["events_in"] == len(events))
+        for name, next_name in zip(names, names[1:]):
+            self.assertTrue(totals[name]["events_out"] ==
+                            totals[next_name]["events_in"])
+        self.assertTrue(totals[names[-1]]["events_out"] == len(outputs))
+
+        # the data stage handles every best bid / ask
+        data = counters["0 DataStrategy"]
+        self.assertTrue(data["best_bid"]["handler_calls"] +
+                        data["best_ask"]["handler_calls"] == len(events))
+        self.assertTrue(all(total["wall_ns"] >= 0 and total["cpu_ns"] >= 0
+                            for total in totals.values()))
+
+        # and off again
+        pipeline.disable_instrumentation()
+        pipeline(events[:1])
+        self.assertTrue(pipeline.get_instrumentation() is None)
+        self.assertTrue(instrumentation.totals()[names[0]]["events_in"] ==
+                        len(events))
+
+    def test_2(self):
+        a = Instrumentation()
+        a.record("0 DataStrategy", "best_bid", 1, 2, 1, 100, 50)
+        a.record("0 DataStrategy", "best_bid", 1, 2, 1, 100, 50)
+
+        b = Instrumentation()
+        b.record("0 DataStrategy", "best_ask", 1, 2, 1, 300, 150)
+        b.record("1 RiskStrategy", "long", 1, 1, 1, 10, 10)
+
+        # merged from objects and from dictionaries, e.g. sent back by workers
+        merged = Instrumentation.merge_all([a, pickle.loads(pickle.dumps(b))])
+        self.assertTrue(Instrumentation.merge_all([a.to_dict(), b.to_dict()])
+                        .to_dict() == merged.to_dict())
+
+        counters = merged.to_dict()
+        self.assertTrue(counters["0 DataStrategy"]["best_bid"] == {
+            "events_in": 2,
+            "events_out": 4,
+            "handler_calls": 2,
+            "wall_ns": 200,
+            "cpu_ns": 100
+        })
+        self.assertTrue(merged.totals()["0 DataStrategy"]["wall_ns"] == 500)
+
+        # one row per stage and event name plus a total per stage
+        table = str(merged)
+        self.assertTrue(len(table.splitlines()) == 2 + 3 + 2)
+        self.assertTrue("best_ask" in table and "(total)" in table)
+        self.assertTrue("98.0" in table)
+
+        self.assertTrue(Instrumentation().is_empty())
+        self.assertTrue(Instrumentation().table().splitlines()[0].startswith("stage"))
+
+    def test_3(self):
+        events = random_ticks(100)
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        data = DataStrategy(exchanges)
+        pipeline = Pipeline(data, double_stage)
+
+        instrumentation = pipeline.enable_instrumentation()
+        outputs = pipeline(events)
+
+        # other callables are counted a batch at a time
+        counters = instrumentation.to_dict()["1 function"]["*"]
+        self.assertTrue(counters["events_in"] == len(outputs) // 2)
+        self.assertTrue(counters["events_out"] == len(outputs))
+        self.assertTrue(counters["handler_calls"] == 0)
+
+        # the wrapped stage can be pickled, and checkpoints skip the counters
+        self.assertTrue(isinstance(pickle.loads(pickle.dumps(pipeline._stages[1])),
+                                   InstrumentedStage))
+        self.assertFalse("_instrumentation" in data.get_state())
+
+        pipeline.disable_instrumentation()
+        self.assertTrue(pipeline.get_stages() == (data, double_stage))
+        self.assertTrue(pipeline._stages[1] is double_stage)
+
+    def test_4(self):
+        events = random_ticks(300)
+        grid = {"random_seed": [1, 2]}
+
+        local = Ensemble(events, build_instrumented_pipeline, grid,
+                         processes=1).execute()
+        pooled = Ensemble(events, build_instrumented_pipeline, grid,
+                          processes=2).execute()
+
+        # counters come back from every worker and can be merged
+        merged = Instrumentation.merge_all(summary["instrumentation"]
+                                           for _, summary in pooled)
+        self.assertTrue(merged.totals()["0 DataStrategy"]["events_in"] ==
+                        2 * len(events))
+        self.assertTrue([summary["trades"] for _, summary in local] ==
+                        [summary["trades"] for _, summary in pooled])
+
+        # a plain backtest of an instrumented pipeline
+        pipeline = build_instrumented_pipeline(random_seed=1)
+        Backtest(events, pipeline).execute()
+        self.assertTrue(pipeline.get_instrumentation().totals()["0 DataStrategy"]
+                        ["events_in"] == len(events))
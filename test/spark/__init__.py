@@ -0,0 +1 @@
+from .test_spark import *
@@ -0,0 +1,287 @@
+import collections
+import copy
+import functools
+import types
+import unittest
+import unittest.mock
+
+import numpy as np
+
+
+# stands in for a pyspark Row: fields are read as attributes
+Row = collections.namedtuple(
+    "Row",
+    ["unix_ts_ns", "market_id", "side", "price", "liquidity", "exchange_name"])
+
+
+def rows_from_events(events):
+    """ Convert best_bid/best_ask events into rows, with prices as strings like
+    columns read from a CSV file.
+    """
+    return [Row(unix_ts_ns, values["market_id"],
+                "bids" if event_name == "best_bid" else "asks",
+                str(values["price"]), str(values["liquidity"]),
+                values["exchange_name"])
+            for event_name, unix_ts_ns, values in events]
+
+
+class Accumulator:
+    """ Stands in for a pyspark accumulator: add merges with the accumulator param.
+    """
+    def __init__(self, value, accum_param):
+        self.value = value
+        self._accum_param = accum_param
+
+    def add(self, term):
+        self.value = self._accum_param.addInPlace(self.value, term)
+
+    def __deepcopy__(self, memo):
+        # tasks add to the driver's accumulator
+        return self
+
+
+class SparkContext:
+    def accumulator(self, value, accum_param):
+        return Accumulator(value, accum_param)
+
+
+def columns_from_events(events):
+    """ Convert best_bid/best_ask events into columns as they come out of an arrow
+    record batch.
+    """
+    return {
+        "unix_ts_ns": np.array([ts for _, ts, _ in events]),
+        "exchange_name": [values["exchange_name"] for _, _, values in events],
+        "market_id": np.array([values["market_id"] for _, _, values in events]),
+        "side": ["bids" if name == "best_bid" else "asks" for name, _, _ in events],
+        "price": np.array([values["price"] for _, _, values in events]),
+        "liquidity": np.array([values["liquidity"] for _, _, values in events])
+    }
+
+
+def copy_function(func):
+    """ Copy a function with what its closure refers to, as spark does when it sends
+    a function to a task, so every partition gets its own copy of the pipeline.
+    """
+    if func.__closure__ is None:
+        return func
+
+    contents = copy.deepcopy([cell.cell_contents for cell in func.__closure__])
+    return types.FunctionType(func.__code__, func.__globals__, func.__name__,
+                              func.__defaults__,
+                              tuple(types.CellType(value) for value in contents))
+
+
+@functools.lru_cache(maxsize=None)
+def row_type(fields):
+    return collections.namedtuple("Row", fields)
+
+
+def make_row(values):
+    """ Convert a dictionary of fields into a row.
+    """
+    return row_type(tuple(values))(**values)
+
+
+class RDD:
+    """ Stands in for a pyspark RDD: a list of partitions, each a list of rows.
+    """
+    def __init__(self, partitions):
+        self.partitions = [list(partition) for partition in partitions]
+        self.persisted = False
+
+    def map(self, func):
+        return RDD([func(row) for row in partition]
+                   for partition in self.partitions)
+
+    def mapPartitions(self, func):
+        return RDD(copy_function(func)(iter(partition))
+                   for partition in self.partitions)
+
+    def persist(self):
+        self.persisted = True
+        return self
+
+    def treeAggregate(self, zero, seq_op, comb_op):
+        results = []
+
+        for partition in self.partitions:
+            value = copy.deepcopy(zero)
+            for row in partition:
+                value = seq_op(value, row)
+            results.append(value)
+
+        return functools.reduce(comb_op, results, copy.deepcopy(zero))
+
+    def toLocalIterator(self):
+        return (row for partition in self.partitions for row in partition)
+
+
+# the spark sql types of Column.cast
+CASTS = {"long": int, "double": float, "string": str}
+
+
+class Column:
+    """ Stands in for a pyspark column of a data frame, optionally cast.
+    """
+    def __init__(self, name, cast_type=None):
+        self.name = name
+        self._cast_type = cast_type
+
+    def cast(self, cast_type):
+        return Column(self.name, cast_type)
+
+    def value(self, row):
+        value = row[self.name]
+        return value if self._cast_type is None else CASTS[self._cast_type](value)
+
+
+class Literal:
+    def __init__(self, literal):
+        self._literal = literal
+
+    def value(self, row):
+        return self._literal
+
+
+# stands in for pyspark.sql.functions
+mock_functions = types.SimpleNamespace(col=Column, lit=Literal)
+
+
+class ArrowArray:
+    def __init__(self, values):
+        self._values = values
+
+    def to_numpy(self, zero_copy_only=True):
+        return np.array(self._values)
+
+
+class RecordBatch:
+    """ Stands in for an arrow record batch: a dictionary of equal length lists.
+    """
+    def __init__(self, columns):
+        self._columns = columns
+        self.schema = types.SimpleNamespace(names=list(columns))
+
+    @staticmethod
+    def from_pydict(pydict, schema=None):
+        if schema is not None and list(pydict) != [name for name, _ in schema]:
+            raise Exception("the columns do not match the schema")
+
+        return RecordBatch({name: list(column) for name, column in pydict.items()})
+
+    def column(self, name):
+        return ArrowArray(self._columns[name])
+
+    def to_pylist(self):
+        names = self.schema.names
+        return [dict(zip(names, values))
+                for values in zip(*self._columns.values())]
+
+
+# stands in for pyarrow: types are their names
+mock_pyarrow = types.SimpleNamespace(
+    RecordBatch=RecordBatch,
+    schema=list,
+    list_=lambda value_type: ("list", value_type),
+    string=lambda: "string",
+    int64=lambda: "int64",
+    int8=lambda: "int8",
+    float64=lambda: "float64")
+
+
+class DataFrame:
+    """ Stands in for a pyspark data frame: a list of partitions, each a list of rows
+    given as dictionaries. mapInArrow sends each partition to python as record
+    batches of batch_size rows.
+    """
+    def __init__(self, partitions, batch_size=100):
+        self.partitions = [list(partition) for partition in partitions]
+        self._batch_size = batch_size
+
+    @staticmethod
+    def from_rows(rows, batch_size=100):
+        """ A data frame of rows in one partition, in the given order.
+        """
+        return DataFrame([[row._asdict() for row in rows]], batch_size)
+
+    def with_partitions(self, partitions):
+        return DataFrame(partitions, self._batch_size)
+
+    def withColumn(self, name, column):
+        return self.with_partitions([{**row, name: column.value(row)}
+                                     for row in partition]
+                                    for partition in self.partitions)
+
+    def repartitionByRange(self, *args):
+        # the number of partitions is optional (spark's default is 200)
+        if isinstance(args[0], int):
+            num_partitions, keys = args[0], args[1:]
+        else:
+            num_partitions, keys = 200, args
+
+        rows = [row for partition in self.partitions for row in partition]
+        key = lambda row: tuple(column.value(row) for column in keys)
+
+        # contiguous ranges of keys, a key is never split
+        ranges = sorted({key(row) for row in rows})
+        num_partitions = min(num_partitions, len(ranges))
+        index = {value: i * num_partitions // len(ranges)
+                 for i, value in enumerate(ranges)}
+
+        partitions = [[] for _ in range(num_partitions)]
+
+        for row in rows:
+            partitions[index[key(row)]].append(row)
+
+        return self.with_partitions(partitions)
+
+    def sortWithinPartitions(self, *names):
+        return self.with_partitions(
+            sorted(partition, key=lambda row: tuple(row[name] for name in names))
+            for partition in self.partitions)
+
+    def select(self, *columns):
+        return self.with_partitions([{column.name: column.value(row)
+                                      for column in columns}
+                                     for row in partition]
+                                    for partition in self.partitions)
+
+    @property
+    def rdd(self):
+        return RDD([make_row(row) for row in partition]
+                   for partition in self.partitions)
+
+    def mapInArrow(self, func, schema):
+        partitions = []
+
+        for partition in self.partitions:
+            batches = []
+
+            for start in range(0, len(partition), self._batch_size):
+                rows = partition[start:start + self._batch_size]
+                batches.append(RecordBatch.from_pydict(
+                    {name: [row[name] for row in rows] for name in rows[0]}))
+
+            partitions.append([row
+                               for batch in copy_function(func)(iter(batches))
+                               for row in batch.to_pylist()])
+
+        return self.with_partitions(partitions)
+
+
+class SparkTest(unittest.TestCase):
+    def setUp(self):
+        # the optional spark modules are replaced by the mocks above
+        self._patches = [
+            unittest.mock.patch("dyno.spark.import_spark_functions",
+                                lambda: mock_functions),
+            unittest.mock.patch("dyno.spark.import_pyarrow", lambda: mock_pyarrow)
+        ]
+
+        for patch in self._patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self._patches:
+            patch.stop()
@@ -0,0 +1,197 @@
+from .mock_environment import SparkTest, SparkContext, rows_from_events
+from .mock_environment import DataFrame, make_row
+from .mock_environment import columns_from_events
+
+import collections
+import random
+
+import numpy as np
+
+from dyno.backtest import Results, ResultsColumns, Backtest
+from dyno.spark import row_to_event, run_partition
+from dyno.spark import columns_to_events, outputs_to_columns, row_to_output
+from dyno.spark import RESULT_COLUMNS
+from dyno.spark import instrumentation_accumulator
+from dyno.spark import SparkEvents, ArrowSparkEvents
+from dyno.helpers import all_cryptocurrency_exchanges
+from dyno.helpers import build_basic_signal_strategy
+
+from test.backtest.mock_environment import RandomSignalStrategy, random_ticks
+
+
+class TestSpark(SparkTest):
+    def make_pipeline(self):
+        exchanges = all_cryptocurrency_exchanges({"GBP": 1000, "BTC": 1})
+        return build_basic_signal_strategy(RandomSignalStrategy(exchanges), exchanges)
+
+    def test_1(self):
+        [row] = rows_from_events(random_ticks(1))
+        event_name, unix_ts_ns, values = row_to_event(row)
+
+        self.assertTrue(event_name == ("best_bid" if row.side == "bids"
+                                       else "best_ask"))
+        self.assertTrue(values["price"] == float(row.price))
+        self.assertTrue(values["exchange_name"] == "COINBASE.SPOT")
+
+        # the exchange name can be given instead of read from the row
+        _, _, values = row_to_event(row, "KRAKEN.SPOT")
+        self.assertTrue(values["exchange_name"] == "KRAKEN.SPOT")
+
+    def test_2(self):
+        events = random_ticks(1000)
+
+        # one pipeline instance per partition keeps its state across rows
+        outputs = list(run_partition(self.make_pipeline(), rows_from_events(events)))
+        pipeline = self.make_pipeline()
+        expected = [pipeline([event]) for event in events]
+
+        self.assertTrue(len(outputs) == len(events))
+        self.assertTrue(outputs == expected)
+
+    def test_3(self):
+        events = random_ticks(100)
+
+        # columns as they come out of an arrow record batch
+        columns = columns_from_events(events)
+
+        self.assertTrue(list(columns_to_events(columns)) == events)
+
+    def test_4(self):
+        events = random_ticks(1000)
+        pipeline = self.make_pipeline()
+        outputs = [output for event in events for output in pipeline([event])]
+
+        # only the outputs Results needs are sent back, one column per field
+        columns = outputs_to_columns(outputs)
+        self.assertTrue(set(columns["event_name"]) <=
+                        {"mid_market_price", "bid_fill", "ask_fill",
+                         "long_executed", "short_executed"})
+
+        # rows of those columns give the same results
+        Row = collections.namedtuple("Row", RESULT_COLUMNS)
+        rows = [Row(*fields) for fields in zip(*columns.values())]
+
+        expected = Results(outputs).summary()
+        results = Results([row_to_output(row) for row in rows]).summary()
+        self.assertTrue(results == expected)
+
+    def test_5(self):
+        events = random_ticks(400)
+        rows = rows_from_events(events)
+        accumulator = instrumentation_accumulator(SparkContext())
+
+        # two partitions, each with its own copy of the pipeline
+        for partition in (rows[:100], rows[100:]):
+            list(run_partition(self.make_pipeline(), partition,
+                               instrumentation=accumulator))
+
+        totals = accumulator.value.totals()
+        self.assertTrue(totals["0 DataStrategy"]["events_in"] == len(events))
+
+    def make_events(self):
+        """ Ticks of three books, in time order.
+        """
+        events = random_ticks(300, 1, "COINBASE.SPOT", 1) + \
+            random_ticks(300, 2, "COINBASE.SPOT", 2) + \
+            random_ticks(300, 3, "KRAKEN.SPOT", 1)
+
+        return sorted(events, key=lambda event: event[1])
+
+    def make_data_frame(self, events):
+        # spark does not keep the rows in order
+        rows = rows_from_events(events)
+        random.Random(7).shuffle(rows)
+        return DataFrame.from_rows(rows)
+
+    def expected_results(self, events):
+        # every book is backtested with its own copy of the pipeline
+        books = sorted({(values["exchange_name"], values["market_id"])
+                        for _, _, values in events})
+
+        return Results([output
+                        for book in books
+                        for output in self.make_pipeline().stream(
+                            [event for event in events
+                             if (event[2]["exchange_name"],
+                                 event[2]["market_id"]) == book])])
+
+    def test_6(self):
+        events = self.make_events()
+        df = self.make_data_frame(events)
+        expected = self.expected_results(events)
+
+        # range partitioned by book, one partition per book
+        partitioned = SparkEvents(df).partitioned()
+        self.assertTrue(len(partitioned.partitions) == 3)
+        self.assertTrue(all(len({(row["exchange_name"], row["market_id"])
+                                 for row in partition}) == 1
+                            for partition in partitioned.partitions))
+
+        # partitions are collected into columns and merged, without mid prices
+        backtest = Backtest(SparkEvents(df), self.make_pipeline())
+        results = backtest.execute()
+        self.assertTrue(results.summary() == expected.summary())
+        self.assertTrue(len(results.mid_market_prices()[0]) == 0)
+        self.assertTrue(backtest.get_persisted() is None)
+
+        # unless asked for
+        results = Backtest(SparkEvents(df), self.make_pipeline(),
+                           mid_prices=True).execute()
+        self.assertTrue(np.array_equal(np.sort(results.mid_market_prices()[0]),
+                                       np.sort(expected.mid_market_prices()[0])))
+
+        # only the trade and fill columns of each partition are persisted
+        backtest = Backtest(SparkEvents(df), self.make_pipeline(), persist=True)
+        results = backtest.execute()
+        persisted = backtest.get_persisted()
+        self.assertTrue(persisted.persisted)
+        self.assertTrue(all(len(columns.mid_ts) == 0 and
+                            isinstance(columns, ResultsColumns)
+                            for [columns] in persisted.partitions))
+        self.assertTrue(results.summary() == expected.summary())
+
+        self.assertRaises(Exception, Backtest(SparkEvents(df),
+                                              self.make_pipeline(),
+                                              mid_prices=True,
+                                              persist=True).execute)
+
+        # a data frame of one exchange's rows without an exchange_name column
+        coinbase = [event for event in events
+                    if event[2]["exchange_name"] == "COINBASE.SPOT"]
+        rows = [make_row({name: value for name, value in row._asdict().items()
+                          if name != "exchange_name"})
+                for row in rows_from_events(coinbase)]
+        accumulator = instrumentation_accumulator(SparkContext())
+
+        results = Backtest(SparkEvents(DataFrame.from_rows(rows), "COINBASE.SPOT",
+                                       num_partitions=1,
+                                       instrumentation=accumulator),
+                           self.make_pipeline()).execute()
+        self.assertTrue(results.summary() ==
+                        Results(self.make_pipeline().stream(coinbase)).summary())
+        self.assertTrue(accumulator.value.totals()["0 DataStrategy"]["events_in"] ==
+                        len(coinbase))
+
+    def test_7(self):
+        events = self.make_events()
+        df = self.make_data_frame(events)
+        expected = self.expected_results(events)
+
+        # each partition's batches are collected into columns where they are
+        # produced, and one row of columns per partition comes back
+        for mid_prices in (False, True):
+            backtest = Backtest(ArrowSparkEvents(df), self.make_pipeline(),
+                                mid_prices=mid_prices)
+            results = backtest.execute()
+
+            self.assertTrue(results.summary() == expected.summary())
+            self.assertTrue(results.event_timings() == expected.event_timings())
+            self.assertTrue(np.array_equal(results.all_fees_incurred(),
+                                           expected.all_fees_incurred()))
+            self.assertTrue(len(results.mid_market_prices()[0]) ==
+                            (len(expected.mid_market_prices()[0])
+                             if mid_prices else 0))
+
+        # the outputs Results needs can also come back as rows
+        results = Results(ArrowSparkEvents(df).pipe(self.make_pipeline()))
+        self.assertTrue(results.summary() == expected.summary())
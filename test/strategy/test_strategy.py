@@ -1,4 +1,9 @@
+import random
+
+import numpy as np
+
 from .mock_environment import StrategyTest, QueueTest
+from .mock_environment import TestExchange1
 
 from dyno.strategy import Strategy
 from dyno.strategy import DataStrategy
@@ -7,6 +12,7 @@ from dyno.strategy import ExecutionStrategy
 from dyno.strategy import EntryStrategy
 from dyno.strategy import PositionStrategy
 from dyno.strategy import ExitStrategy
+from dyno.strategy import MakerStrategy, RestingOrderSide
 from dyno.strategy import BidQueue, AskQueue
 
 
@@ -24,6 +30,62 @@ class TestBaseStrategy(StrategyTest):
         self.assertTrue(s([ask]), [ask])
         self.assertTrue(s([something]), [something])
 
+    def test_2(self):
+        class Overrides(Strategy):
+            def on_best_bid(self, unix_ts_ns, values):
+                return []
+
+            def on_something(self, unix_ts_ns, values):
+                return [("something_else", unix_ts_ns, values)]
+
+        s = Overrides(self._exchanges)
+
+        # the dispatch table lists every handled event name
+        self.assertTrue(Strategy.handles() == {"best_bid", "best_ask"})
+        self.assertTrue(Overrides.handles() == {"best_bid", "best_ask", "something"})
+
+        # overridden handlers replace the base class handlers
+        self.assertTrue(s([("best_bid", 0, 123)]) == [])
+        self.assertTrue(s([("best_ask", 0, 456)]) == [("best_ask", 0, 456)])
+        self.assertTrue(s([("something", 0, 789)]) == [("something_else", 0, 789)])
+        self.assertTrue(s([("unknown", 0, 1)]) == [("unknown", 0, 1)])
+
+    def test_3(self):
+        # decorated handlers are found in the dispatch table
+        self.assertTrue({"long", "short"} <= RiskStrategy.handles())
+        self.assertTrue({"take_from_bids", "take_from_asks"} <= EntryStrategy.handles())
+        self.assertTrue("mid_market_price" in PositionStrategy.handles())
+        self.assertTrue(DataStrategy._handlers["best_bid"] is DataStrategy.on_best_bid)
+
+    def test_4(self):
+        class Handlers(Strategy):
+            @staticmethod
+            def on_static(unix_ts_ns, values):
+                return [("static_out", unix_ts_ns, values)]
+
+            @classmethod
+            def on_class(cls, unix_ts_ns, values):
+                return [(cls.__name__, unix_ts_ns, values)]
+
+        s = Handlers(self._exchanges)
+
+        # handlers assigned to the instance are called, and override the class's
+        s.on_assigned = lambda unix_ts_ns, values: [("assigned_out", unix_ts_ns, values)]
+        s.on_best_bid = lambda unix_ts_ns, values: []
+
+        self.assertTrue(s([("static", 0, 1), ("class", 1, 2), ("assigned", 2, 3),
+                           ("best_bid", 3, 4), ("best_ask", 4, 5)]) ==
+                        [("static_out", 0, 1), ("Handlers", 1, 2),
+                         ("assigned_out", 2, 3), ("best_ask", 4, 5)])
+
+        # the same handlers are called when instrumented
+        s.enable_instrumentation()
+        self.assertTrue(s([("assigned", 5, 6), ("best_bid", 6, 7)]) ==
+                        [("assigned_out", 5, 6)])
+
+        # the handlers are not part of the strategy's state
+        self.assertTrue("_bound_handlers" not in s.get_state())
+
 
 class TestDataStrategy(StrategyTest):
     def test_1(self):
@@ -81,6 +143,75 @@ class TestDataStrategy(StrategyTest):
         self.assertTrue(len(s([ask2])) == 3)
 
 
+    def test_2(self):
+        rand = random.Random(7)
+        initial_balances = {"GBP": 2500, "BTC": 0.5}
+
+        # random updates for markets 1, 2 (existing books) and 3 (new book)
+        n = 1000
+        unix_ts_ns = np.arange(n)
+        market_ids = np.array([rand.choice([1, 2, 3]) for _ in range(n)])
+        is_bid = np.array([rand.random() < 0.5 for _ in range(n)])
+        prices = np.array([100 + rand.gauss(0, 1) for _ in range(n)])
+        liquidity = np.array([rand.uniform(0, 10) for _ in range(n)])
+
+        # per event path
+        scalar = DataStrategy({"EXCHANGE 1": TestExchange1(initial_balances)})
+        outputs = scalar([
+            ("best_bid" if is_bid[i] else "best_ask", int(unix_ts_ns[i]), {
+                "exchange_name": "EXCHANGE 1",
+                "market_id": int(market_ids[i]),
+                "price": float(prices[i]),
+                "liquidity": float(liquidity[i])
+            })
+            for i in range(n)])
+
+        expected_mids = [v["mid_market_price"] for name, _, v in outputs
+                         if name == "mid_market_price"]
+        expected_lin = [v["lin"] for name, _, v in outputs
+                        if name == "mid_market_price_returns"]
+        expected_log = [v["log"] for name, _, v in outputs
+                        if name == "mid_market_price_returns"]
+
+        # block path, split into uneven blocks to test state carry over
+        exchanges = {"EXCHANGE 1": TestExchange1(initial_balances)}
+        block = DataStrategy(exchanges)
+        mids, lin, log = [], [], []
+
+        for start, end in [(0, 1), (1, 250), (250, 251), (251, 700), (700, n)]:
+            rows = slice(start, end)
+            [(name, _, values)] = block([
+                ("best_bid_ask_block", end, {
+                    "exchange_name": "EXCHANGE 1",
+                    "unix_ts_ns": unix_ts_ns[rows],
+                    "market_id": market_ids[rows],
+                    "is_bid": is_bid[rows],
+                    "price": prices[rows],
+                    "liquidity": liquidity[rows]
+                })])
+
+            self.assertTrue(name == "mid_market_price_block")
+            mids.extend(values["mid_market_price"][~np.isnan(values["mid_market_price"])])
+            lin.extend(values["lin"][~np.isnan(values["lin"])])
+            log.extend(values["log"][~np.isnan(values["log"])])
+
+        self.assertTrue(np.array_equal(mids, expected_mids))
+        self.assertTrue(np.array_equal(lin, expected_lin))
+        self.assertTrue(np.allclose(log, expected_log, rtol=0, atol=1e-15))
+
+        # same final state for books and mid market prices
+        for market_id in [1, 2, 3]:
+            self.assertTrue(
+                exchanges["EXCHANGE 1"].get_best_bid(market_id) ==
+                scalar._exchanges["EXCHANGE 1"].get_best_bid(market_id))
+            self.assertTrue(
+                exchanges["EXCHANGE 1"].get_best_ask(market_id) ==
+                scalar._exchanges["EXCHANGE 1"].get_best_ask(market_id))
+
+        self.assertTrue(block._curr_mid_market_prices == scalar._curr_mid_market_prices)
+        self.assertTrue(block._prev_mid_market_prices == scalar._prev_mid_market_prices)
+
+
 class TestRiskStrategy(StrategyTest):
     def test_1(self):
         # ...
@@ -138,7 +269,7 @@ class TestExecutionStrategy(StrategyTest):
         s = ExecutionStrategy(self._exchanges)
 
         # ...
-        s._ask_queue.append(127, {
+        s.get_ask_queue("EXCHANGE 1", 1).append(127, {
             "market_id": 1,
             "exchange_name": "EXCHANGE 1",
             "base_currency": "BTC",
@@ -148,7 +279,10 @@ class TestExecutionStrategy(StrategyTest):
         })
 
         # ...
-        outputs = s.on_best_ask(1, [])
+        outputs = s.on_best_ask(1, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 1
+        })
 
         # ...
         self.assertTrue(len(outputs) == 2)
@@ -156,6 +290,86 @@ class TestExecutionStrategy(StrategyTest):
         # ...
         self.assertTrue(outputs[1][2]["amount"] != 250)
 
+    def test_2(self):
+        s = ExecutionStrategy(self._exchanges)
+        exchange = self._exchanges["EXCHANGE 1"]
+
+        # full depth book for market 3
+        exchange.apply_l2_snapshot(3, bids=[(99, 1)], asks=[(100, 1), (101, 1)])
+
+        # an order taking from the asks with a limit price of 101
+        s.get_ask_queue("EXCHANGE 1", 3).append(101, {
+            "market_id": 3,
+            "exchange_name": "EXCHANGE 1",
+            "base_currency": "BTC",
+            "quote_currency": "GBP",
+            "price": 101,
+            "remaining": 150
+        })
+
+        # the order is filled across both ask levels
+        outputs = s([("l2_delta", 1, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 3,
+            "side": "bids",
+            "price": 98,
+            "liquidity": 1
+        })])
+
+        fills = [values for name, _, values in outputs if name == "ask_fill"]
+        self.assertTrue([fill["fill_price"] for fill in fills] == [100, 101])
+        self.assertTrue(sum(fill["amount"] for fill in fills) == 150)
+        self.assertTrue(exchange.get_best_ask(3)[0] == 101)
+
+    def test_3(self):
+        s = DataStrategy(self._exchanges)
+
+        outputs = s([("l2_snapshot", 1, {
+            "exchange_name": "EXCHANGE 2",
+            "market_id": 3,
+            "bids": [(99, 1), (98, 2)],
+            "asks": [(101, 1), (102, 2)]
+        })])
+
+        # snapshot forwarded plus a mid market price
+        self.assertTrue([name for name, _, _ in outputs] ==
+                        ["l2_snapshot", "mid_market_price"])
+        self.assertTrue(outputs[1][2]["mid_market_price"] == 100)
+
+    def test_4(self):
+        s = ExecutionStrategy(self._exchanges)
+
+        # an order on market 2 that cannot match...
+        s.get_ask_queue("EXCHANGE 1", 2).append(1, {
+            "market_id": 2,
+            "exchange_name": "EXCHANGE 1",
+            "base_currency": "BTC",
+            "quote_currency": "GBP",
+            "price": 1,
+            "remaining": 100
+        })
+
+        # ...does not block an order on market 1
+        s.get_ask_queue("EXCHANGE 1", 1).append(127, {
+            "market_id": 1,
+            "exchange_name": "EXCHANGE 1",
+            "base_currency": "BTC",
+            "quote_currency": "GBP",
+            "price": 127,
+            "remaining": 100
+        })
+
+        outputs = s([("best_ask", 1, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 1
+        })])
+
+        self.assertTrue([name for name, _, _ in outputs] ==
+                        ["best_ask", "ask_fill"])
+        self.assertTrue(len(s.get_ask_queue("EXCHANGE 1", 2)) == 1)
+        self.assertTrue(len(s.get_ask_queue("EXCHANGE 1", 1)) == 0)
+
+
 class TestPositionStrategy(StrategyTest):
     def test_1(self):
         s = PositionStrategy(self._exchanges)
@@ -211,6 +425,129 @@ class TestPositionStrategy(StrategyTest):
         self.assertTrue(len(outputs) == 2)
 
 
+class TestMakerStrategy(StrategyTest):
+    def quote(self, event_name, unix_ts_ns, price, liquidity):
+        return (event_name, unix_ts_ns, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 1,
+            "price": price,
+            "liquidity": liquidity
+        })
+
+    def join(self, event_name, unix_ts_ns, price, amount):
+        return (event_name, unix_ts_ns, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 1,
+            "base_currency": "BTC",
+            "quote_currency": "GBP",
+            "price": price,
+            "amount": amount
+        })
+
+    def test_1(self):
+        s = MakerStrategy(self._exchanges)
+
+        # 2 BTC ahead of the order at the best bid
+        s([self.quote("best_bid", 1, 100, 2)])
+        outputs = s([self.join("join_bids", 2, 100, 100)])
+        self.assertTrue(outputs[0][0] == "resting_bid_placed")
+
+        # 1.5 BTC trades: still 0.5 BTC ahead of the order
+        outputs = s([self.quote("best_bid", 3, 100, 0.5)])
+        self.assertTrue(len(outputs) == 1)
+
+        # 0.5 BTC more trades: the queue ahead is consumed, half the order fills
+        outputs = s([self.quote("best_bid", 4, 100, 1.5)])
+        self.assertTrue(len(outputs) == 1)
+        outputs = s([self.quote("best_bid", 5, 100, 0.5)])
+        self.assertTrue(outputs[1][0] == "bid_maker_fill")
+        self.assertTrue(outputs[1][2]["amount"] == 50)
+        self.assertTrue(outputs[1][2]["remaining"] == 50)
+
+        # maker fee is charged
+        self.assertTrue(outputs[1][2]["fee"] ==
+                        self._exchanges["EXCHANGE 1"].get_maker_quoted_fee(50))
+        self.assertTrue(
+            self._exchanges["EXCHANGE 1"].get_balance("BTC") == 1)
+
+    def test_2(self):
+        s = MakerStrategy(self._exchanges)
+
+        # orders rest at 101 and 102 on the asks side behind 1 BTC each
+        s([self.quote("best_ask", 1, 101, 1)])
+        s([self.join("join_asks", 2, 101, 101),
+           self.join("join_asks", 2, 102, 102)])
+
+        # price trades through 101 and 102 is now the best ask
+        outputs = s([self.quote("best_ask", 3, 102, 1)])
+        self.assertTrue([name for name, _, _ in outputs] ==
+                        ["best_ask", "ask_maker_fill"])
+        self.assertTrue(outputs[1][2]["fill_price"] == 101)
+
+        # best bid crosses 102 and fills the other order
+        outputs = s([self.quote("best_bid", 4, 102, 1)])
+        self.assertTrue([name for name, _, _ in outputs] ==
+                        ["best_bid", "ask_maker_fill"])
+        self.assertTrue(outputs[1][2]["fill_price"] == 102)
+
+    def test_3(self):
+        s = MakerStrategy(self._exchanges)
+
+        # many resting orders at one level fill in FIFO order
+        s([self.quote("best_bid", 1, 100, 1)])
+        s([self.join("join_bids", 2, 100, 100) for _ in range(10000)])
+
+        # cancel the first order
+        s([("cancel_resting_order", 3, {
+            "exchange_name": "EXCHANGE 1",
+            "market_id": 1,
+            "order_id": 0
+        })])
+
+        outputs = s([self.quote("best_bid", 4, 100, 0),
+                     self.quote("best_bid", 5, 100, 0)])
+        self.assertTrue(len(outputs) == 2)
+
+        # 3 BTC leave the level: the next 3 orders fill
+        s([self.quote("best_bid", 6, 100, 3)])
+        outputs = s([self.quote("best_bid", 7, 100, 0)])
+        fills = [values for name, _, values in outputs
+                 if name == "bid_maker_fill"]
+        self.assertTrue([values["order_id"] for values in fills] == [1, 2, 3])
+
+    def test_4(self):
+        side = RestingOrderSide("asks")
+        side.update_best(101, 1)
+        side.add(0, 101, {"order_id": 0}, 2)
+
+        # price trades through 101: the order fills in full and is forgotten
+        [(order, filled)] = side.update_best(102, 1)
+        self.assertTrue(filled == 2 and order.filled == 2)
+        self.assertTrue(len(side) == 0)
+
+        # so there is nothing left to cancel
+        self.assertFalse(side.cancel(0))
+        self.assertTrue(len(side) == 0)
+
+    def test_5(self):
+        side = RestingOrderSide("bids")
+        side.update_best(100, 1)
+
+        # orders behind the best level are placed once it becomes the best
+        side.add(0, 99, {"order_id": 0}, 1)
+        side.add(1, 99, {"order_id": 1}, 1)
+        side.add(2, 99, {"order_id": 2}, 1)
+        self.assertTrue(side.cancel(1))
+        side.update_best(99, 2)
+
+        # 2 BTC ahead, then the remaining two orders
+        fills = side.update_best(99, 0) + side.update_best(99, 3) + \
+            side.update_best(99, 1)
+        self.assertTrue([(order.values["order_id"], filled)
+                         for order, filled in fills] == [(0, 1.0), (2, 1.0)])
+        self.assertTrue(len(side) == 0)
+
+
 class TestBidQueue(QueueTest):
     def test_1(self):
         # ...
@@ -223,6 +560,29 @@ class TestBidQueue(QueueTest):
         self.assertTrue(self._queue.pop() == "input 2")
         self.assertTrue(self._queue.pop() == "input 3")
 
+    def test_2(self):
+        # orders with the same price are executed first in first out
+        # (the values are never compared)
+        first = self._queue.append(1, {"id": 1})
+        self._queue.append(1, {"id": 2})
+        self._queue.append(2, {"id": 3})
+        self.assertTrue([values["id"] for values in self._queue] == [1, 2, 3])
+
+        # peek does not remove the order
+        self.assertTrue(self._queue.peek() == {"id": 1})
+        self.assertTrue(len(self._queue) == 3)
+
+        # cancel and amend by order id
+        self.assertTrue(self._queue.cancel(first) == {"id": 1})
+        self.assertTrue(self._queue.cancel(first) is None)
+        self._queue.amend(self._queue.peek_id(), price=3)
+        self.assertTrue([values["id"] for values in self._queue] == [3, 2])
+
+        self.assertTrue(self._queue.pop() == {"id": 3})
+        self.assertTrue(self._queue.pop() == {"id": 2})
+        self.assertTrue(self._queue.is_empty())
+        self.assertTrue(self._queue.peek() is None)
+
     def setUp(self):
         super().setUp(BidQueue)
 
@@ -239,5 +599,36 @@ class TestAskQueue(QueueTest):
         self.assertTrue(self._queue.pop() == "input 2")
         self.assertTrue(self._queue.pop() == "input 1")
 
+    def test_2(self):
+        # many cancels leave the queue consistent
+        ids = [self._queue.append(i % 10, {"id": i}) for i in range(1000)]
+
+        for order_id in ids[:990]:
+            self._queue.cancel(order_id)
+
+        self.assertTrue(len(self._queue) == 10)
+        self.assertTrue([values["id"] for values in self._queue] ==
+                        [999, 998, 997, 996, 995, 994, 993, 992, 991, 990])
+
+        # an explicit order id must be unique
+        self._queue.append(1, {"id": -1}, order_id="a")
+        self.assertRaises(Exception, self._queue.append, 1, {}, order_id="a")
+
+    def test_3(self):
+        # generated order ids never collide with explicit ones
+        self._queue.append(1, {"id": 1}, order_id=0)
+        self._queue.append(1, {"id": 2}, order_id=1)
+        generated = self._queue.append(2, {"id": 3})
+        self._queue.append(1, {"id": 4}, order_id=2)
+        self.assertTrue(len(self._queue) == 4)
+        self.assertTrue(self._queue.cancel(generated) == {"id": 3})
+
+        # repeated price amends do not grow the heap without bound
+        for i in range(1000):
+            self._queue.amend(0, price=i % 7)
+
+        self.assertTrue(len(self._queue._items) <= 2 * len(self._queue) + 33)
+        self.assertTrue(self._queue.peek() == {"id": 1})
+
     def setUp(self):
         super().setUp(AskQueue)
@@ -0,0 +1,24 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TicksTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def path(self, name):
+        return os.path.join(self._dir, name)
+
+    def write_csv(self, name, rows):
+        with open(self.path(name), "w") as f:
+            f.write("unix_ts_ns,market_id,price,liquidity\n")
+
+            for row in rows:
+                f.write(",".join(str(x) for x in row) + "\n")
+
+        return self.path(name)
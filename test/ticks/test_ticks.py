@@ -0,0 +1,125 @@
+from .mock_environment import TicksTest
+
+import pickle
+
+import numpy as np
+
+from dyno.ticks import TickFile, TICK_DTYPE, BID, ASK
+from dyno.ticks import convert_csv, write_ticks
+from dyno.ticks import MergedEvents
+from dyno.strategy import DataStrategy
+from dyno.helpers import all_cryptocurrency_exchanges
+
+
+class TestTickFile(TicksTest):
+    def test_1(self):
+        bids = self.write_csv("bids.csv", [(1, 137, "99.5", "2"),
+                                           (3, 137, "99.0", "1.5")])
+        asks = self.write_csv("asks.csv", [(1, 137, "100.5", "3"),
+                                           (2, 137, "100.0", "0.5")])
+
+        n = convert_csv(self.path("ticks"), bids, asks, "COINBASE.SPOT")
+        self.assertTrue(n == 4)
+
+        ticks = TickFile(self.path("ticks"))
+        self.assertTrue(len(ticks) == 4)
+        self.assertTrue(ticks.get_exchange_names() == ["COINBASE.SPOT"])
+
+        # time order, bids first when timestamps are equal
+        events = list(ticks)
+        self.assertTrue([(name, ts) for name, ts, _ in events] ==
+                        [("best_bid", 1), ("best_ask", 1),
+                         ("best_ask", 2), ("best_bid", 3)])
+        self.assertTrue(events[0][2] == {
+            "exchange_name": "COINBASE.SPOT",
+            "market_id": 137,
+            "price": 99.5,
+            "liquidity": 2.0
+        })
+
+        # files can be read more than once
+        self.assertTrue(list(ticks) == events)
+
+        # pickled by path e.g. to send to worker processes
+        self.assertTrue(list(pickle.loads(pickle.dumps(ticks))) == events)
+
+    def test_2(self):
+        n = 1000
+        rng = np.random.default_rng(3)
+
+        ticks = np.zeros(n, dtype=TICK_DTYPE)
+        ticks["unix_ts_ns"] = np.arange(n)
+        ticks["market_id"] = 1
+        ticks["exchange_id"] = np.repeat([0, 1, 0], [300, 300, 400])
+        ticks["side"] = rng.choice([BID, ASK], n)
+        ticks["price"] = 100 + rng.normal(0, 1, n)
+        ticks["liquidity"] = rng.uniform(0.1, 5, n)
+
+        names = ["COINBASE.SPOT", "KRAKEN.SPOT"]
+        write_ticks(self.path("ticks"), names, ticks)
+        tick_file = TickFile(self.path("ticks"), chunk_size=256)
+
+        # blocks only hold one exchange's ticks
+        blocks = list(tick_file.blocks())
+        self.assertTrue(sum(len(values["price"]) for _, _, values in blocks) == n)
+        for _, _, values in blocks:
+            exchange_ids = ticks["exchange_id"][values["unix_ts_ns"]]
+            self.assertTrue(np.all(exchange_ids ==
+                                   names.index(values["exchange_name"])))
+
+        # per event and block replay give the same mid market prices
+        scalar = DataStrategy(all_cryptocurrency_exchanges({"GBP": 1}))
+        expected = [values["mid_market_price"]
+                    for name, _, values in scalar(list(tick_file))
+                    if name == "mid_market_price"]
+
+        block = DataStrategy(all_cryptocurrency_exchanges({"GBP": 1}))
+        mids = [mid for _, _, values in block(blocks)
+                for mid in values["mid_market_price"]
+                if not np.isnan(mid)]
+
+        self.assertTrue(np.array_equal(mids, expected))
+
+    def test_3(self):
+        # empty files and files that are not tick files
+        write_ticks(self.path("empty"), [], np.empty(0, dtype=TICK_DTYPE))
+        self.assertTrue(list(TickFile(self.path("empty"))) == [])
+
+        with open(self.path("other"), "wb") as f:
+            f.write(b"unix_ts_ns,market_id,price,liquidity\n")
+
+        self.assertRaises(Exception, TickFile, self.path("other"))
+
+
+class TestMergedEvents(TicksTest):
+    def test_1(self):
+        bids = [("best_bid", ts, {"source": "bids"}) for ts in [1, 2, 2, 5]]
+        asks = [("best_ask", ts, {"source": "asks"}) for ts in [0, 2, 6]]
+
+        merged = MergedEvents(bids, asks, [])
+        events = list(merged)
+
+        # time order, ties broken by source order then by order in the source
+        self.assertTrue([ts for _, ts, _ in events] == [0, 1, 2, 2, 2, 5, 6])
+        self.assertTrue(events[2:5] == [bids[1], bids[2], asks[1]])
+
+        # lazy and re-iterable
+        self.assertFalse(isinstance(iter(merged), list))
+        self.assertTrue(list(merged) == events)
+
+    def test_2(self):
+        ticks = np.zeros(3, dtype=TICK_DTYPE)
+        ticks["unix_ts_ns"] = [1, 3, 5]
+        ticks["side"] = [BID, ASK, BID]
+        ticks["price"] = [99, 101, 98]
+        write_ticks(self.path("kraken"), ["KRAKEN.SPOT"], ticks)
+
+        # tick file paths and iterables can be merged
+        other = [("best_ask", 2, {"exchange_name": "COINBASE.SPOT"}),
+                 ("best_ask", 5, {"exchange_name": "COINBASE.SPOT"})]
+        events = list(MergedEvents(self.path("kraken"), other))
+
+        self.assertTrue([(ts, values["exchange_name"]) for _, ts, values in events] ==
+                        [(1, "KRAKEN.SPOT"), (2, "COINBASE.SPOT"),
+                         (3, "KRAKEN.SPOT"), (5, "KRAKEN.SPOT"),
+                         (5, "COINBASE.SPOT")])
@@ -0,0 +1,77 @@
+from .mock_environment import VenuesTest
+
+from dyno import venues
+from dyno.exchange import Binance, Kraken, TieredFeeSchedule
+from dyno.exchange import venue_fee_schedule
+from dyno.helpers import all_cryptocurrency_exchanges
+
+
+class TestVenues(VenuesTest):
+    def test_1(self):
+        config = venues.get_venue("Binance")
+
+        # configs are loaded once and cannot be changed
+        self.assertTrue(config is venues.get_venue("Binance"))
+        self.assertRaises(AttributeError, setattr, config, "maker_pct", 0)
+        with self.assertRaises(TypeError):
+            config.size_limits["ETH"] = {}
+
+        with self.assertRaises(TypeError):
+            config.size_limits["BTC"]["GBP"]["minimum"] = 0
+
+        # unknown venue
+        self.assertRaises(Exception, venues.get_venue, "Unknown")
+
+    def test_2(self):
+        spec = {
+            "defaults": venues.VENUE_SPEC["defaults"],
+            "venues": {
+                "Tiered": {
+                    "fee_tiers": [(0, 0.001, 0.002), (1000, 0.0005, 0.001)]
+                },
+                "Specified": {
+                    "pairs": {
+                        "BTC": {
+                            "USD": {
+                                "minimum": 10,
+                                "maximum": 1000,
+                                "tick_size": 0.5,
+                                "lot_size": 0.0001
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        # tick and lot sizes come from a venue's own pairs
+        limits = venues.load_venues(spec)["Specified"].size_limits["BTC"]["USD"]
+        self.assertTrue(limits["tick_size"] == 0.5 and limits["lot_size"] == 0.0001)
+
+        config = venues.load_venues(spec)["Tiered"]
+
+        # tiered fee schedules have state so they are not shared
+        fees = venue_fee_schedule(config)
+        self.assertTrue(isinstance(fees, TieredFeeSchedule))
+        self.assertTrue(fees is not venue_fee_schedule(config))
+
+    def test_3(self):
+        initial_balances = {"GBP": 100, "BTC": 1}
+        exchanges = all_cryptocurrency_exchanges(initial_balances)
+
+        # exchanges of the same venue share config but not balances
+        binance_spot = exchanges["BINANCE.SPOT"]
+        binance_future = exchanges["BINANCE.FUTURE"]
+        self.assertTrue(binance_spot._size_limits is binance_future._size_limits)
+        self.assertTrue(binance_spot._fee_schedule is binance_future._fee_schedule)
+
+        binance_spot.sub_from_balance("GBP", 50)
+        self.assertTrue(binance_future.get_balance("GBP") == 100)
+        self.assertTrue(initial_balances["GBP"] == 100)
+
+        # pair limits, tick and lot sizes
+        kraken = Kraken(initial_balances)
+        self.assertTrue(kraken.get_min_trade_size("BTC", "USD") == 25)
+        self.assertTrue(kraken.get_tick_size("BTC", "USD") is None)
+        self.assertTrue(kraken.get_lot_size("BTC", "USD") is None)
+        self.assertTrue(str(Binance(initial_balances)) == "Binance")